@@ -8,18 +8,21 @@
 
 import os, sys, re
 from optparse import OptionParser
-import matplotlib
-# If you want to use a different backend, replace Agg with
-# Cairo, PS, SVG, GD, Paint etc.
-# Agg stands for "antigrain rendering" and produces PNG files
-matplotlib.use('Agg')
 
-from pylab import *
+def pyplot():
+    """
+    Return the matplotlib.pyplot module, importing it on the first call.
 
-##**Phillip Kent** 2014-12-10: Commented out 
-# Avoid name collisions with min and max functions from numarray module
-##min = __builtins__.min
-##max = __builtins__.max
+    Matplotlib takes up to a few seconds to import, so it is not imported
+    until a sparkline is plotted.
+    """
+    import matplotlib
+    # If you want to use a different backend, replace Agg with
+    # Cairo, PS, SVG, GD, Paint etc.
+    # Agg stands for "antigrain rendering" and produces PNG files
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    return matplotlib.pyplot
 
 class Sparkplot:
     """
@@ -136,6 +139,7 @@ class Sparkplot:
         Plot sparkline graphic by using various matplotlib functions.
         """
 
+        plt = pyplot()
         if len(self.data) == 0:
             self.data = self.get_input_data()
         num_points = len(self.data)
@@ -188,11 +192,11 @@ class Sparkplot:
             print "Axes position:", axes_position
 
         # Create a figure with the given width, height and dpi
-        fig = figure(figsize=(fig_width, fig_height), dpi=150)
+        fig = plt.figure(figsize=(fig_width, fig_height), dpi=150)
 
         if self.type.startswith('line'):
             # For 'line' plots, simply plot the line
-            plot(range(num_points), self.data, color='gray')
+            plt.plot(range(num_points), self.data, color='gray')
         elif self.type.startswith('bar'):
             # For 'bars' plots, simulate bars by plotting vertical lines
             for i in range(num_points):
@@ -200,41 +204,41 @@ class Sparkplot:
                     color = 'r'
                 else:
                     color = 'b' # Use color = '#003163' for a dark blue
-                plot((i, i), (0, self.data[i]), color=color, linewidth=1.25)
+                plt.plot((i, i), (0, self.data[i]), color=color, linewidth=1.25)
 
 
         if self.draw_hspan:
-            axhspan(ymin=self.hspan_min, ymax=self.hspan_max, xmin=0, xmax=1, linewidth=0.5, edgecolor='gray', facecolor='gray')
+            plt.axhspan(ymin=self.hspan_min, ymax=self.hspan_max, xmin=0, xmax=1, linewidth=0.5, edgecolor='gray', facecolor='gray')
 
         if self.type == 'line':
             # Plotting the first, last, min and max data points in a different color only makes sense for 'line' plots
             if self.plot_first:
-                plot([0,0], [self.data[0], self.data[0]], 'r.')
+                plt.plot([0,0], [self.data[0], self.data[0]], 'r.')
             if self.plot_last:
-                plot([num_points-1, num_points-1], [self.data[num_points-1], self.data[num_points-1]], 'r.')
+                plt.plot([num_points-1, num_points-1], [self.data[num_points-1], self.data[num_points-1]], 'r.')
             if self.plot_min:
-                plot([min_index, min_index], [self.data[min_index], self.data[min_index]], 'b.')
+                plt.plot([min_index, min_index], [self.data[min_index], self.data[min_index]], 'b.')
             if self.plot_max:
-                plot([max_index, max_index], [self.data[max_index], self.data[max_index]], 'b.')
+                plt.plot([max_index, max_index], [self.data[max_index], self.data[max_index]], 'b.')
 
         if self.label_first_value:
-            text(0, self.data[0], self.format_text(self.data[0]), size=6)
+            plt.text(0, self.data[0], self.format_text(self.data[0]), size=6)
         if self.label_last_value:
-            text(num_points-1, self.data[num_points-1], self.format_text(self.data[num_points-1]), size=6)
+            plt.text(num_points-1, self.data[num_points-1], self.format_text(self.data[num_points-1]), size=6)
         if self.label_min:
-            text(min_index*1.05, self.data[min_index]*1.05, self.format_text(min_data), size=8)
+            plt.text(min_index*1.05, self.data[min_index]*1.05, self.format_text(min_data), size=8)
         if self.label_max:
-            text(max_index*1.05, self.data[max_index]*1.05, self.format_text(max_data), size=8)
+            plt.text(max_index*1.05, self.data[max_index]*1.05, self.format_text(max_data), size=8)
 
         # IMPORTANT: commands affecting the axes need to be issued AFTER the plot commands
 
         # Set the axis limits instead of letting them be computed automatically by matplotlib
         # We leave some space around the data points so that the plot points for
         # the first/last/min/max points are displayed
-        axis([-1, num_points, min_data - (abs(min_data)*0.1), max_data + (abs(max_data)*0.1) ])                
+        plt.axis([-1, num_points, min_data - (abs(min_data)*0.1), max_data + (abs(max_data)*0.1) ])                
 
         # Turn off all axis display elements (frame, ticks, tick labels)
-        axis('off')
+        plt.axis('off')
         # Note that these elements can also be turned off via the following calls,
         # but I had problems setting the axis limits AND settings the ticks to empty lists
         #a.set_xticks([])
@@ -242,7 +246,7 @@ class Sparkplot:
         #a.set_frame_on(False)
 
         # Set the position for the current axis so that the data labels fit in the figure
-        a = gca()
+        a = plt.gca()
         a.set_position(axes_position)
 
         if self.transparency:
@@ -253,7 +257,7 @@ class Sparkplot:
         self.generate_output_file()
 
         # Delete the fig 
-        close()
+        plt.close()
 
     def generate_output_file(self):
         """
@@ -265,7 +269,7 @@ class Sparkplot:
             self.output_file = os.path.splitext(self.input_file)[0]
         if self.verbose:
             print "Generating output file " + self.output_file + '.png'
-        savefig(self.output_file)
+        pyplot().savefig(self.output_file)
 
     def format_text(self, data):
         """
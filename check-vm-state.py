@@ -17,20 +17,37 @@
 #   (2) Put this file and the file vdc_api_call.py in any location
 #   (3) You can run this file using the command 'python check-vm-state.py'
 #   (4) Or, run the command 'chmod +x check-vm-state.py' and then you can run with './check-vm-state.py'
+#   (5) Use the option '-c FILE' to read the configuration from another file than ~/.vdcapi
+#   (6) With the option '-d', only the VMs which have been added or removed, or have changed state,
+#       since the last run with '-d' are printed (see vdc_inventory.py)
 
 # EVERYTHING IN THE FOLLOWING SECTION IS 'BOILERPLATE' CODE (ALWAYS THE SAME) TO ESTABLISH 
 # THE API CONNECTION.....................................................................
  
 from __future__ import print_function
 import vdc_api_call as vdc
+import vdc_agent
+import vdc_inventory
+import argparse
 import getpass
 import json
 import os
 import datetime
+import itertools
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default=os.path.join(os.path.expanduser('~'), '.vdcapi'),
+                        help="path/name of the config file to be used for the API URL and API keys (default is ~/.vdcapi)")
+    parser.add_argument("-d", "--changes", action='store_true',
+                        help="print only the changes of the VMs since the last run with -d (default: print all of the VMs)")
+    parser.add_argument("--inventory", default=os.path.join(os.path.expanduser('~'), '.vdcapi_inventory.json'),
+                        help="path/name of the file which keeps the VM list between runs with -d (default is ~/.vdcapi_inventory.json)")
+    showChanges = parser.parse_args().changes
+    inventoryFile = parser.parse_args().inventory
+
     cloudinit_scripts_dir = 'cloudinit-scripts'
-    config_file = os.path.join(os.path.expanduser('~'), '.vdcapi')
+    config_file = parser.parse_args().config
     if os.path.isfile(config_file):
         with open(config_file) as fh:
             data = fh.read()
@@ -49,8 +66,8 @@ if __name__ == '__main__':
         apiKey = raw_input()
         secret = getpass.getpass(prompt='API secret:')
 
-    # Create the api access object
-    api = vdc.VDCApiCall(api_url, apiKey, secret)
+    # Create the api access object (which makes its calls through the VDC agent if one is running - see vdc_agent.py)
+    api = vdc_agent.connect(api_url, apiKey, secret)
 
 # END OF THE BOILERPLATE SECTION
 
@@ -61,17 +78,50 @@ if __name__ == '__main__':
 
     checkTime = datetime.datetime.utcnow() # get the current time (UTC = GMT)
 
-    result = api.listVirtualMachines(request)
-
-    print("\nChecking states of %d VMs in the account '%s'\nat %s:" 
-        % (result['count'],result['virtualmachine'][1]['account'],checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))    
+    if showChanges:
+        # The VM list is compared with the list kept from the last run, and only the changes are printed
+        inventory = vdc_inventory.InventorySync(api, request, path=inventoryFile)
+        lastCheck = inventory.last_poll
+        changes = inventory.poll()
+        if lastCheck is None:
+            print("\nFirst check of the %d VMs in the account at %s (all VMs are new):"
+                % (len(inventory),checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))
+        else:
+            print("\n%d changes of the %d VMs in the account since %s\nat %s:"
+                % (len(changes),len(inventory),
+                   datetime.datetime.utcfromtimestamp(lastCheck).strftime("%Y-%m-%d %H:%M:%S UTC"),
+                   checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))
+        for change in changes:
+            vm = change.vm
+            was = " (was %s)" % change.old['state'] if change.kind == vdc_inventory.STATE else ""
+            if change.kind == vdc_inventory.REMOVED:
+               print("  \x1b[35m %s (removed)\x1b[0m" % vm['name'])
+            elif change.kind == vdc_inventory.NICS:
+               print("  \x1b[36m %s (NICs changed)\x1b[0m" % vm['name'])
+            elif vm['state'] == 'Running':
+               print("  \x1b[32m %s%s\x1b[0m" % (vm['name'],was))
+            elif vm['state'] == 'Stopped':
+               print("  \x1b[31m %s (%s)%s\x1b[0m" % (vm['name'],vm['state'],was))
+            else:
+               print("  \x1b[36m %s (%s)%s\x1b[0m" % (vm['name'],vm['state'],was))
+    else:
+        # The VMs are fetched one page at a time (so memory use stays small for accounts with many VMs);
+        # the total count is known once the first page has arrived
+        vmIterator = api.iter_listVirtualMachines(request, pagesize=500, fields=['name', 'state', 'account'])
+        firstVm = next(vmIterator, None)
 
-    for vm in result['virtualmachine']:
-        if vm['state'] == 'Running':
-           print("  \x1b[32m %s\x1b[0m" % vm['name'])
-        elif vm['state'] == 'Stopped':
-           print("  \x1b[31m %s (%s)\x1b[0m" % (vm['name'],vm['state']))
+        if firstVm is None:
+            print("\nNo VMs found in the account at %s" % checkTime.strftime("%Y-%m-%d %H:%M:%S UTC"))
         else:
-           print("  \x1b[36m %s (%s)\x1b[0m" % (vm['name'],vm['state']))
+            print("\nChecking states of %d VMs in the account '%s'\nat %s:" 
+                % (vmIterator.count,firstVm['account'],checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))    
+
+            for vm in itertools.chain([firstVm], vmIterator):
+                if vm['state'] == 'Running':
+                   print("  \x1b[32m %s\x1b[0m" % vm['name'])
+                elif vm['state'] == 'Stopped':
+                   print("  \x1b[31m %s (%s)\x1b[0m" % (vm['name'],vm['state']))
+                else:
+                   print("  \x1b[36m %s (%s)\x1b[0m" % (vm['name'],vm['state']))
 
     print("--VM state check complete--")
@@ -21,7 +21,6 @@ import sys
 import pprint
 import argparse
 import re
-import numpy as np
 #import time
 
 # STEP: Parse the command line arguments
@@ -54,6 +53,8 @@ for z in zonesDict:
       if not outputSummaryOnly:
          print("%s, %s, %s, %s, %s" % (re.sub('[ ()]','', zonesDict[z]['name']), "NA", "NA", "NA", "NA"))
 
+# (numpy is imported here, because it is slow to import and is not needed for the '-h' option)
+import numpy as np
 data = np.array(deployTimeList)
 if not outputSummaryOnly:
    print("\nSUMMARY STATISTICS:\nN, MIN, MAX, RANGE, MEAN, MEDIAN")
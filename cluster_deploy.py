@@ -20,28 +20,20 @@
 from __future__ import print_function
 from collections import OrderedDict
 from copy import deepcopy
-import base64
 import vdc_api_call as vdc
+import vdc_trace
+import vdc_agent
+import vdc_catalog
 import getpass
 import json
 import os
 import sys
-import pprint
 import time
 import datetime
-import dateutil.parser
-import pytz
-import textwrap
 import argparse
-import urllib
-import urllib2
-import hashlib
-import hmac
-import ipaddress
-from netaddr import *
 import re
 import random
-import numpy as np
+# (netaddr, dateutil, pytz and numpy are slow to import, so they are imported in the steps which use them)
 
 # STEP: Parse the command line arguments
 parser = argparse.ArgumentParser()
@@ -62,6 +54,8 @@ parser.add_argument("-q", "--publicport", type=int, default=62200, help="public
 parser.add_argument("-k", "--keypair", default='', help="keypair name which must exist for all VDC regions (default = empty string)")
 parser.add_argument("-u", "--userdatafile", default='', help="filename for userdata to use in deployment")
 parser.add_argument("-g", "--globaltimeout", default=900, help="maximum time in seconds to wait for VM deployments to complete (default: 900)")
+parser.add_argument("--refresh", action='store_true', help="refresh the catalog of zones, templates, service offerings and networks from the API (default: use the catalog file ~/.vdcapi_catalog.db while it is up to date)")
+parser.add_argument("--trace", default='', help="name of output file to receive a trace of the program run in Chrome trace-event format (default: no trace)")
 config_file = parser.parse_args().config
 dcgID = parser.parse_args().dcgid
 templateName = parser.parse_args().templatename
@@ -83,6 +77,8 @@ accessMode = parser.parse_args().accessmode
 keypairName = parser.parse_args().keypair
 userdataFilename = parser.parse_args().userdatafile
 globalTimeout = int(parser.parse_args().globaltimeout)
+refreshCatalog = parser.parse_args().refresh
+traceFile = parser.parse_args().trace
 
 # Check if dcgid was input
 if dcgID==-1:
@@ -110,8 +106,17 @@ else:
     apiKey = raw_input()
     secret = getpass.getpass(prompt='API secret:')
 
-# STEP: Create the API access object
-api = vdc.VDCApiCall(api_url, apiKey, secret)
+# STEP: Create the API access object (with a cache for repeated list calls), and an async object for making
+# independent API calls concurrently
+# (if a trace file is set, the API calls and the phases of the program are recorded in a trace;
+# the calls are made through the VDC agent if one is running - see vdc_agent.py)
+if traceFile:
+   tracer = vdc_trace.Tracer(traceFile)
+else:
+   tracer = vdc_trace.NullTracer()
+api = vdc_agent.connect(api_url, apiKey, secret, cache=vdc.ResponseCache(ttl=300), rate_limit=True,
+                        tracer=tracer if traceFile else None)
+apiAsync = vdc.AsyncVDCApiCall.from_api(api, max_concurrency=8)
 
 # Check if dcgID is a valid DCG - otherwise exit
 dcgConfigTest = api.listDirectConnectGroups({'id':dcgID})['directconnectgroups']
@@ -123,6 +128,12 @@ else:
     
 vdcRegions = ['Europe', 'USA', 'Asia']
 
+# STEP: Open the catalog of zones, templates, service offerings and networks
+# (the catalog is kept in a file and only listed again from the API when it is out of date, or with --refresh)
+catalog = vdc_catalog.Catalog(api, regions=vdcRegions)
+if refreshCatalog:
+   catalog.refresh()
+
 # STEP: Pre-checks for usable inputs for:
 #     keypair (defined in all required regions)
 #     templateName (defined in all required zones)
@@ -130,17 +141,26 @@ vdcRegions = ['Europe', 'USA', 'Asia']
 #     
 # ... TO BE DONE ...
 #
+tracer.phase("Pre-checks for usable inputs")
 
 # STEP: Construct dict with zones information
+tracer.phase("Construct dict with zones information")
+# (the zones come from the catalog; a region which cannot be reached when the catalog is refreshed is
+# reported and left out, and the deployment goes ahead in the zones of the other regions)
 allZonesDict = {}
-for r in vdcRegions:
-   zlist = api.listZones({'region':r})['zone']
-   for z in zlist:
-      name1 = z['name']
-      allZonesDict[name1] = {}
-      allZonesDict[name1]['name'] = z['name']
-      allZonesDict[name1]['region'] = r
-      allZonesDict[name1]['id'] = z['id']
+zonesList = catalog.zones()
+for (kind, r), e in catalog.errors.items():
+   if kind == 'zones':
+      print("WARNING: Zones of region %s could not be listed: %s" % (r, e))
+for z in zonesList:
+   name1 = z['name']
+   allZonesDict[name1] = {}
+   allZonesDict[name1]['name'] = z['name']
+   allZonesDict[name1]['region'] = z['region']
+   allZonesDict[name1]['id'] = z['id']
+if allZonesDict == {}:
+   print("ERROR: No zones were found in any of the regions")
+   sys.exit("FATAL: Program terminating")
 if allZonesDeploy:
    zonesDict = deepcopy(allZonesDict)
    if primaryZone != "DEFAULT":
@@ -151,6 +171,10 @@ if allZonesDeploy:
       primaryZone = pz
 else:
    zonesDict = {}
+   missingZones = [z for z in zonesListInput if z not in allZonesDict]
+   if missingZones:
+      print("ERROR: These zones were not found in the available regions: %s" % ', '.join(missingZones))
+      sys.exit("FATAL: Program terminating")
    for z in zonesListInput:
       zonesDict[z] = deepcopy(allZonesDict[z])
    pz = zonesListInput[0]
@@ -158,11 +182,14 @@ else:
    primaryZone = pz
 
 # STEP: Check for any existing virtual machines using the cluster name in the requested zones - if any exist then exit
+tracer.phase("Check for any existing virtual machines using the cluster name")
 existingVmNames = {}
 existingVmConflict = False
 print("CHECKING for cluster name already in use for an existing VM in a deployment zone")
+vmCheckFutures = dict([(z, apiAsync.listVirtualMachines({'region':zonesDict[z]['region'],'zoneid':zonesDict[z]['id'],'name':clusterName}))
+                       for z in zonesDict])
 for z in zonesDict:
-   resultVmCheck = api.listVirtualMachines({'region':zonesDict[z]['region'],'zoneid':zonesDict[z]['id'],'name':clusterName})
+   resultVmCheck = vmCheckFutures[z].result()
    if resultVmCheck != {}:
       existingVmConflict = True
       for v in resultVmCheck['virtualmachine']:
@@ -176,9 +203,10 @@ else:
       
 # STEP: Check and if required create private networks in the zones
 # If there is more than one private DC network in the zone and the DCG, then the first one is selected
+tracer.phase("Check and if required create private networks in the zones")
 for z in zonesDict:
    zonesDict[z]['clustername'] = clusterName
-   privateNetworksInZone = api.listNetworks({'subtype':'privatedirectconnect','zoneid':zonesDict[z]['id'],'region':zonesDict[z]['region']})['network']
+   privateNetworksInZone = catalog.networks(zonesDict[z]['region'], zoneid=zonesDict[z]['id'], subtype='privatedirectconnect')
    if privateNetworksInZone != []:
       privateNetworksInZoneAndDCG = [netdict for netdict in privateNetworksInZone if netdict['dcgid']==dcgID]
       if privateNetworksInZoneAndDCG != []:
@@ -202,6 +230,7 @@ else:
       print("   %s" % (zonesDict[z]['name']))
    raw_input("Press any key to continue with private network creation...")
    # Private network creation...
+   from netaddr import IPSet
    takenIP = []
    for z in set(zonesDict.keys()) - set(zmissing):
       takenIP = takenIP + [zonesDict[z]['privatecidr']]
@@ -231,11 +260,13 @@ else:
          sys.exit("FATAL: Program terminating")
       print("Created network %d: id:%s, CIDR:%s, Gateway:%s" % (networkCreationNumber+1,networkID,networkCIDR,networkGateway))
       networkCreationNumber = networkCreationNumber + 1
+   catalog.invalidate('networks')
    print("Finished the creation of private networks... continuing to next step")     
     
 # STEP: Check and if required create internet gateway networks in the zones
+tracer.phase("Check and if required create internet gateway networks in the zones")
 for z in zonesDict:
-   internetNetworksInZone = api.listNetworks({'subtype':'internetgateway','zoneid':zonesDict[z]['id'],'region':zonesDict[z]['region']})['network']
+   internetNetworksInZone = catalog.networks(zonesDict[z]['region'], zoneid=zonesDict[z]['id'], subtype='internetgateway')
    if internetNetworksInZone != []:
       zonesDict[z]['internetnetworkid'] = internetNetworksInZone[0]['id']
       zonesDict[z]['internetcidr'] = internetNetworksInZone[0]['cidr']
@@ -265,6 +296,7 @@ else:
       print("   %s" % (zonesDict[z]['name']))
    raw_input("Press any key to continue with Internet Gateway network creation...")
    # Internet Gateway network creation...
+   from netaddr import IPSet
    networkCreationNumber = 0
    for z in zmissingcreate:
       takenIP = []
@@ -294,25 +326,29 @@ else:
          sys.exit("FATAL: Program terminating")
       print("Created network %d: id:%s, CIDR:%s, Gateway:%s" % (networkCreationNumber+1,networkID,networkCIDR,networkGateway))
       networkCreationNumber = networkCreationNumber + 1
+   catalog.invalidate('networks')
    print("Finished the creation of Internet Gateway networks... continuing to next step")
     
 # STEP: Load and prepare userdata
 # ... TO BE DONE ...
+tracer.phase("Load and prepare userdata")
     
 # STEP: Check and record templateid for each zone based on templateName
 # Pre-check above tests that a template with templateName exists in all required zones
+tracer.phase("Check and record templateid for each zone based on templateName")
 for z in zonesDict:
    try:
-      zonesDict[z]['templateid'] = api.listTemplates({'region':zonesDict[z]['region'],'templatefilter':'executable', 'name':templateName, 'zoneid':zonesDict[z]['id']})['template'][0]['id']
+      zonesDict[z]['templateid'] = catalog.templates(zonesDict[z]['region'], templateName, zoneid=zonesDict[z]['id'])[0]['id']
    except:
       print("ERROR: Failure occurred in API call listTemplates for zone %s" % zonesDict[z]['name'])
       sys.exit("FATAL: Program terminating")
     
 # STEP: Check and record serviceofferingid for each zone based on serviceofferingName (this ID should be same for all zones within a region)
 # Pre-check above tests that a serviceofferingName exists in all required regions
+tracer.phase("Check and record serviceofferingid for each zone based on serviceofferingName")
 for z in zonesDict:
    try:
-      zonesDict[z]['serviceofferingid'] = api.listServiceOfferings({'region':zonesDict[z]['region'], 'name':serviceofferingName})['serviceoffering'][0]['id']
+      zonesDict[z]['serviceofferingid'] = catalog.service_offerings(zonesDict[z]['region'], serviceofferingName)[0]['id']
    except:
       print("ERROR: Failure occurred in API call listServiceOfferings for zone %s" % zonesDict[z]['name'])
       sys.exit("FATAL: Program terminating")
@@ -320,9 +356,11 @@ for z in zonesDict:
 # STEP: Check that all private networks are provisioned (i.e. ready to use) - otherwise pause until ready
 ## TO BE DONE!
 
+tracer.phase("Wait for confirmation to deploy")
 raw_input("READY TO DEPLOY VIRTUAL MACHINES. Press any key to continue...")
 
 # STEP: Deploy virtual machines in zones
+tracer.phase("Deploy virtual machines in zones")
 for z in zonesDict:
    zonesDict[z]['deploycomplete'] = False
    vmName = "VM-" + re.sub('[ ()]','', zonesDict[z]['name']) + "-" + re.sub('[ ()]','', clusterName)
@@ -352,69 +390,65 @@ for z in zonesDict:
          sys.exit("FATAL: Program terminating. JSON file is being output.")
              
 # STEP: Monitor and wait for VM deploys to complete
-checkDelay = 2
-displayProgress = True
-deployAllComplete = False
-countdown = len(zonesDict)
-deployStartTime = datetime.datetime.utcnow()
-while not deployAllComplete:
-   for z in zonesDict:
-      if zonesDict[z]['deployjobid'] != 'MISSING' and not zonesDict[z]['deploycomplete']:
-         try:
-            result = api.queryAsyncJobResult({'region':zonesDict[z]['region'], 'jobid': zonesDict[z]['deployjobid']})
-         except KeyError:
-            pass
-         if 'jobresult' in result and 'virtualmachine' in result['jobresult']:
-            # Deployment finished and it was successful ('virtualmachine' key exists) 
-            countdown = countdown - 1
-            zonesDict[z]['deploycomplete'] = True
-            zonesDict[z]['created'] = result['jobresult']['virtualmachine']['created']    
-            zonesDict[z]['deploytime'] = (datetime.datetime.utcnow().replace(tzinfo=pytz.utc) 
-                                            - dateutil.parser.parse(zonesDict[z]['created'])).seconds
-            vmNics = result['jobresult']['virtualmachine']['nic']
-            zonesDict[z]['privateipaddress'] = [net for net in vmNics if net['networkid']==zonesDict[z]['privatenetworkid']][0]['ipaddress']
-            ##if zonesDict[z]['internetnetworkid'] != 'MISSING':
-            if accessMode == 'single' and z != primaryZone:
-               zonesDict[z]['internetipaddress'] = 'MISSING'
-               zonesDict[z]['publicipaddress'] = 'MISSING'        
-            else:
-               zonesDict[z]['internetipaddress'] = [net for net in vmNics if net['networkid']==zonesDict[z]['internetnetworkid']][0]['ipaddress']
-               ipdata = api.listPublicIpAddresses({'region':zonesDict[z]['region'], 'associatednetworkid':zonesDict[z]['internetnetworkid']})['publicipaddress'][0]
-               zonesDict[z]['publicipaddress'] = ipdata['ipaddress']
-               zonesDict[z]['publicipaddressid'] = ipdata['id']
-            zonesDict[z]['virtualmachineid'] = result['jobresult']['virtualmachine']['id']
-            zonesDict[z]['virtualmachinename'] = result['jobresult']['virtualmachine']['name']
-            if keypairName == '':
-               zonesDict[z]['keypair'] = None 
-            else:
-               zonesDict[z]['keypair'] = result['jobresult']['virtualmachine']['keypair']
-            zonesDict[z]['password'] = result['jobresult']['virtualmachine']['password']
-            print('')
-            print("VM deploy completed in zone %s. %d zones left to complete." % (zonesDict[z]['name'],countdown))
-         if 'jobresult' in result and 'virtualmachine' not in result['jobresult']:
-            # Deployment finished but with failure ('virtualmachine' key doesn't exist) 
-            countdown = countdown - 1
-            zonesDict[z]['deploycomplete'] = True
-            zonesDict[z]['internetipaddress'] = 'MISSING'
-            print('')
-            print("ERROR: VM deployment FAILED in zone %s. %d zones left to complete." % (zonesDict[z]['name'],countdown))
-      elif zonesDict[z]['deployjobid'] == 'MISSING':
-         countdown = countdown - 1
-         zonesDict[z]['deploycomplete'] = True
-   # check if time in deployment loop exceeds value of globalTimeout
-   if (datetime.datetime.utcnow() - deployStartTime).seconds > globalTimeout:
-      deployAllComplete = True
-      print("\nALERT: Global timeout of %d seconds for VM deployment has been exceeded. Quitting deployment loop and continuing to next step..." % (globalTimeout))
-   if countdown == 0:
-      deployAllComplete = True
-      print("Finished the deployment of virtual machines. Continuing to next step...")
+# (the deploy jobs are watched by the job watcher of the API object, which checks all of the pending jobs
+# together with one API call per region; each job gives a future, and the futures are handled as they finish)
+tracer.phase("Monitor and wait for VM deploys to complete")
+deployFutures = {}
+for z in zonesDict:
+   if zonesDict[z]['deployjobid'] == 'MISSING':
+      zonesDict[z]['deploycomplete'] = True
    else:
-      if displayProgress:
-         print('.', end='')
-         sys.stdout.flush()
-      time.sleep(checkDelay)        
+      deployFutures[api.watch_job(zonesDict[z]['deployjobid'], zonesDict[z]['region'], timeout=globalTimeout)] = z
+print("Waiting for %d VM deploys to complete..." % len(deployFutures))
+deployTimeout = False
+zonesLeft = len(deployFutures)
+import dateutil.parser
+import pytz
+for future in apiAsync.as_completed(deployFutures.keys()):
+   z = deployFutures[future]
+   zonesLeft = zonesLeft - 1
+   try:
+      jobResult = future.result()
+   except vdc.VDCJobTimeout:
+      deployTimeout = True
+      continue
+   except vdc.VDCError as e:
+      # Deployment finished but with failure (or its job could not be checked)
+      zonesDict[z]['deploycomplete'] = True
+      zonesDict[z]['internetipaddress'] = 'MISSING'
+      print("ERROR: VM deployment FAILED in zone %s (%s). %d zones left to complete." % (zonesDict[z]['name'],e,zonesLeft))
+      continue
+   # Deployment finished and it was successful
+   zonesDict[z]['deploycomplete'] = True
+   zonesDict[z]['created'] = jobResult['virtualmachine']['created']
+   zonesDict[z]['deploytime'] = (datetime.datetime.utcnow().replace(tzinfo=pytz.utc) 
+                                   - dateutil.parser.parse(zonesDict[z]['created'])).seconds
+   vmNics = jobResult['virtualmachine']['nic']
+   zonesDict[z]['privateipaddress'] = [net for net in vmNics if net['networkid']==zonesDict[z]['privatenetworkid']][0]['ipaddress']
+   ##if zonesDict[z]['internetnetworkid'] != 'MISSING':
+   if accessMode == 'single' and z != primaryZone:
+      zonesDict[z]['internetipaddress'] = 'MISSING'
+      zonesDict[z]['publicipaddress'] = 'MISSING'        
+   else:
+      zonesDict[z]['internetipaddress'] = [net for net in vmNics if net['networkid']==zonesDict[z]['internetnetworkid']][0]['ipaddress']
+      ipdata = api.listPublicIpAddresses({'region':zonesDict[z]['region'], 'associatednetworkid':zonesDict[z]['internetnetworkid']})['publicipaddress'][0]
+      zonesDict[z]['publicipaddress'] = ipdata['ipaddress']
+      zonesDict[z]['publicipaddressid'] = ipdata['id']
+   zonesDict[z]['virtualmachineid'] = jobResult['virtualmachine']['id']
+   zonesDict[z]['virtualmachinename'] = jobResult['virtualmachine']['name']
+   if keypairName == '':
+      zonesDict[z]['keypair'] = None 
+   else:
+      zonesDict[z]['keypair'] = jobResult['virtualmachine']['keypair']
+   zonesDict[z]['password'] = jobResult['virtualmachine']['password']
+   print("VM deploy completed in zone %s. %d zones left to complete." % (zonesDict[z]['name'],zonesLeft))
+if deployTimeout:
+   print("\nALERT: Global timeout of %d seconds for VM deployment has been exceeded. Quitting deployment loop and continuing to next step..." % (globalTimeout))
+else:
+   print("Finished the deployment of virtual machines. Continuing to next step...")
     
 # STEP: Create portforwarding rules
+tracer.phase("Create portforwarding rules")
 for z in zonesDict:
    ##if zonesDict[z]['internetnetworkid'] != 'MISSING':
    if accessMode != 'single' or (z == primaryZone and accessMode == 'single'):
@@ -439,6 +473,7 @@ for z in zonesDict:
 print("Finished the creation of portforwarding rules. Continuing to next step...")
                                                         
 # STEP: Output cluster data in JSON format
+tracer.phase("Output cluster data in JSON format")
 print("Cluster configuration '%s':" % (outfile))
 print(json.dumps(zonesDict))
 with open(outfile, 'w') as outf:
@@ -446,5 +481,6 @@ with open(outfile, 'w') as outf:
 print("Cluster configuration data written to output file. Program terminating.")
 
 # Print summary statistics for VM deploy times
+import numpy as np
 deploydata = [zonesDict[z]['deploytime'] for z in zonesDict if 'deploytime' in zonesDict[z].keys()]
 print("\nDEPLOY TIME SUMMARY STATISTICS:\nN, MIN, MAX, RANGE, MEAN, MEDIAN\n%s, %s, %s, %s, %s, %s" % (len(deploydata), np.nanmin(deploydata), np.nanmax(deploydata), np.ptp(deploydata), np.nanmean(deploydata), np.median(deploydata)))
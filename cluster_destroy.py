@@ -14,6 +14,8 @@
 
 from __future__ import print_function
 import vdc_api_call as vdc
+import vdc_trace
+import vdc_agent
 import getpass
 import json
 import os
@@ -33,11 +35,13 @@ parser.add_argument("-f", "--filename", help="name of input file with the cluste
 parser.add_argument("-x", "--expunge", action='store_true', help="expunge the virtual machines (otherwise they will put into Destroyed state)")
 parser.add_argument("-r", "--rename", action='store_true', help="rename the JSON info file with ending '-deploydata.json'")
 parser.add_argument("-g", "--globaltimeout", default=400, help="maximum time in seconds to wait for the VM destruction to complete (default: 400)")
+parser.add_argument("--trace", default='', help="name of output file to receive a trace of the program run in Chrome trace-event format (default: no trace)")
 config_file = parser.parse_args().config
 datafile = parser.parse_args().filename
 expunge = parser.parse_args().expunge
 rename = parser.parse_args().rename
 globalTimeout = int(parser.parse_args().globaltimeout)
+traceFile = parser.parse_args().trace
     
 # STEP: If config file is found, read its content,
 # else query user for the URL, API key, Secret key
@@ -56,15 +60,23 @@ else:
     secret = getpass.getpass(prompt='API secret:')
 
 # STEP: Create the API access object
-api = vdc.VDCApiCall(api_url, apiKey, secret)
+# (if a trace file is set, the API calls and the phases of the program are recorded in a trace;
+# the calls are made through the VDC agent if one is running - see vdc_agent.py)
+if traceFile:
+   tracer = vdc_trace.Tracer(traceFile)
+else:
+   tracer = vdc_trace.NullTracer()
+api = vdc_agent.connect(api_url, apiKey, secret, tracer=tracer if traceFile else None)
 
 # STEP: Load the cluster data from the JSON file
+tracer.phase("Load the cluster data from the JSON file")
 with open(datafile) as json_file:
    zonesDict = json.load(json_file)
 if rename:
    newJsonFilename = datafile.split(".json")[0] + "-deploydata.json"
 
 # STEP: Check if VM exists (ie. not already deleted) and check VM state
+tracer.phase("Check if VM exists (ie. not already deleted) and check VM state")
 zNotExist = []
 for z in zonesDict:
    if 'virtualmachineid' not in zonesDict[z].keys():
@@ -98,6 +110,7 @@ if set(zonesDict.keys())-set(zNotExist) == set([]):
    sys.exit("FATAL: Program terminating")
            
 # STEP: Confirm destruction of virtual machines
+tracer.phase("Confirm destruction of virtual machines")
 print("These virtual machines are being setup for destruction:")
 for z in set(zonesDict.keys()) - set(zNotExist):
    print("  VM %s in zone %s (state: %s)" % (zonesDict[z]['virtualmachineid'],zonesDict[z]['name'],zonesDict[z]['state']))
@@ -106,6 +119,7 @@ if choice != "d" and choice != "D":
    sys.exit("FATAL: Program terminating")
         
 # STEP: Execute the API calls to destroy the virtual machines
+tracer.phase("Execute the API calls to destroy the virtual machines")
 for z in set(zonesDict.keys()) - set(zNotExist):
    destroyparams = {'region':zonesDict[z]['region'], 'id':zonesDict[z]['virtualmachineid']}
    zonesDict[z]['destroycomplete'] = False
@@ -119,38 +133,36 @@ for z in set(zonesDict.keys()) - set(zNotExist):
       pass
 
 # STEP: Monitor and wait for VM destruction to complete
-checkDelay = 2
-displayProgress = True
-destroyAllComplete = False
-countdown = len(set(zonesDict.keys()) - set(zNotExist))
-destroyStartTime = datetime.datetime.utcnow()
-while not destroyAllComplete:
-   for z in set(zonesDict.keys()) - set(zNotExist):
-      if zonesDict[z]['deploycomplete'] and not zonesDict[z]['destroycomplete']:
-         try:
-            result = api.queryAsyncJobResult({'region':zonesDict[z]['region'], 'jobid': zonesDict[z]['destroyjobid']})
-         except KeyError:
-            pass
-         if 'jobresult' in result:
-            countdown = countdown - 1
-            zonesDict[z]['destroycomplete'] = True
-            print('')
-            print("VM %s destroyed in zone %s. %d zones left to complete." % (zonesDict[z]['virtualmachineid'],zonesDict[z]['name'],countdown))                
-   if countdown == 0:
-      destroyAllComplete = True
-      if rename:
-         print("Renaming json file from %s to %s" % (datafile, newJsonFilename))
-         shutil.move(datafile, newJsonFilename)
-      print("Finished the destruction of virtual machines. Program terminating.")
-   elif (datetime.datetime.utcnow() - destroyStartTime).seconds > globalTimeout:
-      # check if time in the VM destroy loop exceeds value of globalTimeout
-      destroyAllComplete = True
-      print("\nALERT: Global timeout of %d seconds has been exceeded. Exiting. Rerun the program to check status of all VMs in the cluster." % (globalTimeout))
-   else:
-      if displayProgress:
-         print('.', end='')
-         sys.stdout.flush()
-      time.sleep(checkDelay)
-        
-
-
+# (the destroy jobs are watched by the job watcher of the API object, which checks all of the pending jobs
+# together with one API call per region; each job gives a future, and the futures are handled as they finish)
+tracer.phase("Monitor and wait for VM destruction to complete")
+destroyFutures = {}
+for z in set(zonesDict.keys()) - set(zNotExist):
+   if zonesDict[z]['deploycomplete'] and 'destroyjobid' in zonesDict[z]:
+      destroyFutures[api.watch_job(zonesDict[z]['destroyjobid'], zonesDict[z]['region'], timeout=globalTimeout)] = z
+print("Waiting for %d VM destructions to complete..." % len(destroyFutures))
+zonesLeft = len(set(zonesDict.keys()) - set(zNotExist))
+destroyTimeout = False
+for future in vdc.as_completed(destroyFutures.keys()):
+   z = destroyFutures[future]
+   try:
+      future.result()
+   except vdc.VDCJobTimeout:
+      destroyTimeout = True
+      continue
+   except vdc.VDCError as e:
+      print("ERROR: VM %s destruction FAILED in zone %s (%s)." % (zonesDict[z]['virtualmachineid'],zonesDict[z]['name'],e))
+      continue
+   zonesLeft = zonesLeft - 1
+   zonesDict[z]['destroycomplete'] = True
+   print("VM %s destroyed in zone %s. %d zones left to complete." % (zonesDict[z]['virtualmachineid'],zonesDict[z]['name'],zonesLeft))
+if zonesLeft == 0:
+   if rename:
+      print("Renaming json file from %s to %s" % (datafile, newJsonFilename))
+      shutil.move(datafile, newJsonFilename)
+   print("Finished the destruction of virtual machines. Program terminating.")
+elif destroyTimeout:
+   # the time in the VM destroy loop exceeded the value of globalTimeout
+   print("\nALERT: Global timeout of %d seconds has been exceeded. Exiting. Rerun the program to check status of all VMs in the cluster." % (globalTimeout))
+else:
+   print("\nALERT: Not all of the virtual machines were destroyed. Exiting. Rerun the program to check status of all VMs in the cluster.")
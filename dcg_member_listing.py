@@ -15,6 +15,7 @@
 
 from __future__ import print_function
 import vdc_api_call as vdc
+import vdc_agent
 import getpass
 import json
 import os
@@ -80,10 +81,22 @@ if __name__ == '__main__':
         apiKey = raw_input()
         secret = getpass.getpass(prompt='API secret:')
 
-    # STEP 3: Create the api access object
-    api = vdc.VDCApiCall(api_url, apiKey, secret)
+    # STEP 3: Create the api access object, and an async object for making independent API calls concurrently
+    # (the calls are made through the VDC agent if one is running - see vdc_agent.py)
+    api = vdc_agent.connect(api_url, apiKey, secret, rate_limit=True)
+    apiAsync = vdc.AsyncVDCApiCall.from_api(api, max_concurrency=8)
  
     # STEP 4: API calls to get the information about DCGs and networks
+    # (the calls for all of the regions are started together and run concurrently,
+    # and the networks and VMs are kept as compact records - see vdc_records.py)
+    apiLimitFuture = apiAsync.getApiLimit({})
+    pdcFuture = apiAsync.fan_out('listNetworks', {'subtype': 'privatedirectconnect'}, regions=vdcRegions, records=True)
+    pdcEgressFuture = apiAsync.fan_out('listNetworks', {'subtype': 'privatedirectconnectwithgatewayservicesegress'},
+                                       regions=vdcRegions, records=True)
+    if show_netmem:
+       # only the VM fields used in print_network_members are kept, as the VM list is decoded
+       vmsFuture = apiAsync.fan_out('listVirtualMachines', regions=vdcRegions,
+                                    fields=['id', 'name', 'zonename', 'nic.networkid', 'nic.ipaddress'], records=True)
     if dcgid_requested:
        dcgList = api.listDirectConnectGroups({'id':dcgid_requested})
        if dcgList['count'] == 0:
@@ -96,32 +109,25 @@ if __name__ == '__main__':
           sys.exit("FATAL: Program terminating")
     else:   
        dcgList = api.listDirectConnectGroups({})
-    networksLists = {}
+    # (a region whose calls fail is reported, and the networks of the other regions are listed)
+    pdcResult = pdcFuture.result()
+    pdcEgressResult = pdcEgressFuture.result()
+    failedRegions = dict(pdcResult.errors, **pdcEgressResult.errors)
+    for r in vdcRegions:
+       if r in failedRegions:
+          print("WARNING: Networks of region %s could not be listed: %s" % (r, failedRegions[r]))
+    networksList = pdcResult.get('network', []) + pdcEgressResult.get('network', [])
     if show_netmem:
+       # VMs grouped by zone (a zone with no VMs has no entry)
        vmLists = {}
-    for r in vdcRegions:
-       nlistPDC = api.listNetworks({'region': r, 'subtype': 'privatedirectconnect'})
-       nlistPDCEgress = api.listNetworks({'region': r, 'subtype': 'privatedirectconnectwithgatewayservicesegress'})
-       if nlistPDC['count'] == 0 and nlistPDCEgress['count'] == 0: # there are no PrivateDirectConnect networks in this region
-          networksLists[r] = {'count':0, 'network':[]}
-       else:
-          networksLists[r] = {'count': nlistPDC['count'] + nlistPDCEgress['count'], 'network': nlistPDC['network'] + nlistPDCEgress['network']}
-       if show_netmem:
-          zonesResponse = api.listZones({'region':r})
-          zonesList = [z['name'] for z in zonesResponse['zone']]
-          vmRawList = api.listVirtualMachines({'region':r}) 
-          for z in zonesList:
-              try:
-                  vmLists[z] = [v for v in vmRawList['virtualmachine'] if v['zonename']==z]
-              except KeyError:  # there are no VMs in this region so lookup in the dict will fail
-                  vmLists[z] = []
-              
+       for v in vmsFuture.result().get('virtualmachine', []):
+           vmLists.setdefault(v['zonename'], []).append(v)
 
     # STEP 5: Process the information from the API calls
     try:
         checkTime = datetime.datetime.utcnow() # get the current time (UTC = GMT)
         print("\nDirect Connect Group listing for the account '%s' checked at %s:"
-            % (api.getApiLimit({})['apilimit']['account'], checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))
+            % (apiLimitFuture.result()['apilimit']['account'], checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))
         if dcgid_requested:
             print("\n** Results are shown only for dcgid=%s" % dcgid_requested)
         elif dcgname_requested:
@@ -136,13 +142,11 @@ if __name__ == '__main__':
         for d in dcgList['directconnectgroups']:
             print(" "+unichr(0x2015)+' \'%s\' (dcgid: %s)' % (d['name'], d['id']))
             members = []
-            for r in vdcRegions:
-               if networksLists[r]['network'] != []:
-                  for n in networksLists[r]['network']:
-                      if n['dcgfriendlyname'] == d['name']:
-                         if 'isprovisioned' not in n:
-                            n['isprovisioned'] = 'Unknown'
-                         members.append([n['cidr'],n['name'],n['zonename'],r,n['id'],n['isprovisioned'],n['displaytext'],n['subtype']])
+            for n in networksList:
+                if n['dcgfriendlyname'] == d['name']:
+                   if 'isprovisioned' not in n:
+                      n['isprovisioned'] = 'Unknown'
+                   members.append([n['cidr'],n['name'],n['zonename'],n['region'],n['id'],n['isprovisioned'],n['displaytext'],n['subtype']])
             if len(members)>0:
                 members = sorted(members, key=lambda x: x[2]) #sort by zonename
                 members = sorted(members, key=lambda x: x[3]) #sort by region
@@ -163,8 +167,8 @@ if __name__ == '__main__':
                        else:
                           print("   "+unichr(0x2514)+" %s%s: %s'%s' (%s, %s)" % (members[i][0],egressLabel,provisionedLabel,members[i][1],members[i][2],members[i][3]))
                        if show_netmem:
-                           if vmLists[members[i][2]] != {}:
-                              print_network_members(vmLists[members[i][2]],members[i][4],members[i][5],"        ")
+                           if vmLists.get(members[i][2], []) != {}:
+                              print_network_members(vmLists.get(members[i][2], []),members[i][4],members[i][5],"        ")
                            else:
                               print("        " + "*(NO MEMBERS)")
                     else:
@@ -173,8 +177,8 @@ if __name__ == '__main__':
                        else:
                           print("   "+unichr(0x251C)+" %s%s: %s'%s' (%s, %s)" % (members[i][0],egressLabel,provisionedLabel,members[i][1],members[i][2],members[i][3]))
                        if show_netmem:
-                           if vmLists[members[i][2]] != {}:
-                              print_network_members(vmLists[members[i][2]],members[i][4],members[i][5],"   "+unichr(0x2502)+"    ")
+                           if vmLists.get(members[i][2], []) != {}:
+                              print_network_members(vmLists.get(members[i][2], []),members[i][4],members[i][5],"   "+unichr(0x2502)+"    ")
                            else:
                               print("        " + "*(NO MEMBERS)")
                 print(" ")
@@ -19,7 +19,7 @@
 
 from __future__ import print_function
 import vdc_api_call as vdc
-import requests
+import vdc_trace
 import sys
 import getpass
 import json
@@ -30,7 +30,6 @@ import datetime
 import argparse
 import re
 import math
-from subprocess import call
 
 def write_logfile(logfile_handle, message):
    timeNow = datetime.datetime.utcnow()
@@ -49,11 +48,17 @@ parser.add_argument("-t", "--timeout", default=300,
                help="specify the deploy 'timeout': if deploy time exceeds this, the VM deploy will be abandoned (default 300 seconds)")
 parser.add_argument("-l", "--logfile", default='./autoscaler.log',
                help="path/name of the logfile to be used to log the runs of the autoscaler process (default ./autoscaler.log)')")
+parser.add_argument("-m", "--metrics-port", type=int, default=None,
+               help="serve metrics of the API calls in Prometheus format on this local port (default: no metrics)")
+parser.add_argument("--trace", default='',
+               help="name of output file to receive a trace of the autoscaler runs in Chrome trace-event format, written after each run and when the program exits (default: no trace)")
 vdcRegion = parser.parse_args().region
 config_file = parser.parse_args().config
 repeat_interval = parser.parse_args().interval
 deploy_timeout = parser.parse_args().timeout
 logfile = parser.parse_args().logfile
+metrics_port = parser.parse_args().metrics_port
+traceFile = parser.parse_args().trace
 
 # TEMPORARY: Hard configuration settings (these should be set via a configuration file)
 # REPLACE [INSERT] WITH YOUR OWN VALUES
@@ -89,169 +94,179 @@ else:
     apiKey = raw_input()
     secret = getpass.getpass(prompt='API secret:')
 
-# SETUP: Create the api access object for VDC
-api = vdc.VDCApiCall(api_url, apiKey, secret)
+# SETUP: Create the api access object for VDC, with metrics of the API calls if requested
+if metrics_port:
+   import vdc_metrics
+   metrics = vdc_metrics.MetricsRegistry()
+   metrics.serve(metrics_port)
+else:
+   metrics = None
+if traceFile:
+   # (only the latest events are kept, as the autoscaler runs for an unlimited time)
+   tracer = vdc_trace.Tracer(traceFile, max_events=100000)
+else:
+   tracer = vdc_trace.NullTracer()
+api = vdc.VDCApiCall(api_url, apiKey, secret, rate_limit=True, metrics=metrics, tracer=tracer if traceFile else None)
+
+# (requests is slow to import, so it is only imported once the program has got this far)
+import requests
 
 # THE REST OF THE PROGRAM RUNS IN A REPEATING LOOP, WITH A DELAY OF repeat_interval SECONDS AT THE END OF THE LOOP
 repeatOn = True
 logfile_handle = open(logfile, 'w', 1)
 
 while repeatOn:
-    # STEP: Program starting message
-    timeNow = datetime.datetime.utcnow()
-    timestamp = timeNow.strftime("%Y-%m-%d %H:%M:%S UTC")
-    write_logfile(logfile_handle, 'Starting')
-    print("\n\n********************************************")
-    print("loadbased_autoscaler: Starting at %s" % timestamp)
-    print("********************************************")
+    tracer.phase('Autoscaler run')
+    try:
+        # STEP: Program starting message
+        timeNow = datetime.datetime.utcnow()
+        timestamp = timeNow.strftime("%Y-%m-%d %H:%M:%S UTC")
+        write_logfile(logfile_handle, 'Starting')
+        print("\n\n********************************************")
+        print("loadbased_autoscaler: Starting at %s" % timestamp)
+        print("********************************************")
 
-    # STEP: Check the number of running VMs
-    vmresult1 = api.listVirtualMachines({'region': vdcRegion, 'zone': zoneID, 'state': 'Running', 'name': vmName})
-    ## add VMs with state=Starting because the VM deploy time could be longer than the run frequency of this script
-    vmresult2 = api.listVirtualMachines({'region': vdcRegion, 'zone': zoneID, 'state': 'Starting', 'name': vmName})
-    if vmresult2 != {} and vmresult1 != {}:
-       currentVmCount = vmresult1['count'] + vmresult2['count']
-       currentVmList = [[vm['id'],vm['name'],vm['state']] for vm in vmresult1['virtualmachine']] + [[vm['id'],vm['name'],vm['state']] for vm in vmresult2['virtualmachine']]
-    elif vmresult1 != {}:
-       currentVmCount = vmresult1['count']
-       currentVmList = [[vm['id'],vm['name'],vm['state']] for vm in vmresult1['virtualmachine']]
-    else:
-       currentVmCount = 0
-       currentVmList = []
-    # sort list alphabetically by VM names
-    currentVmList.sort(key=lambda x: x[1])
-    write_logfile(logfile_handle, "Current virtual machines: %d" % currentVmCount)
-    print("Current virtual machines: %d" % currentVmCount)
-    print("VM list:")
-    for v in currentVmList:
-        print("%s: %s (state: %s)" % (v[0],v[1],v[2]))
+        # STEP: Check the number of running VMs
+        vmresult1 = api.listVirtualMachines({'region': vdcRegion, 'zone': zoneID, 'state': 'Running', 'name': vmName})
+        ## add VMs with state=Starting because the VM deploy time could be longer than the run frequency of this script
+        vmresult2 = api.listVirtualMachines({'region': vdcRegion, 'zone': zoneID, 'state': 'Starting', 'name': vmName})
+        if vmresult2 != {} and vmresult1 != {}:
+           currentVmCount = vmresult1['count'] + vmresult2['count']
+           currentVmList = [[vm['id'],vm['name'],vm['state']] for vm in vmresult1['virtualmachine']] + [[vm['id'],vm['name'],vm['state']] for vm in vmresult2['virtualmachine']]
+        elif vmresult1 != {}:
+           currentVmCount = vmresult1['count']
+           currentVmList = [[vm['id'],vm['name'],vm['state']] for vm in vmresult1['virtualmachine']]
+        else:
+           currentVmCount = 0
+           currentVmList = []
+        # sort list alphabetically by VM names
+        currentVmList.sort(key=lambda x: x[1])
+        write_logfile(logfile_handle, "Current virtual machines: %d" % currentVmCount)
+        print("Current virtual machines: %d" % currentVmCount)
+        print("VM list:")
+        for v in currentVmList:
+            print("%s: %s (state: %s)" % (v[0],v[1],v[2]))
 
-    # STEP: Query to HAProxy VM statistics and extract the number of current sessions
-    # Do this twice with a time gap to get a more reliable number
-    haproxydata = requests.get(haproxyStatsURL, auth=(haproxyStatsUser, haproxyStatsPassword)).text
-    currentSessions1 = float((haproxydata.split('\n')[1]).split(',')[4])
-    time.sleep(10)
-    haproxydata = requests.get(haproxyStatsURL, auth=(haproxyStatsUser, haproxyStatsPassword)).text
-    currentSessions2 = float((haproxydata.split('\n')[1]).split(',')[4])
-    currentSessionsCount = int(math.ceil(0.5*(currentSessions1 + currentSessions2)))
-    write_logfile(logfile_handle, "Current web sessions: %d" % currentSessionsCount)
-    print("Current web sessions: %d" % currentSessionsCount)
+        # STEP: Query to HAProxy VM statistics and extract the number of current sessions
+        # Do this twice with a time gap to get a more reliable number
+        haproxydata = requests.get(haproxyStatsURL, auth=(haproxyStatsUser, haproxyStatsPassword)).text
+        currentSessions1 = float((haproxydata.split('\n')[1]).split(',')[4])
+        tracer.sleep(10)
+        haproxydata = requests.get(haproxyStatsURL, auth=(haproxyStatsUser, haproxyStatsPassword)).text
+        currentSessions2 = float((haproxydata.split('\n')[1]).split(',')[4])
+        currentSessionsCount = int(math.ceil(0.5*(currentSessions1 + currentSessions2)))
+        write_logfile(logfile_handle, "Current web sessions: %d" % currentSessionsCount)
+        print("Current web sessions: %d" % currentSessionsCount)
 
-    # STEP: Calculate number of VMs required for current session loading
-    if currentSessionsCount % sessionPerVM == 0:
-       requiredVmCount = currentSessionsCount / sessionPerVM
-    else:
-       requiredVmCount = currentSessionsCount / sessionPerVM + 1
+        # STEP: Calculate number of VMs required for current session loading
+        if currentSessionsCount % sessionPerVM == 0:
+           requiredVmCount = currentSessionsCount / sessionPerVM
+        else:
+           requiredVmCount = currentSessionsCount / sessionPerVM + 1
 
-    # FOR TESTING: SET THIS VARIABLE TO OVERRIDE THE SESSION-BASED CALCULATION 
-    ##requiredVmCount = 3
+        # FOR TESTING: SET THIS VARIABLE TO OVERRIDE THE SESSION-BASED CALCULATION 
+        ##requiredVmCount = 3
 
-    if requiredVmCount > maxVM:
-       requiredVmCount = maxVM
-    if requiredVmCount < minVM:
-       requiredVmCount = minVM
+        if requiredVmCount > maxVM:
+           requiredVmCount = maxVM
+        if requiredVmCount < minVM:
+           requiredVmCount = minVM
 
-    changeVMNum = requiredVmCount - currentVmCount
-    print("Required VMs (for target loading of %d sessions per VM): %d" % (sessionPerVM, requiredVmCount))
-    print("Change to VMs: %d" % changeVMNum)
+        changeVMNum = requiredVmCount - currentVmCount
+        print("Required VMs (for target loading of %d sessions per VM): %d" % (sessionPerVM, requiredVmCount))
+        print("Change to VMs: %d" % changeVMNum)
 
-    # STEP: Create new VM, or delete VM, or no changes required
-    if changeVMNum == 0:
-       write_logfile(logfile_handle, "No changes to VMs required.")
-       print("No changes to VMs required.")
-    elif changeVMNum > 0:
-       write_logfile(logfile_handle, "Creating %d VMs now..." % changeVMNum)
-       print("Creating %d VMs now..." % changeVMNum)
-       timeNow = datetime.datetime.utcnow()
-       timestamp = timeNow.strftime("%Y%m%dT%H%M%S")
-       newVmDict = {}
-       for i in range(changeVMNum):
-          vmNewName = vmName + timestamp + '-' + "%03d" % (i+1)
-          print("  creating: %s" % vmNewName)
-          newVmDict[vmNewName] = {}
-          try:
-              deployResult = api.deployVirtualMachine({'region':vdcRegion, 'name':vmNewName, 'displayname':vmNewName, 'zoneid': zoneID, 'templateid': templateID, 'serviceofferingid': serviceofferingID, 'networkids': networkIDs}) 
-              newVmDict[vmNewName]['deployjobid'] = deployResult['jobid']
-              newVmDict[vmNewName]['deploycomplete'] = False
-          except:
-              write_logfile(logfile_handle, "ERROR while trying to deploy VM %s. Carrying on but results may not be correct." % vmNewName)
-              pass
-       # NEED TO WAIT FOR DEPLOYS TO COMPLETE SO THAT NEW VMs' IP ADDRESSES ARE AVAILABLE TO HAPROXY CONFIG 
-       checkDelay = 2
-       displayProgress = True
-       deployAllComplete = False
-       countdown = len(newVmDict)
-       deployStartTime = datetime.datetime.utcnow()
-       while not deployAllComplete:
-          for v in newVmDict: 
-              if not newVmDict[v]['deploycomplete']:
-                 try:
-                    result = api.queryAsyncJobResult({'region': vdcRegion, 'jobid': newVmDict[v]['deployjobid']})
-                 except KeyError:
-                    pass
-                 elapsedTime = (datetime.datetime.utcnow() - deployStartTime).seconds
-                 if 'jobresult' in result:
-                    countdown = countdown - 1
-                    newVmDict[v]['deploycomplete'] = True
-                    print('')
-                    print("VM deploy completed: %s. %d deploys left to complete." % (v, countdown))
-                 elif elapsedTime > deploy_timeout:
-                    countdown = countdown - 1
-                    newVmDict[v]['deploycomplete'] = True
-                    print('')
-                    print("TIMEOUT for VM %s: deploy took too long. %d deploys left to complete." % (v, countdown))
-          if countdown == 0:
-              deployAllComplete = True
-              write_logfile(logfile_handle, "Finished the deployment of virtual machines.")
-              print("Finished the deployment of virtual machines.")
-          else:
-              if displayProgress:
-                 print('.', end='')
-                 sys.stdout.flush()
-              time.sleep(checkDelay)       
-    elif changeVMNum < 0:
-       write_logfile(logfile_handle, "Deleting %d VMs now..." % abs(changeVMNum)) 
-       print("Deleting %d VMs now..." % abs(changeVMNum)) 
-       for i in range(abs(changeVMNum)):
-          print("  deleting: %s" % currentVmList[i][1])
-          try:
-              api.destroyVirtualMachine({'region':vdcRegion, 'id': currentVmList[i][0], 'expunge':True})
-          except:
-              write_logfile(logfile_handle, "ERROR while trying to destroy VM %s. Carrying on but results may not be correct." % currentVmList[i][1])
-              pass
-       # Pause so that the deleted VMs have time to switch off, and won't be detected at the next step
-       time.sleep(30)
-       write_logfile(logfile_handle, "Finished deleting virtual machines.") 
+        # STEP: Create new VM, or delete VM, or no changes required
+        if changeVMNum == 0:
+           write_logfile(logfile_handle, "No changes to VMs required.")
+           print("No changes to VMs required.")
+        elif changeVMNum > 0:
+           write_logfile(logfile_handle, "Creating %d VMs now..." % changeVMNum)
+           print("Creating %d VMs now..." % changeVMNum)
+           timeNow = datetime.datetime.utcnow()
+           timestamp = timeNow.strftime("%Y%m%dT%H%M%S")
+           newVmDict = {}
+           for i in range(changeVMNum):
+              vmNewName = vmName + timestamp + '-' + "%03d" % (i+1)
+              print("  creating: %s" % vmNewName)
+              newVmDict[vmNewName] = {}
+              try:
+                  deployResult = api.deployVirtualMachine({'region':vdcRegion, 'name':vmNewName, 'displayname':vmNewName, 'zoneid': zoneID, 'templateid': templateID, 'serviceofferingid': serviceofferingID, 'networkids': networkIDs}) 
+                  newVmDict[vmNewName]['deployjobid'] = deployResult['jobid']
+                  newVmDict[vmNewName]['deploycomplete'] = False
+              except:
+                  write_logfile(logfile_handle, "ERROR while trying to deploy VM %s. Carrying on but results may not be correct." % vmNewName)
+                  pass
+           # NEED TO WAIT FOR DEPLOYS TO COMPLETE SO THAT NEW VMs' IP ADDRESSES ARE AVAILABLE TO HAPROXY CONFIG 
+           # (the deploy jobs are watched by the job watcher of the API object, which checks all of the pending
+           # jobs together with one API call; each job gives a future, and the futures are handled as they finish)
+           deployFutures = dict([(api.watch_job(newVmDict[v]['deployjobid'], vdcRegion, timeout=float(deploy_timeout)), v)
+                                 for v in newVmDict if 'deployjobid' in newVmDict[v]])
+           deploysLeft = len(deployFutures)
+           for future in vdc.as_completed(deployFutures.keys()):
+              v = deployFutures[future]
+              deploysLeft = deploysLeft - 1
+              newVmDict[v]['deploycomplete'] = True
+              try:
+                 future.result()
+              except vdc.VDCJobTimeout:
+                 print("TIMEOUT for VM %s: deploy took too long." % v)
+              except vdc.VDCError as e:
+                 write_logfile(logfile_handle, "ERROR while deploying VM %s: %s" % (v, e))
+                 print("VM deploy FAILED: %s (%s). %d deploys left to complete." % (v, e, deploysLeft))
+              else:
+                 print("VM deploy completed: %s. %d deploys left to complete." % (v, deploysLeft))
+           write_logfile(logfile_handle, "Finished the deployment of virtual machines.")
+           print("Finished the deployment of virtual machines.")
+        elif changeVMNum < 0:
+           write_logfile(logfile_handle, "Deleting %d VMs now..." % abs(changeVMNum)) 
+           print("Deleting %d VMs now..." % abs(changeVMNum)) 
+           for i in range(abs(changeVMNum)):
+              print("  deleting: %s" % currentVmList[i][1])
+              try:
+                  api.destroyVirtualMachine({'region':vdcRegion, 'id': currentVmList[i][0], 'expunge':True})
+              except:
+                  write_logfile(logfile_handle, "ERROR while trying to destroy VM %s. Carrying on but results may not be correct." % currentVmList[i][1])
+                  pass
+           # Pause so that the deleted VMs have time to switch off, and won't be detected at the next step
+           tracer.sleep(30)
+           write_logfile(logfile_handle, "Finished deleting virtual machines.") 
 
-    # STEP: Rewrite the HAProxy config file if there is a change
-    if changeVMNum != 0:
-       # Get network IP addresses for currently running VMs
-       vmresult = api.listVirtualMachines({'region': vdcRegion, 'zone': zoneID, 'state': 'Running', 'name': vmName})
-       vmAddressList = [[vm['name'].replace('-','').lower(), [net for net in vm['nic'] if net['networkid']==networkIDs.split(',')[0]][0]['ipaddress']] for vm in vmresult['virtualmachine']]
-       vmAddressList.sort(key=lambda x: x[0])
-       with open(haproxyConfigFileStatic) as fh:
-          haproxyConfigStatic = fh.read()
-       with open(haproxyConfigFile, 'w') as outfh:
-          outfh.write(haproxyConfigStatic)
-          for v in vmAddressList:
-             outfh.write('\n        server %s %s:80 check' % (v[0], v[1]))
-       write_logfile(logfile_handle, "New configuration written to config file %s" % haproxyConfigFile)
-       print("New configuration written to config file %s" % haproxyConfigFile)
+        # STEP: Rewrite the HAProxy config file if there is a change
+        if changeVMNum != 0:
+           # Get network IP addresses for currently running VMs
+           vmresult = api.listVirtualMachines({'region': vdcRegion, 'zone': zoneID, 'state': 'Running', 'name': vmName})
+           vmAddressList = [[vm['name'].replace('-','').lower(), [net for net in vm['nic'] if net['networkid']==networkIDs.split(',')[0]][0]['ipaddress']] for vm in vmresult['virtualmachine']]
+           vmAddressList.sort(key=lambda x: x[0])
+           with open(haproxyConfigFileStatic) as fh:
+              haproxyConfigStatic = fh.read()
+           with open(haproxyConfigFile, 'w') as outfh:
+              outfh.write(haproxyConfigStatic)
+              for v in vmAddressList:
+                 outfh.write('\n        server %s %s:80 check' % (v[0], v[1]))
+           write_logfile(logfile_handle, "New configuration written to config file %s" % haproxyConfigFile)
+           print("New configuration written to config file %s" % haproxyConfigFile)
 
-       # Restart the HAProxy service
-       call(['sudo', 'service', 'haproxy', 'restart'])
-       write_logfile(logfile_handle, "Service haproxy restarted.")
-       print("Service haproxy restarted.")
+           # Restart the HAProxy service
+           tracer.call(['sudo', 'service', 'haproxy', 'restart'])
+           write_logfile(logfile_handle, "Service haproxy restarted.")
+           print("Service haproxy restarted.")
 
-    # STEP: Program finished
-    write_logfile(logfile_handle, "Finished.\n\n")
-    timeNow = datetime.datetime.utcnow()
-    timestamp = timeNow.strftime("%Y-%m-%d %H:%M:%S UTC")
-    print("********************************************")
-    print("loadbased_autoscaler: Finished at %s" % timestamp)
-    print("********************************************")
+        # STEP: Program finished
+        write_logfile(logfile_handle, "Finished.\n\n")
+        timeNow = datetime.datetime.utcnow()
+        timestamp = timeNow.strftime("%Y-%m-%d %H:%M:%S UTC")
+        print("********************************************")
+        print("loadbased_autoscaler: Finished at %s" % timestamp)
+        print("********************************************")
+    except vdc.VDCError as e:
+        # an API error only abandons this run of the autoscaler, the next run starts after the usual interval
+        write_logfile(logfile_handle, "ERROR from the VDC API, abandoning this run: %s" % e)
+        print("ERROR from the VDC API, abandoning this run: %s" % e)
 
     # Autoscale loop finished, so wait 'repeat_interval' seconds
-    time.sleep(float(repeat_interval))
+    tracer.phase('Wait for next run')
+    tracer.flush()
+    tracer.sleep(float(repeat_interval))
 
     
@@ -12,6 +12,7 @@
 
 from __future__ import print_function
 import vdc_api_call as vdc
+import vdc_agent
 import sys
 import getpass
 import json
@@ -61,13 +62,21 @@ if __name__ == '__main__':
         apiKey = raw_input()
         secret = getpass.getpass(prompt='API secret:')
 
-    # STEP 3: Create the api access object
-    api = vdc.VDCApiCall(api_url, apiKey, secret)
+    # STEP 3: Create the api access object, and an async object for making independent API calls concurrently
+    # (the calls are made through the VDC agent if one is running - see vdc_agent.py)
+    api = vdc_agent.connect(api_url, apiKey, secret, rate_limit=True)
+    apiAsync = vdc.AsyncVDCApiCall.from_api(api, max_concurrency=8)
 
-    # STEP 4: API calls to get the information about networks and VMs
+    # STEP 4: API calls to get the information about networks and VMs (all four calls are made concurrently)
+    # The results are kept as compact records (see vdc_records.py) rather than the full JSON dicts
     request = {'region': vdcRegion}
+    networksFuture = apiAsync.listNetworks(request, records=True)
+    # only the VM fields used below are kept, as the VM list is decoded
+    vmListFuture = apiAsync.listVirtualMachines(request, fields=['id', 'name', 'state', 'nic.networkid', 'nic.ipaddress'], records=True)
+    portForwardingRulesFuture = apiAsync.listPortForwardingRules(request, records=True)
+    loadBalancerRulesFuture = apiAsync.listLoadBalancerRules(request, records=True)
     try:
-       networksList = api.listNetworks(request)
+       networksList = networksFuture.result()
        if zonenameFilter:
           networksList['network'] = [network for network in networksList['network'] if re.search('\A'+zonenameFilter,network['zonename'])]
           if networksList['network'] == []:
@@ -76,25 +85,39 @@ if __name__ == '__main__':
     except KeyError:
        print("Error: No networks found", file=sys.stderr)
     try: 
-       vmList = api.listVirtualMachines(request)
+       vmList = vmListFuture.result()
     except KeyError:
        print("Note: No VMs found for this account", file=sys.stderr)
        vmList = {}
        pass 
     try:
-       portForwardingRulesList = api.listPortForwardingRules(request)
+       portForwardingRulesList = portForwardingRulesFuture.result()
     except KeyError:
        print("Note: No port-forwarding rules found for this account")
        portForwardingRulesList = {}
        pass
     try:
-       loadBalancerRulesList = api.listLoadBalancerRules(request)
+       loadBalancerRulesList = loadBalancerRulesFuture.result()
     except KeyError:
        print("Note: No loadbalancer rules found for this account")
        loadBalancerRulesList = {}
        lbRulesWithVM = []
        pass 
 
+    # Start the per-network API calls (public IPs, egress rules, LB rule instances) concurrently,
+    # their results are collected as each network is printed
+    publicIpFutures = {}
+    egressRulesFutures = {}
+    lbInstancesFutures = {}
+    for network in networksList.get('network', []):
+       if network['subtype']=='internetgateway':
+          publicIpFutures[network['id']] = apiAsync.listPublicIpAddresses({'region': vdcRegion, 'associatednetworkid': network['id']})
+          if showEgress:
+             egressRulesFutures[network['id']] = apiAsync.listEgressFirewallRules({'networkid':network['id']})
+    if loadBalancerRulesList != {}:
+       for l in loadBalancerRulesList['loadbalancerrule']:
+          lbInstancesFutures[l['id']] = apiAsync.listLoadBalancerRuleInstances({'id':l['id'], 'region':vdcRegion})
+
 
     # STEP 5: Process the information from the API calls
     nameStringSubs = string.maketrans(" -","__")
@@ -131,9 +154,7 @@ if __name__ == '__main__':
             #FIND EXTERNAL IP ADDRESSES IF THEY EXIST FOR THE NETWORK
             external_IP = {}
             if network['subtype']=='internetgateway':
-               testdict=request
-               testdict['associatednetworkid']=network['id']
-               external_IP=api.listPublicIpAddresses(testdict)
+               external_IP=publicIpFutures[network['id']].result()
                if external_IP != {}:
                   if external_IP['count']==1:
                      print(", IP: %s)" % external_IP['publicipaddress'][0]['ipaddress'])
@@ -164,7 +185,7 @@ if __name__ == '__main__':
             if showEgress and network['subtype']=='internetgateway':
                print("   " + unichr(0x2502) + "(egress: ", end='')
                try: 
-                  egressrules=api.listEgressFirewallRules({'networkid':network['id']})
+                  egressrules=egressRulesFutures[network['id']].result()
                except KeyError:
                   pass
                if egressrules == {}:
@@ -188,7 +209,7 @@ if __name__ == '__main__':
                for l in lbRulesForNetwork:
                   print("   " + unichr(0x2502) + "LB: '%s', IP: %s, ports: [%s]->[%s], state: " % (l['name'], l['publicip'], l['publicport'], l['privateport']), end='')
                   try:
-                      lVM = api.listLoadBalancerRuleInstances({'id':l['id'], 'region':vdcRegion})
+                      lVM = lbInstancesFutures[l['id']].result()
                       print("%d VM" % lVM['count'])
                       # *** POSSIBLE ADDITION: print list of VM IP addresses
                       vmListIds = [lv['id'] for lv in lVM['loadbalancerruleinstance']]
@@ -0,0 +1,448 @@
+#! /usr/bin/env python
+# Python script for the Interoute Virtual Data Centre API:
+#   Name: vdc_agent.py
+#   Purpose: Long-running local agent which makes the API calls of the other programs over a Unix socket
+#   Requires: class VDCApiCall in the file vdc_api_call.py
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# The agent holds one VDCApiCall for all of the programs run on the computer, so that its
+# open HTTP connections, its rate limiter (which keeps the programs together within the
+# account's API call limit) and a cache of the slowly changing catalog responses (zones,
+# templates, service offerings) are shared between the programs and kept between runs.
+# A program started from cron or a shell loop then makes its first API calls on warm
+# connections, and does not fetch the catalog again.
+#
+# Programs use the agent through AgentApiCall, a drop-in replacement for VDCApiCall which
+# sends its calls to the agent. The connect() function gives an AgentApiCall when an agent
+# is running for the same API URL and API key, and a plain VDCApiCall otherwise, so the
+# programs work in the same way with or without an agent:
+#     api = vdc_agent.connect(api_url, apiKey, secret, rate_limit=True)
+#
+# Run the agent in the background, with the same config file as the programs:
+#     python vdc_agent.py &
+#     python vdc_agent.py --status
+#
+# The socket is created in the user's home directory (or at the path in the environment
+# variable VDC_AGENT_SOCKET) and can only be used by the same user, because the agent
+# signs the calls with the user's API keys.
+#
+# The async jobs of all of the programs are watched by the agent's one job watcher (see
+# JobWatcher in vdc_api_call.py), so the jobs of several programs are checked together.
+# Pre-signed URLs (VDCApiCall.presign) are signed by the agent, so a program using the agent
+# can hand out expiring URLs without having the secret key.
+#
+# The protocol on the socket is one line of JSON for each request, and one line of JSON
+# for each reply; the reply to an API call is followed by the response body, in chunks
+# each preceded by a line with its length in hex and ended by a chunk of length 0.
+#
+# You can pass options via the command line: type 'python vdc_agent.py -h' for usage information
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+import vdc_api_call as vdc
+import argparse
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import SocketServer
+
+SOCKET_PATH = os.environ.get('VDC_AGENT_SOCKET', os.path.join(os.path.expanduser('~'), '.vdcapi-agent.sock'))
+
+# Commands whose responses are cached by the agent. Other commands are not cached (but
+# mutating commands still remove the affected cached responses).
+CATALOG_COMMANDS = ['listZones', 'listTemplates', 'listServiceOfferings', 'listDiskOfferings',
+                    'listNetworkOfferings', 'listOsTypes', 'listApis']
+
+CHUNK_SIZE = 65536
+
+
+# THE AGENT
+
+class VDCAgent(object):
+    """
+        The API calls made by the agent for its clients, through the
+        VDCApiCall 'api' with the ResponseCache 'cache'.
+    """
+    def __init__(self, api, cache):
+        self.api = api
+        self.cache = cache
+        self.started = time.time()
+        self.requests = 0
+        self.clients = 0
+        self._lock = threading.Lock()
+
+    def hello(self):
+        return {'api_url': self.api.api_url, 'api_key': self.api.apiKey, 'pid': os.getpid()}
+
+    def status(self):
+        return {'api_url': self.api.api_url, 'pid': os.getpid(), 'uptime': time.time() - self.started,
+                'requests': self.requests, 'clients': self.clients, 'cache': self.cache.stats(),
+                'jobs': self.api.job_watcher().pending(),
+                'connections': self.api.connection_stats(),
+                'limiter': self.api.limiter.stats() if self.api.limiter is not None else None}
+
+    def call(self, args, stream):
+        """
+            Make an API call, and return an iterator over the chunks of its
+            response body.
+        """
+        with self._lock:
+            self.requests += 1
+        # (the values decoded from JSON are unicode, which the signing code does not accept)
+        args = dict((str(k), v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in args.items())
+        command = args.get('command', '')
+        if self.cache.ttl_for(command) > 0 or not stream:
+            return iter([self.cache.fetch(command, args, lambda: self.api.request(dict(args)))])
+        response = self.api.request(args, stream=True)
+        return iter(lambda: response.read(CHUNK_SIZE), '')
+
+
+class AgentRequestHandler(SocketServer.StreamRequestHandler):
+    # (the replies are buffered, and sent when each one is complete)
+    wbufsize = -1
+
+    def handle(self):
+        agent = self.server.agent
+        with agent._lock:
+            agent.clients += 1
+        try:
+            while True:
+                line = self.rfile.readline()
+                if not line:
+                    return
+                request = json.loads(line)
+                op = request.get('op')
+                if op == 'hello':
+                    self.reply({'ok': True, 'agent': agent.hello()})
+                elif op == 'status':
+                    self.reply({'ok': True, 'status': agent.status()})
+                elif op == 'invalidate':
+                    agent.cache.invalidate()
+                    self.reply({'ok': True})
+                elif op == 'request':
+                    self.handle_call(agent, request)
+                elif op == 'job':
+                    self.handle_job(agent, request)
+                elif op == 'presign':
+                    try:
+                        self.reply({'ok': True, 'result': agent.api.presign_many(
+                            request['calls'], request.get('ttl', 300), request.get('read_only', True))})
+                    except vdc.VDCError as e:
+                        self.reply({'ok': False, 'error': error_to_dict(e)})
+                else:
+                    self.reply({'ok': False, 'error': {'type': 'VDCError', 'message': 'Unknown agent request: %s' % op}})
+        finally:
+            with agent._lock:
+                agent.clients -= 1
+
+    def handle_call(self, agent, request):
+        try:
+            chunks = agent.call(request['args'], request.get('stream', False))
+            chunk = next(chunks, '')
+        except vdc.VDCError as e:
+            return self.reply({'ok': False, 'error': error_to_dict(e)})
+        self.reply({'ok': True})
+        # (an error after this point can only be passed on by closing the connection without the last chunk)
+        while chunk:
+            self.wfile.write('%x\n' % len(chunk))
+            self.wfile.write(chunk)
+            chunk = next(chunks, '')
+        self.wfile.write('0\n')
+        self.wfile.flush()
+
+    def handle_job(self, agent, request):
+        # (the reply is sent when the job has finished)
+        future = agent.api.watch_job(request['jobid'], request.get('region'), request.get('timeout'))
+        try:
+            self.reply({'ok': True, 'result': future.result()})
+        except vdc.VDCError as e:
+            self.reply({'ok': False, 'error': error_to_dict(e)})
+
+    def reply(self, message):
+        self.wfile.write(json.dumps(message) + '\n')
+        self.wfile.flush()
+
+
+class AgentServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, agent):
+        # the socket can only be used by the same user
+        old_umask = os.umask(0o077)
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, AgentRequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.agent = agent
+
+
+def error_to_dict(e):
+    """
+        Return a dict describing the VDCError 'e', for error_from_dict.
+    """
+    return {'type': e.__class__.__name__, 'message': str(e), 'code': getattr(e, 'code', None),
+            'description': getattr(e, 'description', None), 'retry_after': getattr(e, 'retry_after', None),
+            'errno': getattr(e, 'errno', None), 'reason': str(getattr(e, 'reason', '')),
+            'job_id': getattr(e, 'job_id', None), 'result': getattr(e, 'result', None)}
+
+
+def error_from_dict(error, api_url):
+    """
+        Return the VDCError described by a dict made by error_to_dict.
+    """
+    if error['type'] == 'VDCRateLimitError':
+        return vdc.VDCRateLimitError(error['code'], error['description'], error['retry_after'])
+    if error['type'] == 'VDCHTTPError':
+        return vdc.VDCHTTPError(error['code'], error['description'])
+    if error['type'] == 'VDCJobError':
+        return vdc.VDCJobError(error['job_id'], error['result'])
+    if error['type'] == 'VDCConnectionError':
+        e = vdc.VDCConnectionError(error['reason'], api_url)
+        e.errno = error['errno']
+        return e
+    return getattr(vdc, error['type'], vdc.VDCError)(error['message'])
+
+
+# THE CLIENT
+
+class AgentResponse(object):
+    """
+        Response body of an API call read from the agent socket, in the same
+        way as a PooledResponse. The socket is handed back to the
+        AgentApiCall once the body has been read in full, or closed if the
+        response is closed before that.
+    """
+    def __init__(self, api, sock, rfile):
+        self.api = api
+        self.sock = sock
+        self.rfile = rfile
+        self.bytes_read = 0
+        self.on_release = None
+        self._left = 0
+        self._done = False
+
+    def read(self, amt=None):
+        if self._done:
+            return ''
+        parts = []
+        size = 0
+        while amt is None or size < amt:
+            if self._left == 0:
+                line = self.rfile.readline()
+                if not line.endswith('\n'):
+                    self.close()
+                    raise vdc.VDCConnectionError('Connection to the VDC agent closed during the response', self.api.api_url)
+                self._left = int(line, 16)
+                if self._left == 0:
+                    self._done = True
+                    self.release()
+                    break
+            data = self.rfile.read(self._left if amt is None else min(self._left, amt - size))
+            if not data:
+                self.close()
+                raise vdc.VDCConnectionError('Connection to the VDC agent closed during the response', self.api.api_url)
+            self._left -= len(data)
+            size += len(data)
+            parts.append(data)
+        data = ''.join(parts)
+        self.bytes_read += len(data)
+        return data
+
+    def release(self):
+        if self.sock is None:
+            return
+        if self._done:
+            self.api._put(self.sock, self.rfile)
+        else:
+            self.rfile.close()
+            self.sock.close()
+        self.sock = None
+        if self.on_release is not None:
+            self.on_release(self)
+
+    close = release
+
+
+class AgentApiCall(vdc.VDCApiCall):
+    """
+        Drop-in replacement for VDCApiCall which makes its API calls through
+        the VDC agent listening on the Unix socket 'socket_path'. The agent
+        signs the calls with its own API keys, and makes the retries and
+        rate limiting; 'cache', 'metrics', 'tracer' and 'commands' work as
+        for VDCApiCall, in this process.
+        Raises VDCConnectionError if the agent is not running.
+    """
+    def __init__(self, socket_path=SOCKET_PATH, cache=None, metrics=None, tracer=None, commands=None):
+        self.socket_path = socket_path
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self.agent = self._call({'op': 'hello'})['agent']
+        vdc.VDCApiCall.__init__(self, self.agent['api_url'], self.agent['api_key'], '', cache=cache,
+                                metrics=metrics, tracer=tracer, commands=commands)
+
+    def _get(self):
+        with self._idle_lock:
+            if self._idle:
+                return self._idle.pop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except socket.error as e:
+            sock.close()
+            raise vdc.VDCConnectionError(e, self.socket_path)
+        return sock, sock.makefile('rb')
+
+    def _put(self, sock, rfile):
+        with self._idle_lock:
+            self._idle.append((sock, rfile))
+
+    def _call(self, message):
+        """
+            Send a request to the agent and return its reply, and for an API
+            call the AgentResponse for the body as well.
+        """
+        sock, rfile = self._get()
+        try:
+            sock.sendall(json.dumps(message) + '\n')
+            line = rfile.readline()
+        except socket.error as e:
+            sock.close()
+            raise vdc.VDCConnectionError(e, self.socket_path)
+        if not line:
+            sock.close()
+            raise vdc.VDCConnectionError('Connection to the VDC agent closed', self.socket_path)
+        reply = json.loads(line)
+        if not reply['ok']:
+            self._put(sock, rfile)
+            raise error_from_dict(reply['error'], getattr(self, 'api_url', self.socket_path))
+        if message['op'] == 'request':
+            return AgentResponse(self, sock, rfile)
+        self._put(sock, rfile)
+        return reply
+
+    def request(self, args, stream=False):
+        """
+            Make the API call with the given args through the agent. Returns
+            the response body, or with 'stream=True' an AgentResponse for the
+            body to be read from. Raises the same exceptions as VDCApiCall.
+        """
+        command = args.get('command', '')
+        region = args.get('region', 'default')
+        start = time.time()
+        try:
+            response = self._call({'op': 'request', 'args': args, 'stream': stream})
+        except vdc.VDCError as e:
+            self._record(command, region, start, 0, error=e.__class__.__name__)
+            raise
+        if stream:
+            response.on_release = lambda response: self._record(command, region, start, 0, response.bytes_read)
+            return response
+        data = response.read()
+        self._record(command, region, start, 0, len(data))
+        return data
+
+    def watch_job(self, job_id, region=None, timeout=None):
+        """
+            VDCApiCall.watch_job, with the job watched by the agent's job
+            watcher. Each pending job waits on a socket of its own.
+        """
+        return vdc.run_in_thread(lambda: self._call({'op': 'job', 'jobid': job_id, 'region': region,
+                                                      'timeout': timeout})['result'])
+
+    def presign_many(self, calls, ttl=300, read_only=True):
+        """
+            VDCApiCall.presign_many, with the URLs signed by the agent (this
+            process does not have the secret key).
+        """
+        return [tuple(url) for url in self._call({'op': 'presign', 'calls': list(calls), 'ttl': ttl,
+                                                  'read_only': read_only})['result']]
+
+    def agent_status(self):
+        """
+            Return a dict of the agent's statistics.
+        """
+        return self._call({'op': 'status'})['status']
+
+    def invalidate(self):
+        """
+            Remove all of the agent's cached responses.
+        """
+        self._call({'op': 'invalidate'})
+
+
+def connect(api_url, apiKey, secret, socket_path=SOCKET_PATH, **kwargs):
+    """
+        Return an AgentApiCall if a VDC agent is running at 'socket_path'
+        for the same API URL and API key, otherwise a VDCApiCall made with
+        the given arguments. 'kwargs' are options for VDCApiCall; the
+        options for connections, retries and rate limiting are only used
+        without an agent, because the agent has its own.
+    """
+    if os.path.exists(socket_path):
+        options = dict((k, v) for k, v in kwargs.items() if k in ('cache', 'metrics', 'tracer', 'commands'))
+        try:
+            api = AgentApiCall(socket_path, **options)
+        except vdc.VDCConnectionError:
+            pass
+        else:
+            if api.api_url == api_url and api.apiKey == apiKey:
+                return api
+    return vdc.VDCApiCall(api_url, apiKey, secret, **kwargs)
+
+
+def main():
+    # STEP: Parse the command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default=os.path.join(os.path.expanduser('~'), '.vdcapi'),
+                        help="path/name of the config file to be used for the API URL and API keys (default is ~/.vdcapi)")
+    parser.add_argument("-s", "--socket", default=SOCKET_PATH, help="path of the Unix socket (default is %s)" % SOCKET_PATH)
+    parser.add_argument("-t", "--catalogttl", type=int, default=3600,
+                        help="time in seconds for which catalog responses (zones, templates, offerings) are cached (default 3600)")
+    parser.add_argument("--status", action='store_true', help="print the statistics of the running agent and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        try:
+            print(json.dumps(AgentApiCall(args.socket).agent_status(), indent=2, sort_keys=True))
+        except vdc.VDCConnectionError as e:
+            sys.exit("No VDC agent is running at %s: %s" % (args.socket, e))
+        return
+
+    # STEP: Read the config file
+    with open(args.config) as fh:
+        config = json.load(fh)
+
+    # STEP: Check for a running agent, and remove the socket file of an agent which has stopped
+    if os.path.exists(args.socket):
+        try:
+            AgentApiCall(args.socket)
+        except vdc.VDCConnectionError:
+            os.remove(args.socket)
+        else:
+            sys.exit("A VDC agent is already running at %s" % args.socket)
+
+    # STEP: Start the agent
+    cache = vdc.ResponseCache(ttl=0, ttls=dict((command, args.catalogttl) for command in CATALOG_COMMANDS), maxsize=1024)
+    api = vdc.VDCApiCall(config['api_url'], config['api_key'], config['api_secret'], pool_size=16, rate_limit=True)
+    server = AgentServer(args.socket, VDCAgent(api, cache))
+    print("VDC agent for %s listening on %s" % (config['api_url'], args.socket))
+    # (stopping the agent with 'kill' removes the socket in the same way as Ctrl-C)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,132 +10,1706 @@
 
 from __future__ import print_function
 import base64
+import errno
 import hashlib
 import hmac
 import json
+import os
 import sys
 import time
 import datetime
+import itertools
+import random
+import re
+import select
+import socket
 import urllib
-import urllib2
+import urlparse
+import httplib
+import threading
+import zlib
+import Queue
 from socket import error as SocketError
-import errno
+from collections import OrderedDict
+
+# The VDC regions, which each have their own API endpoint (selected by the 'region' argument)
+VDC_REGIONS = ['Europe', 'USA', 'Asia']
+
+# Cache file for the command table of the API (see CommandTable)
+COMMANDS_FILE = os.path.join(os.path.expanduser('~'), '.vdcapi_commands')
+
+
+class PooledResponse(object):
+    """
+        HTTP response read through a ConnectionPool. The connection is handed
+        back to the pool once the body has been read in full, or dropped if
+        the response is closed before that.
+        A gzip-compressed body is decompressed as it is read; 'bytes_read'
+        counts the bytes received, before decompression.
+    """
+    def __init__(self, pool, connection, response):
+        self.pool = pool
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.bytes_read = 0
+        # function called with the response when it is released
+        self.on_release = None
+        if (response.getheader('Content-Encoding') or '').lower() == 'gzip':
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            self._decompressor = None
+
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+    def read(self, amt=None):
+        if self._decompressor is None:
+            data = self.response.read(amt)
+            self.bytes_read += len(data)
+            if amt is None or not data:
+                self.release()
+            return data
+        # a compressed chunk may not make any output, so read until there is some or the body ends
+        # (the output of one read may be more than 'amt' bytes)
+        while True:
+            raw = self.response.read(amt)
+            self.bytes_read += len(raw)
+            data = self._decompressor.decompress(raw)
+            if amt is None or not raw:
+                data += self._decompressor.flush()
+                self.release()
+                return data
+            if data:
+                return data
+
+    def release(self):
+        """
+            Return the connection to the pool if the response was read to
+            the end, otherwise close it.
+        """
+        if self.connection is None:
+            return
+        if self.response.isclosed() and not self.response.will_close:
+            self.pool.put(self.connection)
+        else:
+            self.connection.close()
+        self.connection = None
+        if self.on_release is not None:
+            self.on_release(self)
+
+    close = release
+
+
+class ConnectionPool(object):
+    """
+        Pool of persistent (keep-alive) HTTP/HTTPS connections to the host of
+        an API URL. Connections are shared between calls and threads; an idle
+        connection is reused if it has not been idle for longer than
+        'idle_timeout' seconds, and at most 'pool_size' idle connections are
+        kept open.
+    """
+    def __init__(self, api_url, pool_size=4, idle_timeout=30, timeout=60):
+        parts = urlparse.urlsplit(api_url)
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.path = parts.path or '/'
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self.stats = {'new': 0, 'reused': 0, 'expired': 0, 'stale': 0}
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def get(self):
+        """
+            Take a connection from the pool, or open a new one if no idle
+            connection is usable. Returns (connection, reused). An idle
+            connection which the server has closed is found (as urllib3
+            does) and dropped here, before any request is sent on it.
+        """
+        now = time.time()
+        with self._lock:
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                if now - last_used > self.idle_timeout:
+                    self.stats['expired'] += 1
+                    connection.close()
+                    continue
+                if self._dropped(connection):
+                    self.stats['stale'] += 1
+                    connection.close()
+                    continue
+                self.stats['reused'] += 1
+                return connection, True
+            self.stats['new'] += 1
+        return self._new_connection(), False
+
+    @staticmethod
+    def _dropped(connection):
+        """
+            Return True if an idle connection has been closed by the server:
+            its socket is readable (at the end of the stream, or with data
+            which no request asked for).
+        """
+        if connection.sock is None:
+            return True
+        try:
+            return bool(select.select([connection.sock], [], [], 0)[0])
+        except (select.error, ValueError, SocketError):
+            return True
+
+    def put(self, connection):
+        """
+            Give a connection back to the pool for reuse.
+        """
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append((connection, time.time()))
+                return
+        connection.close()
+
+    def urlopen(self, method, url, body=None, headers=None, preload=True, resend=True):
+        """
+            Send a request on a pooled connection and return a PooledResponse.
+            'url' is the path and query string relative to the host. If a
+            reused connection turns out to have been closed by the server,
+            the request is sent once more on a new connection: always if the
+            request could not be sent (nothing reached the server), and if
+            the connection was closed before any byte of the response unless
+            'resend' is False (for a call which must not be made twice). A
+            request which timed out is never sent again, because the server
+            may have made the call. With 'preload=True' the body is read at
+            once and is in the 'data' attribute of the response.
+        """
+        while True:
+            connection, reused = self.get()
+            try:
+                connection.request(method, url, body, headers or {})
+            except (httplib.HTTPException, SocketError) as e:
+                connection.close()
+                if reused and not isinstance(e, socket.timeout):
+                    self._stale()
+                    continue
+                raise
+            try:
+                response = connection.getresponse()
+            except (httplib.HTTPException, SocketError) as e:
+                connection.close()
+                if reused and resend and self._closed_by_server(e):
+                    self._stale()
+                    continue
+                raise
+            pooled = PooledResponse(self, connection, response)
+            if preload:
+                try:
+                    pooled.data = pooled.read()
+                except:
+                    pooled.close()
+                    raise
+            return pooled
+
+    def _stale(self):
+        with self._lock:
+            self.stats['stale'] += 1
+
+    @staticmethod
+    def _closed_by_server(error):
+        """
+            Return True if the error from getresponse() shows that the server
+            closed the connection before sending any of the response.
+        """
+        if isinstance(error, httplib.BadStatusLine):
+            # (the message for an empty status line differs between Python 2.7 versions)
+            return error.line in ('', "''") or error.line.startswith('No status line')
+        return isinstance(error, SocketError) and not isinstance(error, socket.timeout) and \
+            error.errno == errno.ECONNRESET
+
+    def clear(self):
+        """
+            Close all idle connections.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, last_used in idle:
+            connection.close()
+
+
+class ResponseCache(object):
+    """
+        LRU cache of the raw responses of read-only API commands (list* and
+        get*), keyed on the command name and its arguments. A cached response
+        is used for 'ttl' seconds, or for the time given for the command in
+        the dict 'ttls' (a time of 0 means the command is never cached);
+        at most 'maxsize' responses are kept.
+        A mutating command (deploy*, destroy*, create*, delete*, start*,
+        stop* and similar) removes the cached responses of the list commands
+        for the same kind of object, e.g. destroyVirtualMachine removes the
+        responses of listVirtualMachines.
+        Concurrent calls for a response which is not cached are combined, so
+        that only one of them makes the API call.
+    """
+    MUTATING_PREFIXES = ('deploy', 'destroy', 'create', 'delete', 'start', 'stop', 'reboot', 'update',
+                         'associate', 'disassociate', 'assign', 'remove', 'add', 'attach', 'detach',
+                         'reset', 'restore', 'scale', 'migrate', 'recover', 'expunge')
+    # List commands affected by mutating commands whose object name is not part of the list command name
+    INVALIDATES = {
+        'PrivateDirectConnect': ['listNetworks'],
+        'LocalNetwork': ['listNetworks'],
+        'IpAddress': ['listPublicIpAddresses'],
+        'ToLoadBalancerRule': ['listLoadBalancerRuleInstances'],
+        'FromLoadBalancerRule': ['listLoadBalancerRuleInstances'],
+        'NicToVirtualMachine': ['listVirtualMachines', 'listNics'],
+        'NicFromVirtualMachine': ['listVirtualMachines', 'listNics'],
+    }
+    DEFAULT_TTLS = {'listAsyncJobs': 0, 'getApiLimit': 0}
+
+    def __init__(self, ttl=60, ttls=None, maxsize=256):
+        self.ttl = ttl
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(command, args):
+        # (the values are compared as UTF-8 byte strings, so that a byte string with non-ASCII
+        # characters, e.g. a name from the command line, and the same unicode string share a key)
+        return (command, tuple(sorted((k.lower(), v.encode('utf-8') if isinstance(v, unicode) else str(v))
+                                      for k, v in args.items()
+                                      if k not in ('apiKey', 'response', 'command', 'signature'))))
+
+    def is_mutating(self, command):
+        return command.startswith(self.MUTATING_PREFIXES)
+
+    def ttl_for(self, command):
+        if not command.startswith(('list', 'get')):
+            return 0
+        return self.ttls.get(command, self.ttl)
+
+    def fetch(self, command, args, fn):
+        """
+            Return the response of the API call 'command' with 'args' from
+            the cache, or call fn() to get the response and cache it.
+        """
+        ttl = self.ttl_for(command)
+        if ttl <= 0:
+            data = fn()
+            if self.is_mutating(command):
+                self.invalidate(command)
+            return data
+        key = self.key(command, args)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+                return entry[1]
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                inflight = self._inflight[key] = VDCFuture()
+                self.misses += 1
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            with self._lock:
+                self.coalesced += 1
+            return inflight.result()
+        try:
+            data = fn()
+        except BaseException:
+            with self._lock:
+                del self._inflight[key]
+            inflight.set_exc_info(sys.exc_info())
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, data)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        inflight.set_result(data)
+        return data
+
+    def invalidate(self, command=None):
+        """
+            Remove the cached list responses affected by the mutating
+            command 'command', or all cached responses if no command is given.
+        """
+        with self._lock:
+            if command is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+                return
+            name = command[len([p for p in self.MUTATING_PREFIXES if command.startswith(p)][0]):]
+            targets = self.INVALIDATES.get(name)
+            if targets is not None:
+                matches = lambda c: c in targets
+            else:
+                matches = lambda c: c.startswith('list') and name.lower() in c.lower()
+            stale = [key for key in self._entries if matches(key[0])]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def stats(self):
+        """
+            Return a dict of the cache statistics.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced, 'evictions': self.evictions,
+                    'invalidations': self.invalidations, 'size': len(self._entries)}
+
+
+class RateLimiter(object):
+    """
+        Token bucket limiting the rate of API calls made by a VDCApiCall
+        object to stay within the account's API call limit. The bucket is
+        seeded from the response of getApiLimit: the calls still allowed
+        ('apiAllowed' less 'apiIssued') are spread over the time until the
+        limit is reset ('expireAfter' seconds), with bursts of up to 'burst'
+        calls, and it is seeded again when that time has passed.
+        If the server rejects a call for exceeding the limit, the rate is
+        halved and the call is tried again after a pause; each successful
+        call then raises the rate a little, back up to the seeded rate.
+        Until it has been seeded, and if getApiLimit is not available, calls
+        are not limited except after a rejection.
+    """
+    def __init__(self, burst=10, min_rate=0.1):
+        self.burst = burst
+        self.min_rate = min_rate
+        self.rate = None
+        self.max_rate = None
+        self.tokens = 0.0
+        self.updated = time.time()
+        self.reseed_at = 0
+        self.seeding = False
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+        self.throttles = 0
+
+    def needs_seed(self):
+        """
+            Return True (to one caller at a time) if the limiter should be
+            seeded from getApiLimit now.
+        """
+        with self._lock:
+            if self.seeding or time.time() < self.reseed_at:
+                return False
+            self.seeding = True
+            return True
+
+    def seed(self, apilimit):
+        """
+            Seed the limiter from the 'apilimit' dict of a getApiLimit
+            response, or just schedule another try if it is None.
+        """
+        with self._lock:
+            self.seeding = False
+            if apilimit is None:
+                self.reseed_at = time.time() + 300
+                return
+            expire_after = max(float(apilimit.get('expireAfter', 1)), 1.0)
+            remaining = max(int(apilimit['apiAllowed']) - int(apilimit.get('apiIssued', 0)), 0)
+            self.max_rate = max(remaining / expire_after, self.min_rate)
+            self.rate = self.max_rate
+            self.tokens = min(self.burst, remaining)
+            self.updated = time.time()
+            self.reseed_at = self.updated + expire_after
+
+    def acquire(self):
+        """
+            Take a token for one API call, sleeping until one is available.
+        """
+        with self._lock:
+            if self.rate is None:
+                return
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+            if wait > 0:
+                self.waits += 1
+                self.wait_time += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """
+            Record that the server rejected a call for exceeding the API
+            limit. Returns the number of seconds to wait before trying again.
+        """
+        with self._lock:
+            self.throttles += 1
+            if self.rate is None:
+                self.rate = 1.0
+            else:
+                self.rate = max(self.rate / 2, self.min_rate)
+            self.tokens = min(self.tokens, 0)
+            self.updated = time.time()
+            if retry_after is not None:
+                return retry_after
+            return 1 / self.rate
+
+    def succeeded(self):
+        """
+            Record a call accepted by the server, raising the rate a little
+            after a rejection.
+        """
+        with self._lock:
+            if self.rate is not None and self.rate != self.max_rate:
+                if self.max_rate is None:
+                    self.rate *= 1.05
+                else:
+                    self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def stats(self):
+        """
+            Return a dict of the limiter statistics.
+        """
+        with self._lock:
+            return {'rate': self.rate, 'max_rate': self.max_rate, 'waits': self.waits,
+                    'wait_time': self.wait_time, 'throttles': self.throttles}
+
 
 class VDCApiCall(object):
     """
         Class for making signed API calls to the Interoute VDC.
+        One object can be used by any number of threads at the same time
+        (worker threads, GPIO callbacks, Tk timers): each call takes its own
+        connection from the connection pool, the cache, rate limiter,
+        metrics, tracer, command table and job watcher are safe to share,
+        and the args dict given to a call is never changed, so the same
+        dict can be used for several calls at once.
     """
-    def __init__(self, api_url, apiKey, secret):
+    def __init__(self, api_url, apiKey, secret, pool_size=4, idle_timeout=30, cache=None, rate_limit=False,
+                 retries=3, retry_delay=1, metrics=None, tracer=None, post_size=1024, compress=True, commands=None):
         """
             Initialise the signed API call object with the URL and the
             required API key and Secret key.
+            HTTP connections to the API are kept open and reused between
+            calls: 'pool_size' is the maximum number of idle connections
+            kept, and 'idle_timeout' the number of seconds after which an
+            idle connection is not reused.
+            If 'cache' is a ResponseCache object, responses of read-only
+            commands are taken from the cache when possible.
+            If 'rate_limit' is True (or a RateLimiter object), the rate of
+            calls is limited to stay within the account's API call limit.
+            Read-only calls (list*, get* and query*) which fail with a
+            connection error or a server error are tried again up to
+            'retries' times, after a delay starting at 'retry_delay' seconds
+            and growing for each retry.
+            If 'metrics' is a MetricsRegistry object (see vdc_metrics.py),
+            the latency, size, errors and retries of every call are recorded
+            in it.
+            If 'tracer' is a Tracer object (see vdc_trace.py), a span is
+            recorded for every call, job wait and sleep.
+            Calls whose signed parameters are longer than 'post_size' bytes
+            (such as calls with userdata or long lists of network IDs) are
+            sent as POST requests, and the others as GET requests. If
+            'compress' is true the API is asked for gzip-compressed responses.
+            If 'commands' is True (or a CommandTable object), the table of
+            API commands is loaded when the first command is called (see
+            CommandTable.load). The name of an unknown command then raises
+            AttributeError, and a call without a required parameter raises
+            VDCParameterError, before anything is sent to the API.
         """
         self.api_url = api_url
         self.apiKey = apiKey
-        self.secret = secret
+        # (the keys read from a JSON config file are unicode, which hmac does not accept)
+        self.secret = str(secret)
+        self._hmac = hmac.new(self.secret, digestmod=hashlib.sha1)
+        self.pool = ConnectionPool(api_url, pool_size, idle_timeout)
+        self.cache = cache
+        if rate_limit is True:
+            rate_limit = RateLimiter()
+        self.limiter = rate_limit or None
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.metrics = metrics
+        self.tracer = tracer
+        self.post_size = post_size
+        self.compress = compress
+        self._command_table = commands
+        self._commands_lock = threading.Lock()
+        self._job_watcher = None
 
-    def request(self, args):
+    def connection_stats(self):
+        """
+            Return a dict of counters for the connection pool: 'new' and
+            'reused' connections, idle connections 'expired' by the idle
+            timeout, and 'stale' connections found closed by the server.
+        """
+        with self.pool._lock:
+            return dict(self.pool.stats)
+
+    def request(self, args, stream=False):
         """
             Form the request based on the provided args and using the apikey
             and secret. This ensures the request has the correct signature
             calculated.
+            Returns the response body, or with 'stream=True' the
+            PooledResponse for the body to be read from.
+            Raises VDCHTTPError if the API returns an error status, and
+            VDCConnectionError if the API server cannot be reached.
+        """
+        return self.send_signed(self._sign(args), args.get('command', ''), args.get('region', 'default'), stream)
+
+    def send_signed(self, request_data, command='', region='default', stream=False):
+        """
+            Send a request whose query string has already been signed (e.g.
+            by another process), as request() does after signing it. The
+            'command' and 'region' are used for the retries, the metrics and
+            the trace.
+        """
+        if self.limiter is not None and self.limiter.needs_seed():
+            self._seed_limiter()
+        retries = self.retries if is_idempotent(command) else 0
+        delays = backoff_delays(self.retry_delay, max_delay=30)
+        while True:
+            start = time.time()
+            try:
+                connection = self._send(request_data, stream, command, region)
+            except VDCError as e:
+                self._record(command, region, start, len(request_data), error=e.__class__.__name__)
+                if not e.retryable or retries == 0:
+                    raise
+                retries -= 1
+                if self.metrics is not None:
+                    self.metrics.retry(command, region)
+                self._sleep(next(delays), 'retry delay')
+                continue
+            if stream:
+                # the size of a streamed response is known when it has been read
+                connection.on_release = lambda response: self._record(
+                    command, region, start, len(request_data), response.bytes_read)
+                return connection
+            self._record(command, region, start, len(request_data), connection.bytes_read)
+            return connection.data
+
+    def _record(self, command, region, start, sent, received=0, error=None):
+        """
+            Record an API call started at time 'start' in the metrics and the
+            trace, if they are in use.
+        """
+        if self.metrics is not None:
+            self.metrics.observe(command, region, time.time() - start, sent, received, error)
+        if self.tracer is not None:
+            self.tracer.complete(command, 'api', start, region=region, sent=sent, received=received, error=error)
+
+    def _sleep(self, seconds, name='sleep'):
+        """
+            time.sleep(), recorded in the trace if there is one.
+        """
+        if self.tracer is not None:
+            self.tracer.sleep(seconds, name)
+        else:
+            time.sleep(seconds)
+
+    def _send(self, request_data, stream, command, region):
+        """
+            Send the signed request and return the PooledResponse. A call
+            rejected for exceeding the API limit is tried again when the
+            rate limiter is in use.
         """
-        args['apiKey'] = self.apiKey
-
-        request = zip(args.keys(), args.values())
-        request.sort(key=lambda x: x[0].lower())
-        request_data = "&".join(["=".join([r[0], urllib.quote_plus(str(r[1]),safe='*')])
-                                for r in request])
-        hashStr = "&".join(
-            [
-                "=".join(
-                    [r[0].lower(),
-                     str.lower(urllib.quote_plus(str(r[1]),safe='*')).replace(
-                         "+", "%20"
-                     )]
-                ) for r in request
-            ]
-        )
-
-        sig = urllib.quote_plus(base64.b64encode(
-            hmac.new(
-                self.secret,
-                hashStr,
-                hashlib.sha1
-            ).digest()
-        ).strip())
-
-        request_data += "&signature=%s" % sig
+        throttled_retries = 5
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire()
+            headers = {'Accept-Encoding': 'gzip'} if self.compress else {}
+            try:
+                if len(request_data) > self.post_size:
+                    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+                    connection = self.pool.urlopen('POST', self.pool.path, request_data, headers, preload=not stream,
+                                                   resend=is_idempotent(command))
+                else:
+                    connection = self.pool.urlopen('GET', self.pool.path + "?" + request_data, None, headers,
+                                                   preload=not stream, resend=is_idempotent(command))
+            except (SocketError, httplib.HTTPException) as e:
+                raise VDCConnectionError(e, self.api_url)
+            if not self._is_throttled(connection):
+                if self.limiter is not None:
+                    self.limiter.succeeded()
+                break
+            if self.limiter is None or throttled_retries == 0:
+                break
+            # the call was rejected for exceeding the API limit, so wait and try it again
+            connection.close()
+            throttled_retries -= 1
+            if self.metrics is not None:
+                self.metrics.retry(command, region)
+            self._sleep(self.limiter.throttled(self._retry_after(connection)), 'rate limit')
+        if connection.status >= 400:
+            connection.close()
+            description = connection.getheader('X-Description', '(No extended error message.)')
+            if self._is_throttled(connection):
+                raise VDCRateLimitError(connection.status, description, self._retry_after(connection))
+            raise VDCHTTPError(connection.status, description)
+        return connection
+
+    def _sign(self, args):
+        """
+            Return the query string for the API call with the given args,
+            signed with the secret key. The args dict is not changed.
+        """
+        return self._signed_query(dict(args, apiKey=self.apiKey))
+
+    def _signed_query(self, args):
+        """
+            Return the query string for the complete args of an API call
+            (with the apiKey), with its signature. Each value is quoted once
+            for both the query string and the string which is signed, and
+            the keyed HMAC state is copied rather than keyed again.
+        """
+        request = sorted([(key, urllib.quote_plus(str(value), safe='*')) for key, value in args.iteritems()],
+                         key=lambda x: x[0].lower())
+        request_data = "&".join([key + "=" + value for key, value in request])
+        hashStr = "&".join([key.lower() + "=" + value.lower().replace("+", "%20") for key, value in request])
+        digest = self._hmac.copy()
+        digest.update(hashStr)
         # print the URL string for debug
-        ###print(request_data)
         ###print(self.api_url + "?" + request_data)
+        return request_data + "&signature=" + urllib.quote_plus(base64.b64encode(digest.digest()))
 
+    def presign(self, command, args={}, ttl=300, read_only=True):
+        """
+            Return (url, expires): a URL for the API call, signed to expire
+            'ttl' seconds from now (signatureVersion 3), and its expiry time
+            in seconds since the epoch. The URL can be used without the API
+            keys (e.g. by a worker node) until it expires. With 'read_only'
+            (the default), a command which is not read-only (list*, get*
+            and query*) raises VDCParameterError.
+        """
+        return self.presign_many([(command, args)], ttl, read_only)[0]
+
+    def presign_many(self, calls, ttl=300, read_only=True):
+        """
+            presign() for each (command, args) of 'calls', all with the
+            same expiry time. Returns a list of (url, expires).
+        """
+        expires = int(time.time()) + ttl
+        common = {'apiKey': self.apiKey, 'response': 'json', 'signatureVersion': 3,
+                  'expires': time.strftime('%Y-%m-%dT%H:%M:%S+0000', time.gmtime(expires))}
+        urls = []
+        for command, args in calls:
+            if read_only and not is_idempotent(command):
+                raise VDCParameterError('%s is not a read-only command, so it cannot be presigned' % command)
+            urls.append((self.api_url + "?" + self._signed_query(dict(args, command=command, **common)), expires))
+        return urls
+
+    def _seed_limiter(self):
+        """
+            Seed the rate limiter from the account's API call limit. Any error
+            is ignored, leaving the rate unlimited until the next try.
+        """
+        apilimit = None
         try:
-            connection = urllib2.urlopen(self.api_url + "?" + request_data ) # GET request
-            ##connection = urllib2.urlopen(self.api_url, request_data) # POST request
-            response = connection.read()
-        except SocketError as e:
-            if e.errno != errno.ECONNRESET:
-                # not a RESET error so report it and exit
-                print('Socket error: %s' % e.errno)
-                sys.exit()
-            # ignore a RESET error and carry on by returning an empty response
-            error_timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+0000")
-            print("\n%s Exception for socket error 104 for request:\n%s" % (error_timestamp,self.api_url + "?" + request_data))
-            return '{"CONNECTIONERRORresponse":{}}'
-        except urllib2.HTTPError as error:
-            print('HTTP Error: %s' % error.code)
-            description = str(error.info())
-            description = description.split('\n')
-            description = [line
-                           for line
-                           in description
-                           if line.startswith('X-Description: ')]
-
-            if len(description) > 0:
-                description = description[0].split(':', 1)[-1].lstrip()
-            else:
-                description = '(No extended error message.)'
+            connection = self.pool.urlopen('GET', self.pool.path + "?" + self._sign({'command': 'getApiLimit'}))
+            if connection.status < 400:
+                reply = json.loads(connection.data).values()[0]['apilimit']
+                apilimit = {'apiAllowed': int(reply['apiAllowed']), 'apiIssued': int(reply.get('apiIssued', 0)),
+                            'expireAfter': float(reply.get('expireAfter', 1))}
+        except (SocketError, httplib.HTTPException, ValueError, AttributeError, IndexError, KeyError, TypeError):
+            pass
+        finally:
+            # (the limiter is always seeded or given a time for another try, so it is never left seeding)
+            self.limiter.seed(apilimit)
 
-            print(description)
-            sys.exit()
-        return response
+    @staticmethod
+    def _is_throttled(connection):
+        """
+            Return True if the response shows the call was rejected for
+            exceeding the API call limit. This is HTTP status 429
+            (API_LIMIT_EXCEED in CloudStack), or an error whose description
+            mentions the API limit.
+        """
+        if connection.status == 429:
+            return True
+        if connection.status >= 400:
+            description = connection.getheader('X-Description', '').lower()
+            return 'api limit' in description or 'limit exceeded' in description
+        return False
 
-    def wait_for_job(self, job_id, delay=2, display_progress=True):
+    @staticmethod
+    def _retry_after(connection):
+        """
+            Return the seconds of the Retry-After header of a response, or None.
+        """
+        try:
+            return float(connection.getheader('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    def wait_for_job(self, job_id, delay=None, display_progress=True, timeout=None,
+                     initial_delay=0.5, max_delay=10, progress=None, region=None):
         """
             Wait for the given job ID to return a result.
-            Sleeps for 'delay' seconds between each check for the job
-            finishing- default 2.
-            Will output a '.' for every 'delay' if 'display_progress' is true.
+            The first check for the job finishing is made after
+            'initial_delay' seconds, then the delay between checks grows
+            exponentially (with random jitter) up to 'max_delay' seconds.
+            If 'delay' is given, the checks are made every 'delay' seconds
+            instead.
+            Raises VDCJobTimeout if the job has not finished after 'timeout'
+            seconds (default: wait for ever).
+            After every check progress(job_id, elapsed_seconds, result) is
+            called if a 'progress' function is given; otherwise a '.' is
+            output for every check if 'display_progress' is true.
         """
         request = {
             'jobid': job_id,
         }
+        if region is not None:
+            request['region'] = region
+        if progress is None and display_progress:
+            progress = print_progress_dot
+        if delay is not None:
+            delays = itertools.repeat(delay)
+        else:
+            delays = backoff_delays(initial_delay, max_delay)
+        start = time.time()
+        try:
+            self._sleep(next(delays), 'job poll delay')
+            while(True):
+                result = self.queryAsyncJobResult(dict(request))
+                elapsed = time.time() - start
+                if progress is not None:
+                    progress(job_id, elapsed, result)
+                if 'jobresult' in result:
+                    if progress is print_progress_dot:
+                        print('')
+                    return result['jobresult']
+                wait = next(delays)
+                if timeout is not None:
+                    if elapsed >= timeout:
+                        raise VDCJobTimeout('Job %s not finished after %d seconds' % (job_id, timeout))
+                    wait = min(wait, start + timeout - time.time())
+                self._sleep(max(wait, 0), 'job poll delay')
+        finally:
+            if self.tracer is not None:
+                self.tracer.complete('wait_for_job', 'job', start, jobid=job_id)
+
+    def wait_for_job_async(self, job_id, **kwargs):
+        """
+            Non-blocking form of wait_for_job: returns at once with a
+            VDCFuture for the job result, and the job is waited for on a
+            background thread. The arguments are as for wait_for_job, with
+            'display_progress' False by default.
+        """
+        kwargs.setdefault('display_progress', False)
+        return run_in_thread(lambda: self.wait_for_job(job_id, **kwargs))
+
+    def wait_for_jobs(self, jobs, timeout=None, delay=2, display_progress=True):
+        """
+            Wait for a set of async jobs to finish. This is a generator which
+            yields (job_id, result) for each job as soon as it has finished,
+            where 'result' has the same form as the response of
+            queryAsyncJobResult (the job result is in result['jobresult']).
+            'jobs' is a list of job IDs, or a dict {job_id: region} for jobs
+            which are not in the default region.
+            The pending jobs are checked every 'delay' seconds with one
+            listAsyncJobs call for each region, however many jobs there are.
+            Jobs still pending after 'timeout' seconds are not yielded.
+            Will output a '.' for every check if 'display_progress' is true.
+        """
+        if isinstance(jobs, dict):
+            pending = dict(jobs)
+        else:
+            pending = dict.fromkeys(jobs)
+        deadline = None if timeout is None else time.time() + timeout
+        # only list the jobs started since the day before, to keep the listAsyncJobs responses small
+        startdate = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        start = time.time()
+        try:
+            while pending:
+                regions = {}
+                for job_id, region in pending.items():
+                    regions.setdefault(region, []).append(job_id)
+                for region, job_ids in regions.items():
+                    for job_id, result in self._check_jobs(job_ids, region, startdate):
+                        del pending[job_id]
+                        yield job_id, result
+                if not pending or (deadline is not None and time.time() >= deadline):
+                    return
+                if display_progress:
+                    print('.', end='')
+                    sys.stdout.flush()
+                self._sleep(delay, 'job poll delay')
+        finally:
+            if self.tracer is not None:
+                self.tracer.complete('wait_for_jobs', 'job', start, jobs=len(jobs), pending=len(pending))
+
+    def _check_jobs(self, job_ids, region, startdate):
+        """
+            Return a list of (job_id, result) for the jobs in 'job_ids' which
+            have finished, checked with one listAsyncJobs call. A job which is
+            not in the listAsyncJobs response is checked with
+            queryAsyncJobResult.
+        """
+        request = {'startdate': startdate, 'listall': True}
+        if region is not None:
+            request['region'] = region
+        listed = self.listAsyncJobs(request).get('asyncjobs', [])
+        listed = dict((job['jobid'], job) for job in listed if job.get('jobid') in job_ids)
+        finished = []
+        for job_id in job_ids:
+            result = listed.get(job_id)
+            if result is None:
+                request = {'jobid': job_id}
+                if region is not None:
+                    request['region'] = region
+                result = self.queryAsyncJobResult(request)
+            if result.get('jobstatus', 0) != 0 or 'jobresult' in result:
+                finished.append((job_id, result))
+        return finished
+
+    def job_watcher(self):
+        """
+            Return the JobWatcher of this object, which is made the first
+            time it is needed.
+        """
+        if self._job_watcher is None:
+            with self._commands_lock:
+                if self._job_watcher is None:
+                    self._job_watcher = JobWatcher(self)
+        return self._job_watcher
+
+    def watch_job(self, job_id, region=None, timeout=None):
+        """
+            Return at once with a VDCFuture for the result of the async job
+            'job_id'. The job is checked together with all of the other
+            watched jobs by the JobWatcher of this object. The future's
+            result is the job result of a job which succeeded; for a job
+            which failed it raises VDCJobError, and for a job which has not
+            finished after 'timeout' seconds it raises VDCJobTimeout.
+        """
+        return self.job_watcher().watch(job_id, region, timeout)
 
-        while(True):
-            result = self.queryAsyncJobResult(request)
-            if display_progress:
-                print('.', end='')
-                sys.stdout.flush()
-            if 'jobresult' in result:
-                print('')
-                return result['jobresult']
-            time.sleep(delay)
+    def fan_out(self, command, args={}, regions=VDC_REGIONS, timeout=None, **kwargs):
+        """
+            Make the API call 'command' in each of the 'regions' at the same
+            time, and return a FanOutResult with the results merged. Each
+            region's call runs on its own thread; 'kwargs' are options for
+            _make_request such as 'fields' and 'records'. A region whose
+            call fails, or has not finished after 'timeout' seconds, is
+            left out of the result and its error is kept in 'errors'.
+        """
+        return merge_regions(self._fan_out_calls(command, args, regions, kwargs, run_in_thread), timeout)
+
+    def _fan_out_calls(self, command, args, regions, kwargs, submit):
+        if self.command_table() is not None:
+            self._command_table.check(command, args)
+        return [(r, submit(lambda r=r: self._make_request(command, dict(args, region=r), **kwargs)))
+                for r in regions]
+
+    def command_table(self):
+        """
+            Return the CommandTable of the API, loading it the first time if
+            'commands' was True, or None if no table is used.
+        """
+        if self._command_table is True:
+            with self._commands_lock:
+                if self._command_table is True:
+                    self._command_table = CommandTable.load(self)
+        return self._command_table
 
     def __getattr__(self, name):
-        def handlerFunction(*args, **kwargs):
-            if kwargs:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        command = name[len('iter_'):] if name.startswith('iter_') else name
+        table = self.command_table()
+        if table is not None and command not in table:
+            raise AttributeError("The VDC API has no command '%s'" % command)
+        if name.startswith('iter_'):
+            def iteratorFunction(args={}, pagesize=500, prefetch=True, fields=None, records=False):
+                return PageIterator(self, command, args, pagesize, prefetch, fields, records)
+            handler = iteratorFunction
+        else:
+            def handlerFunction(*args, **kwargs):
+                # with the arguments dict given, keyword arguments are options for _make_request,
+                # otherwise the keyword arguments are the arguments of the API call
+                if args:
+                    return self._make_request(name, args[0], **kwargs)
                 return self._make_request(name, kwargs)
-            return self._make_request(name, args[0])
-        return handlerFunction
+            handler = handlerFunction
+        # the function is kept as an attribute, so later calls of the command do not come here again
+        setattr(self, name, handler)
+        return handler
 
-    def _make_request(self, command, args):
-        args['response'] = 'json'
-        args['command'] = command
-        data = self.request(args)
+    def _make_request(self, command, args, fields=None, records=False):
+        """
+            Make the API call 'command' and return the decoded response.
+            If a list of 'fields' is given, the response is decoded as it
+            is received, one record at a time, and only the given fields of
+            each record are kept; nested fields are given as paths such as
+            'nic.ipaddress'. (The streamed decoding is no faster than
+            json.loads, but its memory hardly grows with the size of the
+            response: see the 'decode' benchmark of vdc_benchmark.py.) With
+            a cache, the whole response is cached as for a call without
+            'fields', and the fields are taken from it after it is decoded.
+            With 'records=True', lists of VMs, NICs, networks and port
+            forwarding and load balancer rules are returned as compact
+            record objects (see vdc_records.py) instead of dicts.
+        """
+        if self._command_table is not None:
+            self.command_table().check(command, args)
+        # (a new dict, so that the caller's args are not changed)
+        args = dict(args, response='json', command=command)
+        record_types = None
+        if records:
+            import vdc_records
+            record_types = vdc_records.RECORD_TYPES
+        if fields is not None and self.cache is None:
+            connection = self.request(args, stream=True)
+            try:
+                return StreamingDecoder(connection.read, fields, record_types).decode()
+            finally:
+                connection.close()
+        if self.cache is not None:
+            data = self.cache.fetch(command, args, lambda: self.request(args))
+        else:
+            data = self.request(args)
         # The response is of the format {commandresponse: actual-data}
         ##key = command.lower() + "response"
         ##  Temporary change due to incompatible behaviour of the new network commands
         ##return json.loads(data)[key]
         ##print("DEBUG data: %s" % data)
-        return json.loads(data).values()[0]
+        result = json.loads(data).values()[0]
+        if fields is not None:
+            # (as by StreamingDecoder, the fields are kept from the records of the lists)
+            projection = make_projection(fields)
+            result = dict((key, project_fields(value, projection) if isinstance(value, list) else value)
+                          for key, value in result.items())
+        if records:
+            result = vdc_records.convert_response(result)
+        return result
+
+
+class CommandTable(object):
+    """
+        Table of the API commands given by the listApis call: 'commands'
+        maps each command name to the list of its required parameters.
+    """
+    def __init__(self, commands):
+        self.commands = commands
+
+    @classmethod
+    def load(cls, api, path=COMMANDS_FILE, ttl=86400):
+        """
+            Return the command table for the API of the VDCApiCall 'api'.
+            The table is read from the cache file 'path' if it was written
+            for the same API URL less than 'ttl' seconds ago; otherwise it
+            is fetched with the listApis call and written to the file.
+        """
+        try:
+            with open(path) as fh:
+                cached = json.load(fh)
+            if cached['api_url'] == api.api_url and 0 <= time.time() - cached['fetched'] < ttl:
+                return cls(cached['commands'])
+        except (IOError, ValueError, KeyError):
+            pass
+        # (the call is made with request() because the table is not there yet to check it)
+        result = json.loads(api.request({'command': 'listApis', 'response': 'json'})).values()[0]
+        commands = dict((a['name'], [p['name'] for p in a.get('params', []) if p.get('required')])
+                        for a in result.get('api', []))
+        try:
+            temp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(temp_path, 'w') as fh:
+                json.dump({'api_url': api.api_url, 'fetched': time.time(), 'commands': commands}, fh)
+            os.rename(temp_path, path)
+        except (IOError, OSError):
+            pass
+        return cls(commands)
+
+    def __contains__(self, command):
+        return command in self.commands
+
+    def check(self, command, args):
+        """
+            Raise VDCParameterError if 'command' is not in the table or
+            'args' is missing a required parameter of the command.
+        """
+        required = self.commands.get(command)
+        if required is None:
+            raise VDCParameterError("The VDC API has no command '%s'" % command)
+        missing = [p for p in required if p not in args]
+        if missing:
+            raise VDCParameterError('Missing required parameters for %s: %s' % (command, ', '.join(missing)))
+
+
+class StreamingDecoder(object):
+    """
+        Incremental decoder for API responses of the form
+            {"<command>response": {"count": N, "<name>": [{record}, {record}, ...]}}
+        The response is read in chunks by calling read(size), and the records
+        are decoded one at a time as the data arrives, so the whole response
+        text is never held in memory. If 'fields' is given, only those fields
+        of each record are kept (see project_fields). If a dict
+        'record_types' of record classes is given, the records of a list
+        whose name is in the dict are made into records of that class.
+        decode() returns the same data as json.loads(response).values()[0].
+    """
+    chunk_size = 65536
+    whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, read, fields=None, record_types=None):
+        self.read = read
+        self.projection = make_projection(fields) if fields is not None else None
+        self.record_types = record_types or {}
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self.pos = self.whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of API response')
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError('Expected %r at position %d of API response' % (char, self.pos))
+        self.pos += 1
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a value ending at the end of the data read so far may be incomplete,
+                # and so may a number followed by more characters of a number (e.g. '2.' of '2.5')
+                if self.eof or (end < len(self.buf) and not (isinstance(value, (int, long, float))
+                                                             and self.buf[end] in '.eE+-0123456789')):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def _records(self, record_type=None):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            record = self._value()
+            if self.projection is not None:
+                record = project_fields(record, self.projection)
+            if record_type is not None:
+                record = record_type.from_dict(record)
+            yield record
+            char = self._peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('Expected \',\' or \']\' at position %d of API response' % (self.pos - 1))
+
+    def decode(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return {}
+        self._value()  # the '<command>response' key
+        self._expect(':')
+        if self._peek() != '{':
+            return self._value()
+        self.pos += 1
+        result = {}
+        while self._peek() != '}':
+            name = self._value()
+            self._expect(':')
+            if self._peek() == '[':
+                result[name] = list(self._records(self.record_types.get(name)))
+            else:
+                result[name] = self._value()
+            if self._peek() == ',':
+                self.pos += 1
+        return result
+
+
+def make_projection(fields):
+    """
+        Make the projection used by project_fields from a list of field
+        paths, e.g. ['id', 'nic.ipaddress', 'nic.networkid'] gives
+        {'id': None, 'nic': {'ipaddress': None, 'networkid': None}}.
+    """
+    projection = {}
+    for field in fields:
+        node = projection
+        parts = field.split('.')
+        for part in parts[:-1]:
+            if node.get(part, {}) is None:
+                break
+            node = node.setdefault(part, {})
+        else:
+            node[parts[-1]] = None
+    return projection
+
+
+def project_fields(value, projection):
+    """
+        Return a copy of the decoded JSON 'value' keeping only the fields in
+        'projection'. Lists are projected item by item.
+    """
+    if isinstance(value, list):
+        return [project_fields(item, projection) for item in value]
+    if not isinstance(value, dict):
+        return value
+    result = {}
+    for name, subprojection in projection.iteritems():
+        if name in value:
+            if subprojection is None:
+                result[name] = value[name]
+            else:
+                result[name] = project_fields(value[name], subprojection)
+    return result
+
+
+class VDCFuture(object):
+    """
+        The result of an API call running in the background. result() blocks
+        until the call has finished and returns its result, or raises the
+        exception raised by the call.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise VDCFutureTimeout('Result not available after %s seconds' % timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise VDCFutureTimeout('Result not available after %s seconds' % timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, fn):
+        """
+            Call fn(future) when the future is done (at once if it is done
+            already). The callback runs in the thread that finished the call.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+
+class VDCError(Exception):
+    """
+        Base class of the errors raised by VDCApiCall. 'retryable' is True
+        for errors after which the same call may succeed if it is made again.
+    """
+    retryable = False
+
+
+class VDCHTTPError(VDCError):
+    """
+        The API returned an HTTP error status. 'code' is the status and
+        'description' the extended error message from the X-Description
+        header.
+    """
+    def __init__(self, code, description):
+        VDCError.__init__(self, 'HTTP Error %s: %s' % (code, description))
+        self.code = code
+        self.description = description
+        self.retryable = code >= 500
+
+
+class VDCRateLimitError(VDCHTTPError):
+    """
+        The API rejected the call for exceeding the account's API call
+        limit. 'retry_after' is the time in seconds to wait before trying
+        again, if the server gave one.
+    """
+    def __init__(self, code, description, retry_after=None):
+        VDCHTTPError.__init__(self, code, description)
+        self.retry_after = retry_after
+        self.retryable = True
+
+
+class VDCConnectionError(VDCError):
+    """
+        The API server could not be reached or closed the connection.
+        'reason' is the socket or HTTP protocol error, and 'errno' its error
+        number if it has one.
+    """
+    retryable = True
+
+    def __init__(self, reason, api_url):
+        VDCError.__init__(self, 'Connection error for %s: %s' % (api_url, str(reason) or reason.__class__.__name__))
+        self.reason = reason
+        self.errno = getattr(reason, 'errno', None)
+
+
+class VDCParameterError(VDCError):
+    """
+        The call was not made because the command does not exist or a
+        required parameter is missing (as given by the CommandTable).
+    """
+
+
+class VDCFutureTimeout(VDCError):
+    pass
+
+
+class VDCJobTimeout(VDCError):
+    pass
+
+
+class VDCJobError(VDCError):
+    """
+        The async job 'job_id' finished with a failure. 'result' is its job
+        result, with the error code in 'code' and the error message in
+        'text'.
+    """
+    def __init__(self, job_id, result):
+        VDCError.__init__(self, 'Job %s failed: %s (error code %s)' % (job_id, result.get('errortext'), result.get('errorcode')))
+        self.job_id = job_id
+        self.result = result
+        self.code = result.get('errorcode')
+        self.text = result.get('errortext')
+
+
+class FanOutResult(dict):
+    """
+        Merged result of an API call made in several regions. The lists of
+        records of the regions are joined, with the region of each record
+        in its 'region' field, and the counts are added up. 'regions' maps
+        each region to its own result, and 'errors' maps each region where
+        the call failed to its exception.
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self.regions = OrderedDict()
+        self.errors = OrderedDict()
+
+    def add(self, region, result):
+        self.regions[region] = result
+        for key, value in result.items():
+            if isinstance(value, list):
+                for item in value:
+                    # (records of vdc_records.py have a 'region' field for this)
+                    if isinstance(item, dict) or 'region' in getattr(item, '__slots__', ()):
+                        item['region'] = region
+                self.setdefault(key, []).extend(value)
+            elif key == 'count':
+                self['count'] = self.get('count', 0) + value
+            else:
+                self.setdefault(key, value)
+
+
+def merge_regions(futures, timeout=None):
+    """
+        Wait for a list of (region, VDCFuture) pairs and return a
+        FanOutResult of their results. 'timeout' is the time in seconds
+        to wait for all of the futures together.
+    """
+    merged = FanOutResult()
+    deadline = None if timeout is None else time.time() + timeout
+    for region, future in futures:
+        try:
+            result = future.result(None if deadline is None else max(0, deadline - time.time()))
+        except Exception as e:
+            # (any error, e.g. a response which cannot be decoded, only loses the result of its own region)
+            merged.errors[region] = e
+            continue
+        merged.add(region, result)
+    merged.setdefault('count', 0)
+    return merged
+
+
+def is_idempotent(command):
+    """
+        Return True if the API command only reads data, so that it is safe
+        to make the call again after an error.
+    """
+    return command.startswith(('list', 'get', 'query'))
+
+
+def backoff_delays(initial_delay=0.5, max_delay=10, factor=1.6, jitter=0.2):
+    """
+        Generator of delays for polling: starts at 'initial_delay' and grows
+        by 'factor' each time up to 'max_delay', with each delay varied at
+        random by +/- 'jitter' (as a fraction) so that many pollers do not
+        stay in step.
+    """
+    delay = initial_delay
+    while True:
+        yield delay * random.uniform(1 - jitter, 1 + jitter)
+        delay = min(delay * factor, max_delay)
+
+
+def print_progress_dot(job_id, elapsed, result):
+    print('.', end='')
+    sys.stdout.flush()
+
+
+def run_in_thread(fn, *args):
+    """
+        Run fn(*args) on a new background thread and return a VDCFuture for
+        its result.
+    """
+    future = VDCFuture()
+    def runner():
+        try:
+            future.set_result(fn(*args))
+        except BaseException:
+            future.set_exc_info(sys.exc_info())
+    thread = threading.Thread(target=runner)
+    thread.daemon = True
+    thread.start()
+    return future
+
+
+def as_completed(futures):
+    """
+        Generator yielding the VDCFutures in the order that they finish.
+    """
+    finished = Queue.Queue()
+    for f in futures:
+        f.add_done_callback(finished.put)
+    for i in range(len(futures)):
+        yield finished.get()
+
+
+class JobWatcher(object):
+    """
+        Watcher of the async jobs of the VDCApiCall 'api', shared by all of
+        its callers. watch() can be called from any thread, and returns a
+        VDCFuture for the job. One background thread checks all of the
+        pending jobs together every 'delay' seconds, with one listAsyncJobs
+        call for each region however many jobs there are (see
+        VDCApiCall._check_jobs). The thread stops when no jobs are pending,
+        and is started again by the next watch().
+        A check which fails with a retryable error is made again at the
+        next round; any other error is raised by the futures of the jobs in
+        that region.
+    """
+    def __init__(self, api, delay=2):
+        self.api = api
+        self.delay = delay
+        self.checks = 0
+        # job ID -> (region, future, deadline)
+        self._jobs = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def watch(self, job_id, region=None, timeout=None):
+        """
+            Return a VDCFuture for the result of the job 'job_id' (see
+            VDCApiCall.watch_job). A job which is already being watched
+            gives the same future.
+        """
+        with self._lock:
+            if job_id in self._jobs:
+                return self._jobs[job_id][1]
+            future = VDCFuture()
+            self._jobs[job_id] = (region, future, None if timeout is None else time.time() + timeout)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='VDCJobWatcher')
+                self._thread.daemon = True
+                self._thread.start()
+        return future
+
+    def pending(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def _run(self):
+        # only list the jobs started since the day before, to keep the listAsyncJobs responses small
+        startdate = (datetime.datetime.utcnow() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+        while True:
+            with self._lock:
+                deadlines = [deadline for region, future, deadline in self._jobs.values() if deadline is not None]
+            wait = self.delay
+            if deadlines:
+                wait = max(0, min(wait, min(deadlines) - time.time()))
+            self.api._sleep(wait, 'job poll delay')
+            with self._lock:
+                regions = {}
+                for job_id, (region, future, deadline) in self._jobs.items():
+                    regions.setdefault(region, []).append(job_id)
+            for region, job_ids in regions.items():
+                try:
+                    finished = self.api._check_jobs(job_ids, region, startdate)
+                except VDCError as e:
+                    if not e.retryable:
+                        self._fail(job_ids, (e.__class__, e, sys.exc_info()[2]))
+                    continue
+                except Exception:
+                    self._fail(job_ids, sys.exc_info())
+                    continue
+                for job_id, result in finished:
+                    self._finish(job_id, result)
+            self.checks += 1
+            now = time.time()
+            with self._lock:
+                timedout = [(job_id, deadline) for job_id, (region, future, deadline) in self._jobs.items()
+                            if deadline is not None and now >= deadline]
+            for job_id, deadline in timedout:
+                e = VDCJobTimeout('Job %s not finished after the timeout' % job_id)
+                self._fail([job_id], (VDCJobTimeout, e, None))
+            with self._lock:
+                if not self._jobs:
+                    self._thread = None
+                    return
+
+    def _pop(self, job_id):
+        with self._lock:
+            entry = self._jobs.pop(job_id, None)
+        return entry and entry[1]
+
+    def _finish(self, job_id, result):
+        future = self._pop(job_id)
+        if future is None:
+            return
+        jobresult = result.get('jobresult', {})
+        if result.get('jobstatus') == 2:
+            future.set_exc_info((VDCJobError, VDCJobError(job_id, jobresult), None))
+        else:
+            future.set_result(jobresult)
+
+    def _fail(self, job_ids, exc_info):
+        for job_id in job_ids:
+            future = self._pop(job_id)
+            if future is not None:
+                future.set_exc_info(exc_info)
+
+
+class PageIterator(object):
+    """
+        Iterator over the records returned by a list* command, which fetches
+        the results one page of 'pagesize' records at a time, so that at most
+        two pages are held in memory. With 'prefetch=True' the next page is
+        fetched in the background while the records of the current page are
+        being used. Created by calling api.iter_<command>(args), for example:
+
+            for vm in api.iter_listVirtualMachines({'region': 'Europe'}, pagesize=500):
+                print(vm['name'])
+
+        The total number of records reported by the server is in the 'count'
+        attribute once the first record has been returned. If a list of
+        'fields' is given, only those fields of the records are kept, and with
+        'records=True' record objects are returned (see
+        VDCApiCall._make_request).
+    """
+    def __init__(self, api, command, args, pagesize=500, prefetch=True, fields=None, records=False):
+        self.api = api
+        self.command = command
+        self.args = dict(args)
+        self.pagesize = pagesize
+        self.prefetch = prefetch
+        self.fields = fields
+        self.records = records
+        self.count = None
+        self._records = self._generate()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return next(self._records)
+
+    def _fetch(self, page):
+        args = dict(self.args)
+        args['page'] = page
+        args['pagesize'] = self.pagesize
+        return self.api._make_request(self.command, args, fields=self.fields, records=self.records)
+
+    def _generate(self):
+        page = 1
+        result = self._fetch(page)
+        while True:
+            records = [value for value in result.values() if isinstance(value, list)]
+            records = records[0] if records else []
+            if self.count is None:
+                self.count = result.get('count', len(records))
+            last_page = len(records) < self.pagesize or page * self.pagesize >= self.count
+            if not last_page and self.prefetch:
+                next_result = run_in_thread(self._fetch, page + 1)
+            result = None
+            for record in records:
+                yield record
+            if last_page:
+                return
+            records = None
+            if self.prefetch:
+                result = next_result.result()
+            else:
+                result = self._fetch(page + 1)
+            page += 1
+
+
+class AsyncVDCApiCall(object):
+    """
+        Class for making signed API calls to the Interoute VDC concurrently.
+        Calls are made in the same way as with VDCApiCall, but each call
+        returns a VDCFuture at once, and up to 'max_concurrency' calls run at
+        the same time on a pool of worker threads:
+
+            futures = [api.listZones({'region': r}) for r in ['Europe', 'USA', 'Asia']]
+            zones = api.gather(futures)
+
+        (Python 2 has no asyncio, so the concurrency comes from threads
+        sharing the pooled HTTP connections of a VDCApiCall.)
+    """
+    def __init__(self, api_url, apiKey, secret, max_concurrency=8, **kwargs):
+        kwargs.setdefault('pool_size', max_concurrency)
+        self._start(VDCApiCall(api_url, apiKey, secret, **kwargs), max_concurrency)
+
+    @classmethod
+    def from_api(cls, api, max_concurrency=8):
+        """
+            Create an AsyncVDCApiCall which makes its calls through an
+            existing VDCApiCall object (and shares its connections).
+        """
+        self = cls.__new__(cls)
+        api.pool.pool_size = max(api.pool.pool_size, max_concurrency)
+        self._start(api, max_concurrency)
+        return self
+
+    def _start(self, api, max_concurrency):
+        self.api = api
+        self.max_concurrency = max_concurrency
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+    def _worker(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            future, fn, args = task
+            try:
+                future.set_result(fn(*args))
+            except BaseException:
+                future.set_exc_info(sys.exc_info())
+
+    def submit(self, fn, *args):
+        """
+            Run fn(*args) on a worker thread and return a VDCFuture for
+            its result.
+        """
+        with self._workers_lock:
+            if len(self._workers) < self.max_concurrency:
+                worker = threading.Thread(target=self._worker)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        future = VDCFuture()
+        self._queue.put((future, fn, args))
+        return future
+
+    def wait_for_job(self, job_id, *args, **kwargs):
+        return self.submit(lambda: self.api.wait_for_job(job_id, *args, **kwargs))
+
+    def watch_job(self, job_id, region=None, timeout=None):
+        """
+            VDCApiCall.watch_job: the job is checked by the JobWatcher of
+            the VDCApiCall, not on the worker threads.
+        """
+        return self.api.watch_job(job_id, region, timeout)
+
+    def fan_out(self, command, args={}, regions=VDC_REGIONS, timeout=None, **kwargs):
+        """
+            VDCApiCall.fan_out run on the worker threads. Returns a VDCFuture
+            for the FanOutResult.
+        """
+        calls = self.api._fan_out_calls(command, args, regions, kwargs, self.submit)
+        # (the results are merged on a separate thread, so that no worker is kept waiting for the others)
+        return run_in_thread(merge_regions, calls, timeout)
+
+    def gather(self, futures):
+        """
+            Wait for all of the futures and return the list of their results,
+            in the same order.
+        """
+        return [f.result() for f in futures]
+
+    def as_completed(self, futures):
+        """
+            Generator yielding the futures in the order that they finish.
+        """
+        return as_completed(futures)
+
+    def shutdown(self):
+        """
+            Stop the worker threads once the calls already submitted are
+            finished.
+        """
+        with self._workers_lock:
+            for worker in self._workers:
+                self._queue.put(None)
+            self._workers = []
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        table = self.api.command_table()
+        if table is not None and name not in table:
+            raise AttributeError("The VDC API has no command '%s'" % name)
+        def handlerFunction(*args, **kwargs):
+            if args:
+                return self.submit(lambda: self.api._make_request(name, dict(args[0]), **kwargs))
+            return self.submit(self.api._make_request, name, kwargs)
+        setattr(self, name, handlerFunction)
+        return handlerFunction
@@ -18,11 +18,26 @@
 # $ python vdc_api_signer.py -c vdcapi -x listZones -a '{"region":"asia"}' -e
 # $ python vdc_api_signer.py -c vdcapi -x listZones -a '{"region":"asia"}' -t
 # $ python vdc_api_signer.py -c vdcapi -x listVirtualMachines -a '{"region":"asia", "zoneid":"f2e16beb-b8b1-4f1d-b211-6b6feb6bb394"}'
+# $ python vdc_api_signer.py -c vdcapi --batch calls.jsonl -j 16 -o results.jsonl
+#
+# BATCH MODE:
+# With '--batch FILE' (or '--batch -' for standard input), each line of the file is one API call
+# in JSON, e.g.
+#   {"command": "listZones", "args": {"region": "Europe"}}
+#   {"command": "stopVirtualMachine", "args": {"region": "Europe", "id": "2b6e1a3c-..."}}
+# The calls are signed by a pool of processes (-p), executed with up to -j calls at the same time
+# on keep-alive connections, and the results are written as JSON lines, one per call, e.g.
+#   {"line": 1, "command": "listZones", "response": {"listzonesresponse": {...}}}
+#   {"line": 2, "command": "stopVirtualMachine", "error": "HTTP Error 431: ..."}
+# in the order of the input file, or with '--completion-order' as soon as each call finishes.
+# Without -e the signed URLs are written instead of being executed. The -m option is not used:
+# a call is sent by POST if its URL is too long for GET.
 #
 # Reference: Accepting a dictionary as an argument with argparse and python
 #   http://stackoverflow.com/questions/18608812/accepting-a-dictionary-as-an-argument-with-argparse-and-python
 
 from __future__ import print_function
+from collections import OrderedDict
 import base64
 import hashlib
 import hmac
@@ -36,6 +51,155 @@ import os
 import argparse
 import datetime
 
+
+def call_args(command, args, apiKey, expiryTimeout=None):
+    """
+        Return a new dict with the args of an API call and the apiKey,
+        response format and command. If 'expiryTimeout' is given, the call
+        expires after that many seconds. Unicode values (from JSON) are
+        encoded as UTF-8, as by the VDC agent.
+    """
+    args = dict((str(k), v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in args.items())
+    args.update(apiKey=apiKey, response='json', command=command)
+    if expiryTimeout is not None:
+        expireTime = datetime.datetime.utcnow() + datetime.timedelta(seconds = expiryTimeout)
+        args['signatureVersion'] = 3
+        args['expires'] = expireTime.strftime("%Y-%m-%dT%H:%M:%S.%f%z")[:-7] + "+0000"
+    return args
+
+
+def sign_request(args, secret):
+    """
+        Return (request_data, signature): the query string for the API call
+        with the given args, including the signature, and the signature.
+    """
+    request = zip(args.keys(), args.values())
+    request.sort(key=lambda x: x[0].lower())
+    request_data = "&".join(["=".join([r[0], urllib.quote_plus(str(r[1]),safe='*')]) for r in request])
+    hashStr = "&".join(
+            [
+                "=".join(
+                    [r[0].lower(),
+                     str.lower(urllib.quote_plus(str(r[1]),safe='*')).replace(
+                         "+", "%20"
+                     )]
+                ) for r in request
+            ]
+        )
+    ##print("Request string to be hashed: %s" % hashStr)
+    ##print("Base64 encoded signature (HMAC-SHA1): %s" %  base64.b64encode(hmac.new(secret,hashStr,hashlib.sha1).digest()))
+    sig = urllib.quote_plus(base64.b64encode(
+            hmac.new(
+                str(secret),
+                hashStr,
+                hashlib.sha1
+            ).digest()
+        ).strip())
+    return request_data + "&signature=%s" % sig, sig
+
+
+# Keys of the signing processes of the batch mode (set by init_signer)
+_signer = {}
+
+def init_signer(apiKey, secret, expiryTimeout):
+    _signer.update(apiKey=apiKey, secret=secret, expiryTimeout=expiryTimeout)
+
+def sign_line(numbered_line):
+    """
+        Sign one line of a batch file, in a signing process. Returns a dict
+        with the line number, command and region and either the signed
+        'request_data' or an 'error'.
+    """
+    number, line = numbered_line
+    result = OrderedDict([('line', number)])
+    try:
+        call = json.loads(line)
+        result['command'] = call['command']
+        args = call.get('args', {})
+        result['region'] = args.get('region', 'default')
+        result['request_data'] = sign_request(
+            call_args(call['command'], args, _signer['apiKey'], _signer['expiryTimeout']), _signer['secret'])[0]
+    except KeyError as e:
+        result['error'] = 'Bad line: no %s' % e
+    except (ValueError, TypeError, AttributeError) as e:
+        result['error'] = 'Bad line: %s' % e
+    return result
+
+
+def run_batch(batchFile, api_url, apiKey, secret, expiryTimeout, executeCall, outfh,
+              processes=None, concurrency=8, completionOrder=False):
+    """
+        Sign the API calls in the lines of 'batchFile' on a pool of
+        'processes', execute them (if 'executeCall') with up to
+        'concurrency' calls at the same time, and write the results to
+        'outfh' as JSON lines. Returns the number of calls which failed.
+    """
+    import collections
+    import multiprocessing
+    import Queue
+    import vdc_api_call as vdc
+
+    # (the signing processes are started first, so that no threads are running when they are forked)
+    signers = multiprocessing.Pool(processes, init_signer, (apiKey, secret, expiryTimeout))
+    api = vdc.AsyncVDCApiCall(api_url, apiKey, secret, max_concurrency=concurrency)
+    # (the futures waiting to be written: in input order a queue of them, in completion order
+    # a queue to which they are put as they finish, and the number of them)
+    pending = collections.deque()
+    finished = Queue.Queue()
+    unfinished = [0]
+    failures = [0]
+
+    def execute(signed):
+        try:
+            signed['response'] = json.loads(api.api.send_signed(signed['request_data'], signed['command'], signed['region']))
+        except vdc.VDCError as e:
+            signed['error'] = str(e)
+        except ValueError as e:
+            signed['error'] = 'Bad response: %s' % e
+        return signed
+
+    def write(result):
+        if 'error' in result:
+            failures[0] += 1
+        if executeCall:
+            result.pop('request_data', None)
+        elif 'request_data' in result:
+            result['url'] = api_url + '?' + result.pop('request_data')
+        result.pop('region', None)
+        outfh.write(json.dumps(result) + '\n')
+        outfh.flush()
+
+    def write_finished(block=False):
+        # (in input order, a result is written when the results of all of the lines before it are written)
+        if completionOrder:
+            while unfinished[0] and (block or not finished.empty()):
+                write(finished.get().result())
+                unfinished[0] -= 1
+        else:
+            while pending and (block or pending[0].done()):
+                write(pending.popleft().result())
+
+    try:
+        lines = ((number, line) for number, line in enumerate(batchFile, 1) if line.strip())
+        for signed in signers.imap(sign_line, lines, chunksize=64):
+            if executeCall and 'error' not in signed:
+                future = api.submit(execute, signed)
+            else:
+                future = vdc.VDCFuture()
+                future.set_result(signed)
+            if completionOrder:
+                unfinished[0] += 1
+                future.add_done_callback(finished.put)
+            else:
+                pending.append(future)
+            write_finished()
+        write_finished(block=True)
+    finally:
+        signers.terminate()
+        api.api.pool.clear()
+    return failures[0]
+
+
 if __name__ == '__main__':
     # Parse command line arguments
     parser = argparse.ArgumentParser()
@@ -49,6 +213,10 @@ if __name__ == '__main__':
     parser.add_argument("-o", "--outfile", default="", help="name of output file to receive the API call response") 
     parser.add_argument("-t", "--timeout", action="store_true", help="add expiry timeout to the API call URL (see -u for setting expiry time)")
     parser.add_argument("-u", "--expiryTime", type=int, default=600, help="expiry time duration for the API call in seconds (default: 600s)")
+    parser.add_argument("--batch", metavar="FILE", help="sign (and with -e execute) the API calls in the lines of a JSON lines file ('-' for standard input), see BATCH MODE above")
+    parser.add_argument("-j", "--concurrency", type=int, default=8, help="batch mode: maximum number of calls executed at the same time (default: 8)")
+    parser.add_argument("-p", "--processes", type=int, help="batch mode: number of signing processes (default: the number of CPUs)")
+    parser.add_argument("--completion-order", action="store_true", help="batch mode: write the results as the calls finish, not in the order of the input")
     config_file = parser.parse_args().config
     command = parser.parse_args().command
     args = parser.parse_args().arguments
@@ -57,6 +225,9 @@ if __name__ == '__main__':
     outfile = parser.parse_args().outfile
     timeoutOn = parser.parse_args().timeout
     expiryTimeout = parser.parse_args().expiryTime
+    batchFile = parser.parse_args().batch
+    if not batchFile and not command:
+        parser.error("an API command (-x) or a batch file (--batch) is needed")
     
     # If config file is found, read its content,
     # else query user for the API endpoint URL, API key, Secret key
@@ -74,43 +245,22 @@ if __name__ == '__main__':
         apiKey = raw_input()
         secret = getpass.getpass(prompt='API secret key:')
 
-    args['apiKey'] = apiKey
-    args['response'] = 'json'
-    args['command'] = command
+    if batchFile:
+       batchIn = sys.stdin if batchFile == '-' else open(batchFile)
+       batchOut = open(outfile, 'w') if outfile else sys.stdout
+       failed = run_batch(batchIn, api_url, apiKey, secret, expiryTimeout if timeoutOn else None, executeCall, batchOut,
+                          parser.parse_args().processes, parser.parse_args().concurrency, parser.parse_args().completion_order)
+       if outfile:
+          batchOut.close()
+       sys.exit(1 if failed else 0)
 
     #add expiry timeout to the API call
-    if timeoutOn:
-       expireTime = datetime.datetime.utcnow() + datetime.timedelta(seconds = expiryTimeout)
-       args['signatureVersion'] = 3
-       args['expires'] = expireTime.strftime("%Y-%m-%dT%H:%M:%S.%f%z")[:-7] + "+0000"
+    args = call_args(command, args, apiKey, expiryTimeout if timeoutOn else None)
 
-    request = zip(args.keys(), args.values())
-    request.sort(key=lambda x: x[0].lower())
-    request_data = "&".join(["=".join([r[0], urllib.quote_plus(str(r[1]),safe='*')]) for r in request])
-    hashStr = "&".join(
-            [
-                "=".join(
-                    [r[0].lower(),
-                     str.lower(urllib.quote_plus(str(r[1]),safe='*')).replace(
-                         "+", "%20"
-                     )]
-                ) for r in request
-            ]
-        )
-    ##print("Request string to be hashed: %s" % hashStr)
-    ##print("Base64 encoded signature (HMAC-SHA1): %s" %  base64.b64encode(hmac.new(secret,hashStr,hashlib.sha1).digest()))
-    sig = urllib.quote_plus(base64.b64encode(
-            hmac.new(
-                secret,
-                hashStr,
-                hashlib.sha1
-            ).digest()
-        ).strip())
+    request_data, sig = sign_request(args, secret)
 
     print("Calculated VDC signature: %s" % sig)
 
-    request_data +=  "&signature=%s" % sig
-
     if timeoutOn:
        print("Runnable URL (expires after %d seconds at %s): \n%s" % (expiryTimeout, args['expires'], api_url + '?' + request_data))
     else:
@@ -0,0 +1,547 @@
+#! /usr/bin/env python
+# Python script for the Interoute Virtual Data Centre API:
+#   Name: vdc_benchmark.py
+#   Purpose: Benchmarks of the API access code and the listing programs, run against the local mock API server
+#   Requires: class VDCApiCall in the file vdc_api_call.py, and vdc_mock_server.py
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# The benchmarks are:
+#   signing  - signatures and pre-signed URLs computed per second by VDCApiCall, and lookups per second of
+#              its command methods
+#   calls    - API calls per second, one at a time and concurrent, to a local mock server
+#   decode   - time and peak memory to decode listVirtualMachines responses of different sizes,
+#              in full and as they are streamed with only a few fields kept
+#   scripts  - run time and peak memory of networks_member_listing.py, dcg_member_listing.py and
+#              check-vm-state.py against a mock server with 100, 1k, 10k and 50k VMs
+#   startup  - cold start time of the programs, run with '-h', and the time they spend importing modules
+#              (Python 2 has no '-X importtime' option, so the imports are timed by wrapping __import__)
+#   idle     - time of a mutating call made on a kept-alive connection which the mock server has
+#              closed while it was idle (the benchmark fails if any such call fails)
+#   catalog  - lookups per second in the catalog of vdc_catalog.py, checking that a catalog opened
+#              again on the same file is used without any API calls (the benchmark fails if not)
+#   stress   - hundreds of threads sharing one VDCApiCall (without a cache) against a mock server,
+#              checking that every call gets the right result and that the shared args dict is not
+#              changed (the benchmark fails if any call goes wrong)
+#
+# The results are written to a JSON file, and the results of an earlier run can be compared
+# with the current run to catch regressions:
+#     python vdc_benchmark.py -o before.json
+#     python vdc_benchmark.py -o after.json --compare before.json
+#
+# You can pass options via the command line: type 'python vdc_benchmark.py -h' for usage information
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+import vdc_api_call as vdc
+import vdc_catalog
+import vdc_mock_server
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+SCRIPTS = [
+    ('networks_member_listing.py', []),
+    ('dcg_member_listing.py', ['-n']),
+    ('check-vm-state.py', []),
+]
+
+SCRIPT_SIZES = [100, 1000, 10000, 50000]
+
+DECODE_SIZES = [10, 100, 1000, 10000]
+
+STARTUP_SCRIPTS = ['cluster_deploy.py', 'cluster_destroy.py', 'cluster_check_deploytime.py', 'dcg_member_listing.py',
+                   'networks_member_listing.py', 'loadbased-autoscaler.py', 'vm_deploy_chooser.py', 'Sparkplot.py']
+
+STARTUP_RUNS = 5
+
+STRESS_CALLERS = 200
+STRESS_ROUNDS = 3
+
+
+def timed(fn, min_time=1.0):
+    """
+        Call fn() repeatedly for at least 'min_time' seconds, and return the
+        number of calls per second.
+    """
+    count = 0
+    start = time.time()
+    while True:
+        fn()
+        count += 1
+        elapsed = time.time() - start
+        if elapsed >= min_time:
+            return count / elapsed
+
+
+def bench_signing(args):
+    """
+        Signatures per second, for a typical listVirtualMachines request,
+        pre-signed URLs per second made by presign_many in batches of 1000,
+        and lookups per second of a command method of VDCApiCall.
+    """
+    api = vdc.VDCApiCall('http://127.0.0.1:1/', 'benchmark-api-key', 'benchmark-secret')
+    request = {'command': 'listVirtualMachines', 'response': 'json', 'region': 'Europe',
+               'zoneid': '7144b207-e97e-4e4a-b15d-64a30711e0e7', 'state': 'Running', 'name': 'Webcluster-web-'}
+    calls = [('listVirtualMachines', {'region': 'Europe', 'id': str(i)}) for i in range(1000)]
+    return {'sign_per_sec': timed(lambda: api._sign(dict(request)), args.min_time),
+            'presign_per_sec': 1000 * timed(lambda: api.presign_many(calls), args.min_time),
+            'dispatch_per_sec': timed(lambda: api.listVirtualMachines, args.min_time)}
+
+
+def bench_calls(args):
+    """
+        API calls per second to a local mock server, one at a time and with
+        8 concurrent calls.
+    """
+    server = vdc_mock_server.start_server(vms=100)
+    api = vdc.VDCApiCall(server.url, server.vdc.api_key, server.vdc.secret, pool_size=8)
+    results = {'sequential_calls_per_sec': timed(lambda: api.listZones({'region': 'Europe'}), args.min_time)}
+    apiAsync = vdc.AsyncVDCApiCall.from_api(api, max_concurrency=8)
+
+    def batch():
+        apiAsync.gather([apiAsync.listZones({'region': 'Europe'}) for i in range(8)])
+    results['concurrent_calls_per_sec'] = 8 * timed(batch, args.min_time)
+    apiAsync.shutdown()
+    # (closing the connections lets the server's handler threads finish before it is shut down)
+    api.pool.clear()
+    server.shutdown()
+    return results
+
+
+def bench_decode(args):
+    """
+        Time and peak memory (of a process which only does the decoding)
+        to decode listVirtualMachines responses with different numbers of
+        VMs: in full with json.loads (keeping only the fields used by
+        check-vm-state.py afterwards), and streamed with StreamingDecoder
+        keeping only those fields. The streamed decoding is not faster, but
+        its memory hardly grows with the size of the response.
+    """
+    results = {}
+    for size in args.decode_sizes:
+        mock = vdc_mock_server.MockVDC(vms=size)
+        body = json.dumps(mock.handle({'command': 'listVirtualMachines', 'listall': 'true'}))
+        results['bytes_%d' % size] = len(body)
+        calls = timed(lambda: json.loads(body), args.min_time)
+        results['json_loads_seconds_%d' % size] = 1 / calls
+        results['json_loads_mb_per_sec_%d' % size] = calls * len(body) / 1e6
+
+        def streamed():
+            chunks = iter([body[i:i + 65536] for i in range(0, len(body), 65536)])
+            vdc.StreamingDecoder(lambda n: next(chunks, ''), ['name', 'state', 'account']).decode()
+        calls = timed(streamed, args.min_time)
+        results['streamed_seconds_%d' % size] = 1 / calls
+        results['streamed_mb_per_sec_%d' % size] = calls * len(body) / 1e6
+        results['json_loads_peak_kb_%d' % size] = decode_memory(body, 'json')
+        results['streamed_peak_kb_%d' % size] = decode_memory(body, 'streamed')
+    return results
+
+
+def start_mock_process(size, home):
+    """
+        Start a mock server process with 'size' VMs, which writes the config
+        file '.vdcapi' in the directory 'home'. Returns the process.
+    """
+    config = os.path.join(home, '.vdcapi')
+    process = subprocess.Popen([sys.executable, 'vdc_mock_server.py', '--vms', str(size), '--port', '0',
+                                '--config', config, '--jobtime', '0.1,0.5'],
+                               stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    while not os.path.exists(config):
+        if process.poll() is not None:
+            raise RuntimeError('Mock server failed to start')
+        time.sleep(0.1)
+    # (the server socket is listening before the config file is written)
+    return process
+
+
+# Program run by run_script to run a program and report its run time and rusage. The program
+# is forked from this small process, because the peak memory reported for a process includes
+# the memory of the process it was forked from, before the exec.
+LAUNCHER = """
+import os, sys, time
+start = time.time()
+pid = os.fork()
+if pid == 0:
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.execv(sys.executable, [sys.executable] + sys.argv[1:])
+pid, status, rusage = os.wait4(pid, 0)
+sys.stdout.write('%d %f %d' % (status, time.time() - start, rusage.ru_maxrss))
+"""
+
+
+def run_script(script, script_args, home):
+    """
+        Run a program with the config file in 'home', and return its run
+        time in seconds and peak memory (maximum resident set size) in KB.
+    """
+    env = dict(os.environ, HOME=home, PYTHONIOENCODING='utf-8')
+    process = subprocess.Popen([sys.executable, '-c', LAUNCHER, script] + script_args, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    status, elapsed, maxrss = stdout.split()
+    if int(status) != 0:
+        raise RuntimeError('%s failed with exit status %s:\n%s' % (script, status, stderr))
+    # ru_maxrss is in KB on Linux (bytes on Mac OS)
+    maxrss = int(maxrss) if sys.platform != 'darwin' else int(maxrss) // 1024
+    return float(elapsed), maxrss
+
+
+# Program run by decode_memory to decode the listVirtualMachines response in the file PATH in
+# the way MODE ('json' or 'streamed'). The file is read as the response would be read from the
+# connection.
+DECODE_MEMORY = """
+import json, sys
+import vdc_api_call as vdc
+path, mode = sys.argv[1], sys.argv[2]
+fields = ['name', 'state', 'account']
+with open(path, 'rb') as fh:
+    if mode == 'json':
+        result = json.loads(fh.read()).values()[0]
+        result['virtualmachine'] = vdc.project_fields(result['virtualmachine'], vdc.make_projection(fields))
+    else:
+        result = vdc.StreamingDecoder(fh.read, fields).decode()
+"""
+
+
+def decode_memory(body, mode):
+    """
+        Return the peak memory in KB of a process which decodes the response
+        'body' by 'mode' ('json' or 'streamed'), run by LAUNCHER.
+    """
+    fd, path = tempfile.mkstemp(prefix='vdc_benchmark_', suffix='.json')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(body)
+        stdout = subprocess.check_output([sys.executable, '-c', LAUNCHER, '-c', DECODE_MEMORY, path, mode])
+    finally:
+        os.remove(path)
+    status, elapsed, maxrss = stdout.split()
+    if int(status) != 0:
+        raise RuntimeError('Decoding with %s failed with exit status %s' % (mode, status))
+    # ru_maxrss is in KB on Linux (bytes on Mac OS)
+    return int(maxrss) if sys.platform != 'darwin' else int(maxrss) // 1024
+
+
+def bench_scripts(args):
+    """
+        Run time and peak memory of the listing programs against mock
+        servers with different numbers of VMs.
+    """
+    results = {}
+    for size in args.script_sizes:
+        home = tempfile.mkdtemp(prefix='vdc-benchmark-')
+        process = start_mock_process(size, home)
+        try:
+            for script, script_args in SCRIPTS:
+                name = script.split('.')[0]
+                elapsed, maxrss = run_script(script, script_args, home)
+                results['%s_seconds_%d' % (name, size)] = elapsed
+                results['%s_maxrss_kb_%d' % (name, size)] = maxrss
+                print("  %s with %d VMs: %.2f seconds, %d KB" % (script, size, elapsed, maxrss))
+        finally:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(home)
+    return results
+
+
+# Program run by bench_startup to run a program with its imports timed. It writes the time
+# from its own start to the exit of the program, the time spent in top-level imports (the
+# imports made by the program, including the modules they import in turn) and the number
+# of modules loaded, to the file named by the environment variable VDC_STARTUP_REPORT.
+IMPORT_TIMER = """
+import __builtin__, atexit, json, os, sys, time
+start = time.time()
+original_import = __builtin__.__import__
+state = {'depth': 0, 'seconds': 0.0}
+def timed_import(*args, **kwargs):
+    state['depth'] += 1
+    t = time.time()
+    try:
+        return original_import(*args, **kwargs)
+    finally:
+        state['depth'] -= 1
+        if state['depth'] == 0:
+            state['seconds'] += time.time() - t
+def report():
+    with open(os.environ['VDC_STARTUP_REPORT'], 'w') as fh:
+        json.dump({'seconds': time.time() - start, 'import_seconds': state['seconds'], 'modules': len(sys.modules)}, fh)
+atexit.register(report)
+__builtin__.__import__ = timed_import
+sys.argv = sys.argv[1:]
+sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+execfile(sys.argv[0], {'__name__': '__main__', '__file__': sys.argv[0]})
+"""
+
+
+def bench_startup(args):
+    """
+        Cold start time of the programs with the '-h' option (the median of
+        several runs), with the time spent in imports and the number of
+        modules loaded.
+    """
+    results = {}
+    handle, report = tempfile.mkstemp(prefix='vdc-startup-', suffix='.json')
+    os.close(handle)
+    env = dict(os.environ, VDC_STARTUP_REPORT=report)
+    try:
+        for script in STARTUP_SCRIPTS:
+            name = script.split('.')[0]
+            runs = []
+            for i in range(args.startup_runs):
+                start = time.time()
+                subprocess.call([sys.executable, '-c', IMPORT_TIMER, script, '-h'], env=env,
+                                stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+                elapsed = time.time() - start
+                with open(report) as fh:
+                    run = json.load(fh)
+                runs.append((elapsed, run['import_seconds'], run['modules']))
+            elapsed, import_seconds, modules = sorted(runs)[len(runs) // 2]
+            results['%s_seconds' % name] = elapsed
+            results['%s_import_seconds' % name] = import_seconds
+            results['%s_modules' % name] = modules
+            print("  %s: %.3f seconds, %.3f seconds in imports, %d modules" % (script, elapsed, import_seconds, modules))
+    finally:
+        os.remove(report)
+    return results
+
+
+def bench_idle(args):
+    """
+        Seconds taken by a stop or start of a VM (mutating calls, which are
+        never sent twice) made after the client's pooled connection has been
+        idle for longer than the mock server's idle timeout, so that the
+        server has closed it. Raises RuntimeError if any of the calls fails.
+    """
+    server = vdc_mock_server.start_server(vms=10, idle_timeout=0.2, job_time=[0, 0])
+    api = vdc.VDCApiCall(server.url, server.vdc.api_key, server.vdc.secret)
+    vm = api.listVirtualMachines({'region': 'Europe'})['virtualmachine'][0]
+    times = []
+    try:
+        for i in range(args.idle_calls):
+            time.sleep(0.3)
+            start = time.time()
+            command = 'stopVirtualMachine' if i % 2 == 0 else 'startVirtualMachine'
+            try:
+                getattr(api, command)({'region': 'Europe', 'id': vm['id']})
+            except vdc.VDCError as e:
+                raise RuntimeError('%s after an idle time failed: %s' % (command, e))
+            times.append(time.time() - start)
+    finally:
+        api.pool.clear()
+        server.shutdown()
+    return {'call_after_idle_sec': sum(times) / len(times), 'stale_connections': api.connection_stats()['stale']}
+
+
+def bench_catalog(args):
+    """
+        Lookups per second by name and zone in a catalog which is up to
+        date, after it has been filled from a local mock server and opened
+        again on the same file. Raises RuntimeError if the catalog opened
+        again makes any API calls.
+    """
+    server = vdc_mock_server.start_server(vms=10)
+    tempdir = tempfile.mkdtemp(prefix='vdc_benchmark_')
+    path = os.path.join(tempdir, 'catalog.db')
+    try:
+        api = vdc.VDCApiCall(server.url, server.vdc.api_key, server.vdc.secret)
+        catalog = vdc_catalog.Catalog(api, path)
+        catalog.refresh()
+        catalog.close()
+        api.pool.clear()
+        # (a new VDCApiCall, as in the next run of a program)
+        api = vdc.VDCApiCall(server.url, server.vdc.api_key, server.vdc.secret)
+        requests = server.requests
+        catalog = vdc_catalog.Catalog(api, path)
+        zone = catalog.zones(name='Frankfurt (ESX)')[0]
+
+        def lookups():
+            catalog.zones(name='Frankfurt (ESX)')
+            catalog.templates(zoneid=zone['id'])
+            catalog.service_offerings(region='Europe')
+            catalog.networks(region='Europe', zoneid=zone['id'])
+        results = {'lookups_per_sec': 4 * timed(lookups, args.min_time)}
+        catalog.close()
+        if server.requests != requests:
+            raise RuntimeError('the catalog opened again made %d API calls' % (server.requests - requests))
+    finally:
+        shutil.rmtree(tempdir)
+        server.shutdown()
+    return results
+
+
+def bench_stress(args):
+    """
+        Calls per second of many threads sharing one VDCApiCall, all started
+        at once against a local mock server. Each thread makes rounds of a
+        listZones for the zone of one VM, a listVirtualMachines for that VM,
+        and a listing of the VMs in its zone in pages of 10, and then reboots
+        its VM and waits for the job with watch_job. The client has no cache,
+        so that every call is signed and sent on a pooled connection, and
+        the args of each thread are made from one shared args dict. Raises
+        RuntimeError if any call fails or gets the wrong result, or if the
+        args dict is changed.
+    """
+    server = vdc_mock_server.start_server(vms=args.stress_callers, job_time=[0.1, 0.5])
+    api = vdc.VDCApiCall(server.url, server.vdc.api_key, server.vdc.secret, pool_size=32)
+    shared = {'region': 'Europe'}
+    vms = api.listVirtualMachines(shared)['virtualmachine']
+    zone_vms = {}
+    for vm in vms:
+        zone_vms[vm['zoneid']] = zone_vms.get(vm['zoneid'], 0) + 1
+    failures = []
+    go = threading.Event()
+
+    def caller(i):
+        vm = vms[i % len(vms)]
+        go.wait()
+        try:
+            for j in range(args.stress_rounds):
+                zones = api.listZones(dict(shared, id=vm['zoneid']))['zone']
+                if [z['id'] for z in zones] != [vm['zoneid']]:
+                    failures.append('listZones for %s returned %s' % (vm['zoneid'], [z['id'] for z in zones]))
+                result = api.listVirtualMachines(dict(shared, id=vm['id']))['virtualmachine']
+                if [v['id'] for v in result] != [vm['id']]:
+                    failures.append('listVirtualMachines for %s returned %s' % (vm['id'], [v['id'] for v in result]))
+                listed = list(api.iter_listVirtualMachines(dict(shared, zoneid=vm['zoneid']), pagesize=10,
+                                                           fields=['id', 'zoneid']))
+                if len(listed) != zone_vms[vm['zoneid']] or any(v['zoneid'] != vm['zoneid'] for v in listed):
+                    failures.append('paged listing of zone %s returned %d VMs, not %d' %
+                                    (vm['zoneid'], len(listed), zone_vms[vm['zoneid']]))
+            # (only one thread reboots each VM)
+            if i < len(vms):
+                jobid = api.rebootVirtualMachine(dict(shared, id=vm['id']))['jobid']
+                if api.watch_job(jobid, shared['region'], timeout=60).result()['virtualmachine']['id'] != vm['id']:
+                    failures.append('job %s returned the wrong VM' % jobid)
+        except Exception as e:
+            failures.append('%s: %s' % (e.__class__.__name__, e))
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(args.stress_callers)]
+    for t in threads:
+        t.start()
+    requests = server.requests
+    start = time.time()
+    go.set()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    calls = server.requests - requests
+    if shared != {'region': 'Europe'}:
+        failures.append('the shared args dict was changed to %s' % shared)
+    api.pool.clear()
+    server.shutdown()
+    if failures:
+        raise RuntimeError('%d failures in the stress test, the first: %s' % (len(failures), failures[0]))
+    return {'callers': args.stress_callers, 'calls': calls, 'calls_per_sec': calls / elapsed,
+            'connections_new': api.connection_stats()['new']}
+
+
+BENCHMARKS = [
+    ('signing', bench_signing),
+    ('calls', bench_calls),
+    ('decode', bench_decode),
+    ('scripts', bench_scripts),
+    ('startup', bench_startup),
+    ('idle', bench_idle),
+    ('catalog', bench_catalog),
+    ('stress', bench_stress),
+]
+
+
+def higher_is_better(name):
+    return '_per_sec' in name
+
+
+def compare(old, new, threshold):
+    """
+        Print the change of each result from the 'old' run to the 'new' run,
+        and return the names of the results which are worse by more than
+        the fraction 'threshold'.
+    """
+    regressions = []
+    print("\n%-45s %14s %14s %9s" % ('RESULT', 'BEFORE', 'AFTER', 'CHANGE'))
+    for group in sorted(new['results']):
+        for name in sorted(new['results'][group]):
+            key = '%s.%s' % (group, name)
+            after = new['results'][group][name]
+            before = old.get('results', {}).get(group, {}).get(name)
+            if not before:
+                print("%-45s %14s %14.4g %9s" % (key, '-', after, ''))
+                continue
+            change = (after - before) / float(before)
+            if name.startswith('bytes_'):
+                worse = False
+            elif higher_is_better(name):
+                worse = change < -threshold
+            else:
+                worse = change > threshold
+            if worse:
+                regressions.append(key)
+            print("%-45s %14.4g %14.4g %+8.1f%%%s" % (key, before, after, change * 100, ' WORSE' if worse else ''))
+    return regressions
+
+
+def main():
+    # STEP: Parse the command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-b", "--benchmarks", nargs='+', choices=[name for name, fn in BENCHMARKS],
+                        default=[name for name, fn in BENCHMARKS], help="benchmarks to run (default all)")
+    parser.add_argument("-o", "--output", default="DEFAULT",
+                        help="name of output file to receive the results in JSON format (default is benchmark-TIMESTAMP.json)")
+    parser.add_argument("--compare", default='', help="name of a results file of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="fraction by which a result must be worse than the earlier run to count as a regression (default 0.1)")
+    parser.add_argument("-q", "--quick", action='store_true', help="run shorter benchmarks with smaller inventories")
+    parser.add_argument("--min-time", type=float, default=1.0, help="minimum time in seconds for each timed benchmark (default 1)")
+    args = parser.parse_args()
+    args.script_sizes = SCRIPT_SIZES[:2] if args.quick else SCRIPT_SIZES
+    args.decode_sizes = DECODE_SIZES[:3] if args.quick else DECODE_SIZES
+    args.startup_runs = 1 if args.quick else STARTUP_RUNS
+    args.idle_calls = 2 if args.quick else 10
+    args.stress_callers = 50 if args.quick else STRESS_CALLERS
+    args.stress_rounds = 1 if args.quick else STRESS_ROUNDS
+    if args.quick:
+        args.min_time = min(args.min_time, 0.2)
+    if args.output == 'DEFAULT':
+        args.output = 'benchmark-%s.json' % datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+    # the programs are run from the directory of this file
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    # STEP: Run the benchmarks
+    run = {'timestamp': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S+0000"),
+           'python': platform.python_version(), 'platform': platform.platform(), 'quick': args.quick, 'results': {}}
+    for name, fn in BENCHMARKS:
+        if name in args.benchmarks:
+            print("Running benchmark: %s" % name)
+            run['results'][name] = fn(args)
+            for key, value in sorted(run['results'][name].items()):
+                print("  %s: %.4g" % (key, value))
+
+    # STEP: Write the results, and compare them with the earlier run
+    with open(args.output, 'w') as fh:
+        json.dump(run, fh, indent=2, sort_keys=True)
+    print("Results written to %s" % args.output)
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)
+        regressions = compare(old, run, args.threshold)
+        if regressions:
+            print("\n%d results are worse than in %s: %s" % (len(regressions), args.compare, ', '.join(regressions)))
+            sys.exit(1)
+        print("\nNo regressions compared with %s" % args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#! /usr/bin/env python
+# Python class to keep a persistent catalog of VDC zones, templates, service offerings and networks
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# The catalog is an SQLite database file (default ~/.vdcapi_catalog.db) with the results of
+# the list calls for zones, templates, service offerings and networks in each region, and
+# indexes on name, zone and region, so that a script can look up a zone or template by name
+# in a few milliseconds instead of making a round trip to the API for each one.
+#
+# The contents of each kind of object in each region are refreshed when they are older than
+# the time-to-live for that kind (networks change more often than the others, so they have
+# a shorter time), or explicitly with Catalog.refresh(). A region whose refresh fails keeps
+# its old contents, and the failure is recorded in Catalog.errors.
+#
+# Use with VDCApiCall:
+#     catalog = vdc_catalog.Catalog(api)
+#     zone = catalog.zones(name='Frankfurt (ESX)')[0]
+#     templates = catalog.templates(zoneid=zone['id'], name='Ubuntu 16.04')
+#
+# The catalog can also be refreshed or listed from the command line: type
+# 'python vdc_catalog.py -h' for usage information
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+from collections import OrderedDict
+import vdc_api_call as vdc
+import argparse
+import getpass
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+CATALOG_FILE = os.path.join(os.path.expanduser('~'), '.vdcapi_catalog.db')
+
+# Kinds of object in the catalog: the API command which lists them in a region, the key
+# of the list in its response, and the extra arguments of the call
+KINDS = OrderedDict([
+    ('zones', ('listZones', 'zone', {})),
+    ('templates', ('listTemplates', 'template', {'templatefilter': 'executable'})),
+    ('serviceofferings', ('listServiceOfferings', 'serviceoffering', {})),
+    ('networks', ('listNetworks', 'network', {})),
+])
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS items (
+        kind TEXT NOT NULL,
+        region TEXT NOT NULL,
+        id TEXT NOT NULL,
+        name TEXT,
+        zoneid TEXT,
+        zonename TEXT,
+        data TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS items_name ON items (kind, name);
+    CREATE INDEX IF NOT EXISTS items_zone ON items (kind, zoneid);
+    CREATE INDEX IF NOT EXISTS items_zonename ON items (kind, zonename);
+    CREATE INDEX IF NOT EXISTS items_region ON items (kind, region);
+    CREATE TABLE IF NOT EXISTS refreshed (
+        kind TEXT NOT NULL,
+        region TEXT NOT NULL,
+        account TEXT NOT NULL,
+        time REAL NOT NULL,
+        PRIMARY KEY (kind, region)
+    );
+"""
+
+
+class Catalog(object):
+    """
+        Persistent catalog of the zones, templates, service offerings and
+        networks of the VDC regions, stored in the SQLite file 'path'.
+        Lookups refresh the contents of a kind of object in a region from
+        the API when they are older than 'ttl' seconds, or than the time
+        given for the kind in the dict 'ttls'. The contents are kept for
+        each API URL and key, so one file can be shared by several accounts
+        (the contents of another account are replaced on the next lookup).
+    """
+    DEFAULT_TTLS = {'networks': 300}
+
+    def __init__(self, api, path=CATALOG_FILE, ttl=86400, ttls=None, regions=vdc.VDC_REGIONS):
+        self.api = api
+        self.path = path
+        self.ttl = ttl
+        self.ttls = dict(self.DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.regions = list(regions)
+        self.account = '%s %s' % (api.api_url, api.apiKey)
+        self.errors = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        with self._lock:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def ttl_for(self, kind):
+        return self.ttls.get(kind, self.ttl)
+
+    def age(self, kind, region):
+        """
+            Return the age in seconds of the contents of 'kind' in 'region'
+            for this account, or None if they have not been listed (or have
+            been invalidated).
+        """
+        with self._lock:
+            row = self._db.execute('SELECT account, time FROM refreshed WHERE kind = ? AND region = ?',
+                                   (kind, region)).fetchone()
+        if row is None or row['account'] != self.account or row['time'] == 0:
+            return None
+        return time.time() - row['time']
+
+    def refresh(self, kinds=None, regions=None):
+        """
+            List the objects of 'kinds' (default all) in 'regions' (default
+            all of the catalog's regions) from the API, and replace the
+            contents of the catalog with them. The calls for the regions are
+            made concurrently. Returns the number of objects stored.
+        """
+        stored = 0
+        for kind in kinds or KINDS:
+            command, key, args = KINDS[kind]
+            result = self.api.fan_out(command, args, regions=regions or self.regions)
+            for region, error in result.errors.items():
+                self.errors[(kind, region)] = error
+            now = time.time()
+            with self._lock:
+                with self._db:
+                    for region, response in result.regions.items():
+                        self.errors.pop((kind, region), None)
+                        self._db.execute('DELETE FROM items WHERE kind = ? AND region = ?', (kind, region))
+                        self._db.executemany('INSERT INTO items VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                             [self._row(kind, region, item) for item in response.get(key, [])])
+                        self._db.execute('INSERT OR REPLACE INTO refreshed VALUES (?, ?, ?, ?)',
+                                         (kind, region, self.account, now))
+                        stored += len(response.get(key, []))
+        return stored
+
+    @staticmethod
+    def _row(kind, region, item):
+        if kind == 'zones':
+            zoneid, zonename = item['id'], item['name']
+        else:
+            zoneid, zonename = item.get('zoneid'), item.get('zonename')
+        return (kind, region, item['id'], item.get('name'), zoneid, zonename, json.dumps(item))
+
+    def invalidate(self, kind, regions=None):
+        """
+            Mark the contents of 'kind' in 'regions' (default all) as out of
+            date, e.g. after creating a network, so that the next lookup
+            lists them again.
+        """
+        with self._lock:
+            with self._db:
+                for region in regions or self.regions:
+                    self._db.execute('UPDATE refreshed SET time = 0 WHERE kind = ? AND region = ?', (kind, region))
+
+    def _fresh(self, kind, regions):
+        # (a region whose refresh has failed is not tried again until refresh() is called)
+        ages = [(r, self.age(kind, r)) for r in regions if (kind, r) not in self.errors]
+        stale = [r for r, age in ages if age is None or age > self.ttl_for(kind)]
+        if stale:
+            self.refresh([kind], stale)
+
+    def lookup(self, kind, region=None, name=None, zoneid=None, zonename=None, **fields):
+        """
+            Return a list of the objects of 'kind' (as dicts in the format of
+            the API response, with their 'region') which match the given
+            region, name, zoneid and zonename (by the indexes of the catalog)
+            and the values of any other 'fields'. Only the regions which are
+            searched are refreshed if they are out of date.
+        """
+        regions = [region] if region is not None else self.regions
+        self._fresh(kind, regions)
+        # (only the contents listed for this account are used)
+        where = ['kind = ?', 'region IN (%s)' % ', '.join('?' * len(regions)),
+                 'EXISTS (SELECT 1 FROM refreshed r WHERE r.kind = items.kind AND r.region = items.region AND r.account = ?)']
+        values = [kind] + regions + [self.account]
+        for column, value in (('name', name), ('zoneid', zoneid), ('zonename', zonename)):
+            if value is not None:
+                where.append('%s = ?' % column)
+                values.append(value)
+        with self._lock:
+            rows = self._db.execute('SELECT data FROM items WHERE %s ORDER BY rowid' % ' AND '.join(where),
+                                    values).fetchall()
+        items = [json.loads(row['data']) for row in rows]
+        return [item for item in items if all(item.get(k) == v for k, v in fields.items())]
+
+    def zones(self, region=None, name=None, **fields):
+        return self.lookup('zones', region, name, **fields)
+
+    def templates(self, region=None, name=None, zoneid=None, zonename=None, **fields):
+        return self.lookup('templates', region, name, zoneid, zonename, **fields)
+
+    def service_offerings(self, region=None, name=None, **fields):
+        return self.lookup('serviceofferings', region, name, **fields)
+
+    def networks(self, region=None, name=None, zoneid=None, zonename=None, **fields):
+        return self.lookup('networks', region, name, zoneid, zonename, **fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh or list the VDC catalog (zones, templates, service offerings and networks)")
+    parser.add_argument("-c", "--config", default=os.path.join(os.path.expanduser('~'), '.vdcapi'),
+                        help="path/name of the config file to be used for the API URL and API keys (default is ~/.vdcapi)")
+    parser.add_argument("-f", "--file", default=CATALOG_FILE, help="path/name of the catalog file (default is ~/.vdcapi_catalog.db)")
+    parser.add_argument("-k", "--kind", choices=list(KINDS), help="kind of object to refresh or list (default: all)")
+    parser.add_argument("-r", "--region", choices=vdc.VDC_REGIONS, help="VDC region to refresh or list (default: all)")
+    parser.add_argument("-l", "--list", action='store_true', help="list the names of the objects in the catalog")
+    parser.add_argument("--refresh", action='store_true', help="refresh the catalog from the API even if it is up to date")
+    args = parser.parse_args()
+
+    if os.path.isfile(args.config):
+        with open(args.config) as fh:
+            config = json.loads(fh.read())
+            api_url = config['api_url']
+            apiKey = config['api_key']
+            secret = config['api_secret']
+    else:
+        print('API url (e.g. http://10.220.18.115:8080/client/api):', end='')
+        api_url = raw_input()
+        print('API key:', end='')
+        apiKey = raw_input()
+        secret = getpass.getpass(prompt='API secret:')
+
+    api = vdc.VDCApiCall(api_url, apiKey, secret)
+    catalog = Catalog(api, args.file)
+    kinds = [args.kind] if args.kind else list(KINDS)
+    regions = [args.region] if args.region else None
+    if args.refresh:
+        start = time.time()
+        stored = catalog.refresh(kinds, regions)
+        print("Catalog refreshed: %d objects in %.2f seconds" % (stored, time.time() - start))
+    for (kind, region), error in catalog.errors.items():
+        print("WARNING: %s of region %s could not be listed: %s" % (kind, region, error))
+    for kind in kinds:
+        for region in regions or catalog.regions:
+            items = catalog.lookup(kind, region)
+            age = catalog.age(kind, region)
+            print("%s, %s: %d (%s)" % (kind, region, len(items),
+                                       'not listed' if age is None else 'listed %d seconds ago' % age))
+            if args.list:
+                for item in sorted(items, key=lambda i: (i.get('zonename') or '', i.get('name') or '')):
+                    print("   %s  %s%s" % (item['id'], item.get('name'),
+                                           ' (%s)' % item['zonename'] if item.get('zonename') else ''))
+    catalog.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+# Python class to keep a local copy of the VMs of a VDC and report the changes between polls
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# An InventorySync keeps the VMs of a VDC region in a dict keyed by VM id. Each poll lists
+# the VMs (only the fields which are needed, decoded as they are received) and compares
+# them with the copy from the last poll, giving a list of VMChange events: a VM was added
+# or removed, its state changed, or its NICs changed. The consumers (a widget, or a script
+# which is run from cron) are given only the changes, so the work they do grows with the
+# number of changes rather than with the number of VMs.
+#
+# The copy can be kept in a file, so that a script which runs once and exits can report
+# the changes since its last run.
+#
+# Use with VDCApiCall:
+#     inventory = vdc_inventory.InventorySync(api, {'region': 'Europe'})
+#     inventory.subscribe(lambda changes: ...)
+#     changes = inventory.poll()
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+from collections import OrderedDict
+import json
+import os
+import threading
+import time
+
+ADDED = 'added'
+REMOVED = 'removed'
+STATE = 'state'
+NICS = 'nics'
+
+# Fields of the VMs which are kept in the inventory (paths as for VDCApiCall 'fields')
+DEFAULT_FIELDS = ['id', 'name', 'displayname', 'state', 'zoneid', 'zonename', 'account',
+                  'nic.id', 'nic.networkid', 'nic.ipaddress', 'nic.macaddress', 'nic.isdefault']
+
+
+class VMChange(object):
+    """
+        A change to one VM found by a poll. 'kind' is ADDED, REMOVED, STATE
+        or NICS; 'vm' is the VM as listed by the poll (as last listed, for
+        REMOVED) and 'old' is the VM as listed by the poll before (None for
+        ADDED). A VM whose state and NICs have both changed gives two
+        changes.
+    """
+    __slots__ = ('kind', 'vm', 'old')
+
+    def __init__(self, kind, vm, old=None):
+        self.kind = kind
+        self.vm = vm
+        self.old = old
+
+    @property
+    def id(self):
+        return self.vm['id']
+
+    def __repr__(self):
+        if self.kind == STATE:
+            return '<VMChange %s %s: %s -> %s>' % (self.kind, self.vm.get('name'), self.old.get('state'), self.vm.get('state'))
+        return '<VMChange %s %s>' % (self.kind, self.vm.get('name'))
+
+
+def nic_key(vm):
+    """
+        Return a value which is the same for two listings of a VM if and only
+        if its NICs are the same (in any order).
+    """
+    return sorted(sorted(nic.items()) for nic in vm.get('nic') or [])
+
+
+def diff_vms(old, new):
+    """
+        Return the list of VMChange events between two dicts of VMs keyed
+        by id: first the added VMs and the changed VMs in the order of 'new',
+        then the removed VMs.
+    """
+    changes = []
+    for id, vm in new.iteritems():
+        before = old.get(id)
+        if before is None:
+            changes.append(VMChange(ADDED, vm))
+            continue
+        if before.get('state') != vm.get('state'):
+            changes.append(VMChange(STATE, vm, before))
+        if nic_key(before) != nic_key(vm):
+            changes.append(VMChange(NICS, vm, before))
+    for id, vm in old.iteritems():
+        if id not in new:
+            changes.append(VMChange(REMOVED, vm, vm))
+    return changes
+
+
+class InventorySync(object):
+    """
+        Local copy of the VMs listed with 'args' (e.g. {'region': 'Europe'})
+        by the VDCApiCall 'api', in the dict 'vms' keyed by VM id. Only the
+        'fields' of the VMs are kept. If 'path' is given, the copy is read
+        from that file (if it was written for the same API URL and args) and
+        written to it after each poll.
+    """
+    def __init__(self, api, args=None, fields=DEFAULT_FIELDS, pagesize=500, path=None):
+        self.api = api
+        self.args = dict(args or {})
+        self.fields = fields
+        self.pagesize = pagesize
+        self.path = path
+        self.vms = OrderedDict()
+        self.last_poll = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def __len__(self):
+        return len(self.vms)
+
+    def __iter__(self):
+        return iter(self.vms.values())
+
+    def get(self, id):
+        return self.vms.get(id)
+
+    def subscribe(self, listener):
+        """
+            Call listener(changes) with the list of changes of each poll
+            which finds any.
+        """
+        self._listeners.append(listener)
+
+    def poll(self):
+        """
+            List the VMs, update the copy and return the list of changes
+            since the last poll (on the first poll, every VM is ADDED). If
+            the listing fails, the exception is raised and the copy is left
+            as it was.
+        """
+        with self._lock:
+            listed = OrderedDict((vm['id'], vm) for vm in
+                                 self.api.iter_listVirtualMachines(self.args, self.pagesize, fields=self.fields))
+            changes = diff_vms(self.vms, listed)
+            self.vms = listed
+            self.last_poll = time.time()
+            if self.path is not None:
+                self.save()
+        if changes:
+            for listener in self._listeners:
+                listener(changes)
+        return changes
+
+    def _key(self):
+        return {'api_url': self.api.api_url, 'args': self.args}
+
+    def load(self):
+        """
+            Read the copy of the VMs from the file 'path'. Returns False if
+            there is no usable copy in the file.
+        """
+        try:
+            with open(self.path) as fh:
+                saved = json.load(fh)
+            if saved['key'] != self._key():
+                return False
+            self.vms = OrderedDict((vm['id'], vm) for vm in saved['vms'])
+            self.last_poll = saved['time']
+            return True
+        except (IOError, ValueError, KeyError):
+            return False
+
+    def save(self):
+        """
+            Write the copy of the VMs to the file 'path'.
+        """
+        temp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(temp_path, 'w') as fh:
+            json.dump({'key': self._key(), 'time': self.last_poll, 'vms': self.vms.values()}, fh)
+        os.rename(temp_path, self.path)
@@ -0,0 +1,208 @@
+#! /usr/bin/env python
+# Python class to collect metrics of the API calls made with VDCApiCall
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# A MetricsRegistry records, for each API command and region, a histogram of the call
+# latency, the bytes sent and received, and the counts of errors and retries. The
+# metrics can be written in the Prometheus text exposition format to a file (for the
+# 'textfile' collector of the Prometheus node exporter) or served on a local HTTP port.
+#
+# Recording a call takes no lock: each thread adds to its own set of counters, and the
+# counters of all the threads are only added together when the metrics are exported.
+#
+# Use with VDCApiCall by passing a registry as 'metrics':
+#     metrics = vdc_metrics.MetricsRegistry()
+#     api = vdc.VDCApiCall(api_url, apiKey, secret, metrics=metrics)
+#     metrics.serve(9464)                 # or: metrics.write_file('/var/lib/node_exporter/vdc.prom')
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+import bisect
+import os
+import threading
+import BaseHTTPServer
+import SocketServer
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Shard(object):
+    """
+        The counters of one thread. 'series' maps (command, region) to a list
+        of the bucket counts followed by the latency sum, the call count,
+        and the bytes sent and received; 'errors' maps (command, region,
+        error) and 'retries' maps (command, region) to counts.
+    """
+    __slots__ = ('thread', 'series', 'errors', 'retries')
+
+    def __init__(self, thread):
+        self.thread = thread
+        self.series = {}
+        self.errors = {}
+        self.retries = {}
+
+
+class MetricsRegistry(object):
+    """
+        Registry of the metrics of API calls. 'buckets' are the upper bounds
+        in seconds of the latency histogram buckets.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._local = threading.local()
+        self._shards = []
+        # counters of threads which have finished
+        self._retired = _Shard(None)
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def observe(self, command, region, seconds, sent=0, received=0, error=None):
+        """
+            Record an API call which took 'seconds', sent 'sent' bytes and
+            received 'received' bytes. 'error' is the name of the error if
+            the call failed.
+        """
+        shard = self._shard()
+        key = (command, region)
+        series = shard.series.get(key)
+        if series is None:
+            series = shard.series[key] = [0] * (len(self.buckets) + 5)
+        n = len(self.buckets)
+        series[bisect.bisect_left(self.buckets, seconds)] += 1
+        series[n + 1] += seconds
+        series[n + 2] += 1
+        series[n + 3] += sent
+        series[n + 4] += received
+        if error is not None:
+            key = (command, region, error)
+            shard.errors[key] = shard.errors.get(key, 0) + 1
+
+    def retry(self, command, region):
+        """
+            Record that an API call is being made again after an error.
+        """
+        retries = self._shard().retries
+        key = (command, region)
+        retries[key] = retries.get(key, 0) + 1
+
+    def collect(self):
+        """
+            Return the counters of all the threads added together, as a
+            _Shard object.
+        """
+        total = _Shard(None)
+        with self._lock:
+            finished = [shard for shard in self._shards if not shard.thread.is_alive()]
+            for shard in finished:
+                self._shards.remove(shard)
+                self._add(self._retired, shard)
+            self._add(total, self._retired)
+            for shard in self._shards:
+                self._add(total, shard)
+        return total
+
+    @staticmethod
+    def _add(total, shard):
+        # copy the dicts first because the thread of the shard may be adding keys
+        for key, series in shard.series.items():
+            current = total.series.get(key)
+            if current is None:
+                total.series[key] = list(series)
+            else:
+                total.series[key] = [a + b for a, b in zip(current, series)]
+        for name in ('errors', 'retries'):
+            counts = getattr(total, name)
+            for key, count in getattr(shard, name).items():
+                counts[key] = counts.get(key, 0) + count
+
+    def export_text(self):
+        """
+            Return the metrics in the Prometheus text exposition format.
+        """
+        total = self.collect()
+        n = len(self.buckets)
+        bounds = [repr(float(b)) for b in self.buckets] + ['+Inf']
+        lines = ['# HELP vdc_api_request_duration_seconds Latency of VDC API calls.',
+                 '# TYPE vdc_api_request_duration_seconds histogram']
+        for (command, region), series in sorted(total.series.items()):
+            labels = _labels(command=command, region=region)
+            cumulative = 0
+            for bound, count in zip(bounds, series[:n + 1]):
+                cumulative += count
+                lines.append('vdc_api_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, cumulative))
+            lines.append('vdc_api_request_duration_seconds_sum{%s} %r' % (labels, float(series[n + 1])))
+            lines.append('vdc_api_request_duration_seconds_count{%s} %d' % (labels, series[n + 2]))
+        for name, index, text in (('vdc_api_request_bytes_total', n + 3, 'Bytes sent in VDC API requests.'),
+                                  ('vdc_api_response_bytes_total', n + 4, 'Bytes received in VDC API responses.')):
+            lines.append('# HELP %s %s' % (name, text))
+            lines.append('# TYPE %s counter' % name)
+            for (command, region), series in sorted(total.series.items()):
+                lines.append('%s{%s} %d' % (name, _labels(command=command, region=region), series[index]))
+        lines.append('# HELP vdc_api_errors_total Failed VDC API calls.')
+        lines.append('# TYPE vdc_api_errors_total counter')
+        for (command, region, error), count in sorted(total.errors.items()):
+            lines.append('vdc_api_errors_total{%s} %d' % (_labels(command=command, region=region, error=error), count))
+        lines.append('# HELP vdc_api_retries_total VDC API calls made again after an error.')
+        lines.append('# TYPE vdc_api_retries_total counter')
+        for (command, region), count in sorted(total.retries.items()):
+            lines.append('vdc_api_retries_total{%s} %d' % (_labels(command=command, region=region), count))
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path):
+        """
+            Write the metrics to the file 'path'. The file is replaced in one
+            step, so a reader never sees a part-written file.
+        """
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as fh:
+            fh.write(self.export_text())
+        os.rename(temp_path, path)
+
+    def serve(self, port=9464, host='127.0.0.1'):
+        """
+            Serve the metrics over HTTP on 'host':'port' from a background
+            thread. Returns the server object; call its shutdown() method to
+            stop it.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.export_text()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = MetricsServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return server
+
+
+class MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _labels(**labels):
+    """
+        Return the Prometheus label string for the given labels.
+    """
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                    for name, value in sorted(labels.items()))
@@ -0,0 +1,763 @@
+#! /usr/bin/env python
+# Python script for the Interoute Virtual Data Centre API:
+#   Name: vdc_mock_server.py
+#   Purpose: Local stand-in for the VDC API, for testing and benchmarking the programs without the real API
+#   Requires: Python standard library only
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# The server checks the signature of each request in the same way as the VDC API (and the
+# expiry time of a request signed with signatureVersion 3), and
+# simulates the commands used by the programs in this repo (listZones, listNetworks,
+# listVirtualMachines, deployVirtualMachine, destroyVirtualMachine, queryAsyncJobResult,
+# listAsyncJobs, createPortForwardingRule, listPublicIpAddresses and others) on a made-up
+# inventory of zones, networks and VMs in the three VDC regions. Deploy, destroy, start,
+# stop and port forwarding commands run as async jobs which finish after a few seconds.
+# The list commands support the 'page' and 'pagesize' parameters. Requests can be sent as
+# GET or POST, and responses are gzip-compressed for clients which accept it.
+#
+# The size of the inventory, the latency of the responses and the rate of injected
+# failures (HTTP errors, API limit errors and connection resets) can be set, so that the
+# programs can be load-tested at 10k+ VMs on one computer.
+#
+# You can pass options via the command line: type 'python vdc_mock_server.py -h' for usage information
+# Example: run a server with 10000 VMs, writing a config file for the programs to use:
+#     python vdc_mock_server.py --vms 10000 --config mock.vdcapi
+#     python check-vm-state.py -c mock.vdcapi
+# The programs without a '-c' option read ~/.vdcapi, so for those run the server with
+# '--config ~/.vdcapi' (after saving your own ~/.vdcapi elsewhere), or set HOME to a directory
+# which has the config file as '.vdcapi':
+#     mkdir mockhome; python vdc_mock_server.py --config mockhome/.vdcapi
+#     HOME=mockhome python widget-check-vm-state-v2.py
+#
+# Or in Python, start a server on a free port in a background thread:
+#     server = vdc_mock_server.start_server(vms=1000)
+#     api = vdc.VDCApiCall(server.url, server.vdc.api_key, server.vdc.secret)
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+import argparse
+import base64
+import BaseHTTPServer
+import datetime
+import hashlib
+import hmac
+import json
+import random
+import socket
+import SocketServer
+import struct
+import sys
+import threading
+import time
+import urllib
+import urlparse
+import uuid
+import zlib
+
+# Zones of the VDC regions
+REGIONS = [
+    ('Europe', ['Amsterdam (ESX)', 'Berlin (ESX)', 'Brussels (ESX)', 'Frankfurt (ESX)', 'Geneva (ESX)',
+                'London (ESX)', 'Madrid (ESX)', 'Milan (ESX)', 'Paris (ESX)', 'Slough (ESX)', 'Zurich (ESX)']),
+    ('USA', ['Los Angeles (ESX)', 'New York (ESX)']),
+    ('Asia', ['Hong Kong (ESX)']),
+]
+
+TEMPLATE_NAMES = ['Ubuntu 16.04 LTS', 'CentOS 7', 'Debian 8', 'Windows Server 2012 R2']
+
+# (name, cpunumber, memory) of the service offerings
+SERVICE_OFFERINGS = [('1024-1', 1, 1024), ('2048-1', 1, 2048), ('4096-2', 2, 4096), ('8192-4', 4, 8192)]
+
+# Async VM commands: command -> (VM state while the job runs, VM state after the job)
+ASYNC_VM_COMMANDS = {
+    'deployVirtualMachine': ('Starting', 'Running'),
+    'startVirtualMachine': ('Starting', 'Running'),
+    'stopVirtualMachine': ('Stopping', 'Stopped'),
+    'rebootVirtualMachine': ('Running', 'Running'),
+    'destroyVirtualMachine': ('Destroyed', 'Destroyed'),
+}
+
+# Required parameters of the commands which have any (also given in the listApis response)
+REQUIRED_PARAMS = {
+    'queryAsyncJobResult': ('jobid',),
+    'listLoadBalancerRuleInstances': ('id',),
+    'listEgressFirewallRules': ('networkid',),
+    'deployVirtualMachine': ('zoneid', 'templateid', 'serviceofferingid'),
+    'startVirtualMachine': ('id',),
+    'stopVirtualMachine': ('id',),
+    'rebootVirtualMachine': ('id',),
+    'destroyVirtualMachine': ('id',),
+    'createPortForwardingRule': ('ipaddressid', 'privateport', 'protocol', 'publicport', 'virtualmachineid'),
+    'createPrivateDirectConnect': ('zonename', 'cidr', 'gateway', 'dcgid'),
+    'createLocalNetwork': ('zonename', 'cidr', 'gateway'),
+}
+
+# Commands whose empty responses have 'count' and an empty list, like the VDC network commands;
+# the other list commands return an empty dict when nothing matches
+ALWAYS_COUNT_COMMANDS = set(['listNetworks', 'listDirectConnectGroups'])
+
+
+class MockError(Exception):
+    """
+        Error response of the API, with the HTTP status 'code' and the
+        'description' sent in the X-Description header.
+    """
+    def __init__(self, code, description):
+        Exception.__init__(self, description)
+        self.code = code
+        self.description = description
+
+
+def timestamp(t=None):
+    """
+        Return the time 't' (default now) in the format of the API responses.
+    """
+    return datetime.datetime.utcfromtimestamp(t or time.time()).strftime("%Y-%m-%dT%H:%M:%S+0000")
+
+
+class MockVDC(object):
+    """
+        The state of the mock VDC: the inventory of zones, networks, VMs and
+        other objects, and the async jobs. Each API command is handled by the
+        method named 'cmd_' + command.
+        'vms' is the number of VMs made at the start, spread over the zones.
+        An async job takes between 'job_time[0]' and 'job_time[1]' seconds.
+        If 'api_limit' is given, at most that number of calls are allowed in
+        each 'api_interval' seconds.
+    """
+    def __init__(self, vms=100, seed=0, job_time=(1.0, 3.0), api_key='mock-api-key', secret='mock-secret',
+                 account='mockaccount', api_limit=None, api_interval=60):
+        self.rng = random.Random(seed)
+        self.job_time = job_time
+        self.api_key = api_key
+        self.secret = secret
+        self.account = account
+        self.api_limit = api_limit
+        self.api_interval = api_interval
+        self.api_window = time.time()
+        self.api_issued = 0
+        self._lock = threading.Lock()
+        self.jobs = {}
+        self.pending_jobs = []
+        self.zones = {}
+        self.templates = {}
+        self.service_offerings = {}
+        self.networks = {}
+        self.public_ips = {}
+        self.vms = {}
+        self.pf_rules = {}
+        self.lb_rules = {}
+        self.egress_rules = {}
+        self.next_ip = {}
+        self.dcgs = [{'id': str(1000 + i), 'name': 'DCG-%d' % (i + 1)} for i in range(2)]
+        self.sshkeypairs = [{'name': 'mock-keypair', 'fingerprint': self._fingerprint()}]
+        for region, zone_names in REGIONS:
+            self.zones[region] = []
+            self.templates[region] = []
+            self.networks[region] = []
+            self.public_ips[region] = []
+            self.vms[region] = []
+            self.pf_rules[region] = []
+            self.lb_rules[region] = []
+            self.service_offerings[region] = [
+                {'id': self._uuid(), 'name': name, 'displaytext': '%d MB RAM, %d vCPU' % (memory, cpus),
+                 'cpunumber': cpus, 'cpuspeed': 2000, 'memory': memory, 'storagetype': 'shared'}
+                for name, cpus, memory in SERVICE_OFFERINGS]
+            for zone_name in zone_names:
+                zone = {'id': self._uuid(), 'name': zone_name, 'description': zone_name, 'networktype': 'Advanced',
+                        'allocationstate': 'Enabled', 'localstorageenabled': False, 'securitygroupsenabled': False}
+                self.zones[region].append(zone)
+                for name in TEMPLATE_NAMES:
+                    self.templates[region].append(
+                        {'id': self._uuid(), 'name': name, 'displaytext': name, 'zoneid': zone['id'],
+                         'zonename': zone_name, 'isready': True, 'ispublic': True, 'ostypename': name,
+                         'templatetype': 'USER', 'hypervisor': 'VMware', 'created': timestamp()})
+                # a /16 private network (room for many VMs) and an Internet network in each zone
+                n = len(self.zones[region])
+                self._new_network(region, zone, 'privatedirectconnect', '10.%d.0.0/16' % (len(self.zones) * 20 + n),
+                                  'Private-%s' % zone_name.split()[0], self.dcgs[n % 2])
+                self._new_network(region, zone, 'internetgateway', '192.168.%d.0/24' % n,
+                                  'Internet-%s' % zone_name.split()[0])
+        all_zones = [(region, zone) for region, zone_names in REGIONS for zone in self.zones[region]]
+        for i in range(vms):
+            region, zone = all_zones[i % len(all_zones)]
+            network = [n for n in self.networks[region]
+                       if n['zoneid'] == zone['id'] and n['subtype'] == 'privatedirectconnect'][0]
+            template = [t for t in self.templates[region] if t['zoneid'] == zone['id']][i % len(TEMPLATE_NAMES)]
+            vm = self._new_vm(region, zone, 'VM-%06d' % (i + 1), template['id'],
+                              self.service_offerings[region][i % len(SERVICE_OFFERINGS)]['id'], [network['id']])
+            vm['state'] = 'Running' if self.rng.random() < 0.9 else 'Stopped'
+        for region in self.zones:
+            for network in self.networks[region]:
+                if network['subtype'] != 'internetgateway':
+                    continue
+                self.egress_rules[network['id']] = [
+                    {'id': self._uuid(), 'protocol': 'all', 'networkid': network['id'], 'cidrlist': network['cidr'],
+                     'state': 'Active'}]
+                members = [vm for vm in self.vms[region] if vm['zoneid'] == network['zoneid']][:2]
+                ip = [ip for ip in self.public_ips[region] if ip['associatednetworkid'] == network['id']][0]
+                if members:
+                    self.lb_rules[region].append(
+                        {'id': self._uuid(), 'name': 'LB-%s' % network['zonename'].split()[0], 'description': '',
+                         'publicip': ip['ipaddress'], 'publicipid': ip['id'], 'publicport': '80', 'privateport': '80',
+                         'algorithm': 'roundrobin', 'networkid': network['id'], 'zoneid': network['zoneid'],
+                         'zonename': network['zonename'], 'state': 'Active', 'cidrlist': '', 'account': self.account,
+                         'domain': self.account, '_members': [vm['id'] for vm in members]})
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _fingerprint(self):
+        return ':'.join('%02x' % self.rng.randint(0, 255) for i in range(16))
+
+    def _new_network(self, region, zone, subtype, cidr, name, dcg=None):
+        address, bits = cidr.split('/')
+        netmask = socket.inet_ntoa(struct.pack('!I', (0xffffffff << (32 - int(bits))) & 0xffffffff))
+        network = {'id': self._uuid(), 'name': name, 'displaytext': name, 'zoneid': zone['id'],
+                   'zonename': zone['name'], 'cidr': cidr, 'gateway': self._address(address, 254), 'netmask': netmask,
+                   'type': 'Isolated', 'subtype': subtype, 'state': 'Implemented', 'isprovisioned': True,
+                   'account': self.account, 'domain': self.account, 'traffictype': 'Guest'}
+        if dcg is not None:
+            network['dcgid'] = dcg['id']
+            network['dcgfriendlyname'] = dcg['name']
+        self.networks[region].append(network)
+        self.next_ip[network['id']] = 0
+        if subtype == 'internetgateway':
+            self.public_ips[region].append(
+                {'id': self._uuid(), 'ipaddress': '203.0.%d.%d' % (len(self.public_ips[region]) % 250,
+                                                                   self.rng.randint(1, 250)),
+                 'associatednetworkid': network['id'], 'associatednetworkname': name, 'zoneid': zone['id'],
+                 'zonename': zone['name'], 'state': 'Allocated', 'issourcenat': True, 'isstaticnat': False,
+                 'account': self.account, 'domain': self.account})
+        return network
+
+    def _new_vm(self, region, zone, name, templateid, serviceofferingid, networkids, displayname=None, keypair=None):
+        template = self._find(self.templates[region], templateid, 'template')
+        offering = self._find(self.service_offerings[region], serviceofferingid, 'service offering')
+        nics = []
+        for i, networkid in enumerate(networkids):
+            network = self._find(self.networks[region], networkid, 'network')
+            # the next address of the network, leaving out the network, gateway and broadcast addresses
+            n = self.next_ip[networkid] + 1
+            while n % 256 in (0, 254, 255):
+                n += 1
+            self.next_ip[networkid] = n
+            nics.append({'id': self._uuid(), 'networkid': networkid, 'networkname': network['name'],
+                         'ipaddress': self._address(network['cidr'].split('/')[0], n),
+                         'netmask': network['netmask'], 'gateway': network['gateway'],
+                         'macaddress': '02:00:%s' % ':'.join('%02x' % self.rng.randint(0, 255) for j in range(4)),
+                         'isdefault': i == 0, 'type': 'Isolated', 'traffictype': 'Guest'})
+        vm = {'id': self._uuid(), 'name': name, 'displayname': displayname or name, 'state': 'Starting',
+              'zoneid': zone['id'], 'zonename': zone['name'], 'account': self.account, 'domain': self.account,
+              'templateid': template['id'], 'templatename': template['name'],
+              'serviceofferingid': offering['id'], 'serviceofferingname': offering['name'],
+              'cpunumber': offering['cpunumber'], 'cpuspeed': offering['cpuspeed'], 'memory': offering['memory'],
+              'cpuused': '%.2f%%' % (self.rng.random() * 100), 'networkkbsread': self.rng.randint(0, 100000),
+              'networkkbswrite': self.rng.randint(0, 100000), 'created': timestamp(), 'haenable': False,
+              'hypervisor': 'VMware', 'password': 'mock%06d' % self.rng.randint(0, 999999), 'nic': nics}
+        if keypair:
+            vm['keypair'] = keypair
+        self.vms[region].append(vm)
+        return vm
+
+    @staticmethod
+    def _address(address, n):
+        # the address 'n' after the IPv4 address 'address'
+        return socket.inet_ntoa(struct.pack('!I', struct.unpack('!I', socket.inet_aton(address))[0] + n))
+
+    @staticmethod
+    def _find(items, item_id, kind):
+        for item in items:
+            if item['id'] == item_id:
+                return item
+        raise MockError(431, 'Unable to execute API command due to invalid value. Invalid parameter %s id=%s'
+                        % (kind, item_id))
+
+    @staticmethod
+    def _region(params):
+        region = params.get('region', 'Europe').capitalize()
+        if region == 'Usa':
+            region = 'USA'
+        if region not in dict(REGIONS):
+            raise MockError(431, 'Unable to execute API command due to invalid value. Invalid region %s' % region)
+        return region
+
+    @staticmethod
+    def _required(params):
+        for name in REQUIRED_PARAMS.get(params['command'], ()):
+            if name not in params:
+                raise MockError(431, 'Unable to execute API command %s due to missing parameter %s'
+                                % (params['command'].lower(), name))
+
+    def _check_api_limit(self, command):
+        if self.api_limit is None or command == 'getApiLimit':
+            return
+        now = time.time()
+        if now >= self.api_window + self.api_interval:
+            self.api_window = now
+            self.api_issued = 0
+        self.api_issued += 1
+        if self.api_issued > self.api_limit:
+            raise MockError(429, 'The given user has reached his/her account api limit, please retry after %d ms.'
+                            % int((self.api_window + self.api_interval - now) * 1000))
+
+    def handle(self, params):
+        """
+            Make the API call given by the request parameters, and return the
+            response as a dict. Raises MockError for an error response.
+        """
+        command = params['command']
+        method = getattr(self, 'cmd_' + command, None)
+        if method is None:
+            raise MockError(432, 'The given command does not exist or it is not available for user')
+        with self._lock:
+            self._check_api_limit(command)
+            self._update_jobs()
+            self._required(params)
+            result = method(params)
+        return {command.lower() + 'response': result}
+
+    def _list(self, command, name, items, params, filters=('id',)):
+        """
+            Return the response of a list command for 'items', with the
+            items selected by the parameters in 'filters' (the 'name' and
+            'keyword' parameters match any part of the name), and a page of
+            the items if the 'page' parameter is given.
+        """
+        for key in filters:
+            if key in params:
+                value = params[key]
+                if key in ('name', 'keyword'):
+                    items = [item for item in items if value.lower() in item['name'].lower()]
+                elif key == 'state':
+                    items = [item for item in items if item['state'].lower() == value.lower()]
+                else:
+                    items = [item for item in items if str(item.get(key)) == value]
+        count = len(items)
+        if 'page' in params:
+            pagesize = int(params.get('pagesize', 500))
+            start = (int(params['page']) - 1) * pagesize
+            items = items[start:start + pagesize]
+        if count == 0 and command not in ALWAYS_COUNT_COMMANDS:
+            return {}
+        return {'count': count, name: [self._public(item) for item in items]}
+
+    @staticmethod
+    def _public(item):
+        # keys starting with '_' are for the server only
+        if any(key.startswith('_') for key in item):
+            return dict((key, value) for key, value in item.items() if not key.startswith('_'))
+        return item
+
+    # ASYNC JOBS
+
+    def _new_job(self, params, instancetype, instanceid, result_fn):
+        """
+            Start an async job, which finishes after a random time; then
+            'result_fn' is called to make the job result. Returns the
+            response of the async command.
+        """
+        now = time.time()
+        job = {'jobid': self._uuid(), 'cmd': params['command'], 'created': timestamp(now), 'jobstatus': 0,
+               'jobprocstatus': 0, 'jobresultcode': 0, 'jobinstancetype': instancetype, 'jobinstanceid': instanceid,
+               'accountid': self.account, 'userid': self.account,
+               '_region': self._region(params), '_done': now + self.rng.uniform(*self.job_time), '_result': result_fn}
+        self.jobs[job['jobid']] = job
+        self.pending_jobs.append(job)
+        return {'id': instanceid, 'jobid': job['jobid']}
+
+    def _update_jobs(self):
+        now = time.time()
+        if not self.pending_jobs or min(job['_done'] for job in self.pending_jobs) > now:
+            return
+        pending = []
+        for job in self.pending_jobs:
+            if job['_done'] > now:
+                pending.append(job)
+                continue
+            try:
+                job['jobresult'] = job.pop('_result')()
+                job['jobstatus'] = 1
+                job['jobresulttype'] = 'object'
+            except MockError as e:
+                job['jobresult'] = {'errorcode': e.code, 'errortext': e.description}
+                job['jobstatus'] = 2
+                job['jobresultcode'] = 530
+        self.pending_jobs = pending
+
+    def cmd_queryAsyncJobResult(self, params):
+        job = self.jobs.get(params['jobid'])
+        if job is None:
+            raise MockError(530, 'Unable to find the job by id=%s' % params['jobid'])
+        return self._public(job)
+
+    def cmd_listAsyncJobs(self, params):
+        region = self._region(params)
+        jobs = [job for job in self.jobs.values() if job['_region'] == region]
+        return self._list('listAsyncJobs', 'asyncjobs', jobs, params)
+
+    # LIST COMMANDS
+
+    def cmd_listZones(self, params):
+        return self._list('listZones', 'zone', self.zones[self._region(params)], params, ('id', 'name'))
+
+    def cmd_listTemplates(self, params):
+        return self._list('listTemplates', 'template', self.templates[self._region(params)], params,
+                          ('id', 'name', 'zoneid', 'keyword'))
+
+    def cmd_listServiceOfferings(self, params):
+        return self._list('listServiceOfferings', 'serviceoffering', self.service_offerings[self._region(params)],
+                          params, ('id', 'name', 'keyword'))
+
+    def cmd_listNetworks(self, params):
+        return self._list('listNetworks', 'network', self.networks[self._region(params)], params,
+                          ('id', 'name', 'zoneid', 'subtype', 'dcgid', 'keyword'))
+
+    def cmd_listDirectConnectGroups(self, params):
+        return self._list('listDirectConnectGroups', 'directconnectgroups', self.dcgs, params, ('id', 'name'))
+
+    def cmd_listVirtualMachines(self, params):
+        region = self._region(params)
+        vms = [vm for vm in self.vms[region] if vm['state'] not in ('Destroyed', 'Expunging')]
+        if 'networkid' in params:
+            vms = [vm for vm in vms if any(nic['networkid'] == params['networkid'] for nic in vm['nic'])]
+        return self._list('listVirtualMachines', 'virtualmachine', vms, params,
+                          ('id', 'name', 'state', 'zoneid', 'templateid', 'keyword'))
+
+    def cmd_listPublicIpAddresses(self, params):
+        return self._list('listPublicIpAddresses', 'publicipaddress', self.public_ips[self._region(params)], params,
+                          ('id', 'associatednetworkid', 'zoneid', 'ipaddress'))
+
+    def cmd_listPortForwardingRules(self, params):
+        return self._list('listPortForwardingRules', 'portforwardingrule', self.pf_rules[self._region(params)],
+                          params, ('id', 'ipaddressid', 'networkid'))
+
+    def cmd_listLoadBalancerRules(self, params):
+        return self._list('listLoadBalancerRules', 'loadbalancerrule', self.lb_rules[self._region(params)], params,
+                          ('id', 'name', 'publicipid', 'networkid', 'zoneid'))
+
+    def cmd_listLoadBalancerRuleInstances(self, params):
+        region = self._region(params)
+        rule = self._find(self.lb_rules[region], params['id'], 'load balancer rule')
+        vms = [vm for vm in self.vms[region] if vm['id'] in rule['_members']]
+        return self._list('listLoadBalancerRuleInstances', 'loadbalancerruleinstance', vms, params, ())
+
+    def cmd_listEgressFirewallRules(self, params):
+        return self._list('listEgressFirewallRules', 'firewallrule', self.egress_rules.get(params['networkid'], []),
+                          params, ('id',))
+
+    def cmd_listSSHKeyPairs(self, params):
+        return self._list('listSSHKeyPairs', 'sshkeypair', self.sshkeypairs, params, ('name',))
+
+    def cmd_listApis(self, params):
+        apis = []
+        for name in sorted(dir(self)):
+            if name.startswith('cmd_'):
+                command = name[len('cmd_'):]
+                required = REQUIRED_PARAMS.get(command, ())
+                apis.append({'name': command, 'isasync': command in ASYNC_VM_COMMANDS or command.startswith('create'),
+                             'params': [{'name': p, 'type': 'string', 'required': True} for p in required]})
+        return self._list('listApis', 'api', apis, params, ('name',))
+
+    def cmd_getApiLimit(self, params):
+        if self.api_limit is None:
+            allowed, issued, expire = 1000000, 0, 3600
+        else:
+            allowed, issued = self.api_limit, self.api_issued
+            expire = max(int(self.api_window + self.api_interval - time.time()), 0)
+        return {'apilimit': {'account': self.account, 'accountid': self.account, 'apiIssued': issued,
+                             'apiAllowed': allowed, 'expireAfter': expire}}
+
+    # COMMANDS WHICH CHANGE THE INVENTORY
+
+    def cmd_deployVirtualMachine(self, params):
+        region = self._region(params)
+        zone = self._find(self.zones[region], params['zoneid'], 'zone')
+        if 'networkids' in params:
+            networkids = params['networkids'].split(',')
+        else:
+            networkids = [n['id'] for n in self.networks[region] if n['zoneid'] == zone['id']][:1]
+        vm = self._new_vm(region, zone, params.get('name', 'VM-%s' % self._uuid()[:8]), params['templateid'],
+                          params['serviceofferingid'], networkids, params.get('displayname'), params.get('keypair'))
+
+        def result():
+            vm['state'] = 'Running'
+            return {'virtualmachine': self._public(vm)}
+        return self._new_job(params, 'VirtualMachine', vm['id'], result)
+
+    def _vm_job(self, params):
+        vm = self._find(self.vms[self._region(params)], params['id'], 'virtual machine')
+        running_state, final_state = ASYNC_VM_COMMANDS[params['command']]
+        vm['state'] = running_state
+
+        def result():
+            if params['command'] == 'destroyVirtualMachine' and str(params.get('expunge')).lower() == 'true':
+                vm['state'] = 'Expunging'
+            else:
+                vm['state'] = final_state
+            return {'virtualmachine': self._public(vm)}
+        return self._new_job(params, 'VirtualMachine', vm['id'], result)
+
+    cmd_startVirtualMachine = _vm_job
+    cmd_stopVirtualMachine = _vm_job
+    cmd_rebootVirtualMachine = _vm_job
+    cmd_destroyVirtualMachine = _vm_job
+
+    def cmd_createPortForwardingRule(self, params):
+        region = self._region(params)
+        ip = self._find(self.public_ips[region], params['ipaddressid'], 'ip address')
+        vm = self._find(self.vms[region], params['virtualmachineid'], 'virtual machine')
+        for rule in self.pf_rules[region]:
+            if rule['ipaddressid'] == ip['id'] and rule['publicport'] == params['publicport']:
+                raise MockError(431, 'The range specified, %s-%s, conflicts with rule %s which has %s-%s'
+                                % (params['publicport'], params['publicport'], rule['id'], rule['publicport'],
+                                   rule['publicendport']))
+        rule = {'id': self._uuid(), 'ipaddressid': ip['id'], 'ipaddress': ip['ipaddress'],
+                'publicport': params['publicport'], 'publicendport': params.get('publicendport', params['publicport']),
+                'privateport': params['privateport'], 'privateendport': params.get('privateendport', params['privateport']),
+                'protocol': params['protocol'].lower(), 'virtualmachineid': vm['id'], 'virtualmachinename': vm['name'],
+                'virtualmachinedisplayname': vm['displayname'], 'networkid': ip['associatednetworkid'],
+                'state': 'Add', 'cidrlist': ''}
+        self.pf_rules[region].append(rule)
+
+        def result():
+            rule['state'] = 'Active'
+            return {'portforwardingrule': rule}
+        return self._new_job(params, 'FirewallRule', rule['id'], result)
+
+    def _create_network(self, params, subtype, dcg=None):
+        region = self._region(params)
+        zones = [zone for zone in self.zones[region] if zone['name'] == params['zonename']]
+        if not zones:
+            raise MockError(431, 'Unable to execute API command due to invalid value. Invalid zonename %s'
+                            % params['zonename'])
+        name = params.get('displaytext', 'Network-%s' % params['cidr'])
+        network = self._new_network(region, zones[0], subtype, params['cidr'], name, dcg)
+        network['gateway'] = params['gateway']
+        return network
+
+    def cmd_createPrivateDirectConnect(self, params):
+        dcg = self._find(self.dcgs, params['dcgid'], 'direct connect group')
+        return {'privatedirectconnect': [self._create_network(params, 'privatedirectconnect', dcg)]}
+
+    def cmd_createLocalNetwork(self, params):
+        return {'localnetwork': [self._create_network(params, 'internetgateway')]}
+
+
+def signature(params, secret):
+    """
+        Return the signature of the request parameters, made in the same
+        way as by VDCApiCall.
+    """
+    request = sorted([(key, value) for key, value in params.items() if key != 'signature'],
+                     key=lambda x: x[0].lower())
+    hashStr = '&'.join('='.join([key.lower(), urllib.quote_plus(value, safe='*').lower().replace('+', '%20')])
+                       for key, value in request)
+    return base64.b64encode(hmac.new(secret, hashStr, hashlib.sha1).digest()).strip()
+
+
+def expired(expires):
+    """
+        Return True if the 'expires' time of a request signed with
+        signatureVersion 3 (e.g. '2017-05-01T12:00:00+0000') has passed, or
+        cannot be read.
+    """
+    try:
+        when = datetime.datetime.strptime(expires[:19], '%Y-%m-%dT%H:%M:%S')
+        offset = {'+': 1, '-': -1}[expires[19]] * (int(expires[20:22]) * 60 + int(expires[22:24]))
+    except (ValueError, KeyError, IndexError):
+        return True
+    return when - datetime.timedelta(minutes=offset) < datetime.datetime.utcnow()
+
+
+def latency_function(spec):
+    """
+        Return a function giving the response latency in seconds, for the
+        distribution 'spec': 'none', 'fixed:SECONDS', 'uniform:MIN,MAX',
+        'exp:MEAN' or 'lognormal:MEDIAN,SIGMA'.
+    """
+    kind, _, values = spec.partition(':')
+    values = [float(v) for v in values.split(',') if v]
+    if kind == 'none':
+        return lambda: 0
+    if kind == 'fixed':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: random.uniform(values[0], values[1])
+    if kind == 'exp':
+        return lambda: random.expovariate(1 / values[0])
+    if kind == 'lognormal':
+        import math
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise ValueError('Unknown latency distribution: %s' % spec)
+
+
+class MockRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # (the headers and body are sent in separate writes, which with Nagle's algorithm and the client's
+    # delayed ACK hold up each response on a kept-alive connection by 40 ms)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # (the timeout of the socket closes a connection which is idle for longer than the server's idle timeout)
+        self.timeout = self.server.idle_timeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        self.handle_api(dict(urlparse.parse_qsl(urlparse.urlsplit(self.path).query, keep_blank_values=True)))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        self.handle_api(dict(urlparse.parse_qsl(body, keep_blank_values=True)))
+
+    def handle_api(self, params):
+        server = self.server
+        vdc = server.vdc
+        server.count_request()
+        delay = server.latency()
+        if delay > 0:
+            time.sleep(delay)
+        # STEP: Failure injection
+        r = random.random()
+        if r < server.reset_rate:
+            # close the connection with a TCP reset, without sending a response
+            self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            self.close_connection = 1
+            return
+        r -= server.reset_rate
+        if r < server.error_rate:
+            return self.send_error_response(530, 'Injected internal error of the mock server')
+        r -= server.error_rate
+        if r < server.throttle_rate:
+            return self.send_error_response(429, 'The given user has reached his/her account api limit, '
+                                                 'please retry after 1000 ms.')
+        # STEP: Check the API key and signature
+        if params.get('apiKey') != vdc.api_key or 'signature' not in params or 'command' not in params:
+            return self.send_error_response(401, 'unable to verify user credentials and/or request signature')
+        if params['signature'] != signature(params, vdc.secret):
+            return self.send_error_response(401, 'unable to verify user credentials and/or request signature')
+        if params.get('signatureVersion') == '3' and expired(params.get('expires', '')):
+            return self.send_error_response(401, 'unable to verify user credentials and/or request signature')
+        # STEP: Make the API call
+        try:
+            body = json.dumps(vdc.handle(params))
+        except MockError as e:
+            return self.send_error_response(e.code, e.description)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if len(body) > 1024 and 'gzip' in self.headers.getheader('Accept-Encoding', ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_response(self, code, description):
+        body = json.dumps({'errorresponse': {'errorcode': code, 'errortext': description}})
+        self.send_response(code)
+        self.send_header('X-Description', description)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MockServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+        HTTP server for a MockVDC. The latency of each response is given by
+        the function 'latency'; 'error_rate', 'throttle_rate' and
+        'reset_rate' are the fractions of requests which get an internal
+        error, an API limit error or a connection reset. A kept-alive
+        connection which is idle for 'idle_timeout' seconds is closed by the
+        server (as real servers do, often after a few seconds).
+    """
+    daemon_threads = True
+    request_queue_size = 128
+    allow_reuse_address = True
+
+    def __init__(self, address, vdc, latency=None, error_rate=0, throttle_rate=0, reset_rate=0, verbose=False,
+                 idle_timeout=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, MockRequestHandler)
+        self.idle_timeout = idle_timeout
+        self.vdc = vdc
+        self.latency = latency or (lambda: 0)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.reset_rate = reset_rate
+        self.verbose = verbose
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.url = 'http://%s:%d/vdc-api/' % self.server_address[:2]
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+
+def start_server(host='127.0.0.1', port=0, latency='none', error_rate=0, throttle_rate=0, reset_rate=0,
+                 verbose=False, idle_timeout=None, **kwargs):
+    """
+        Start a mock server in a background thread and return it. The
+        server URL is in its 'url' attribute, and the MockVDC in its 'vdc'
+        attribute. Other keyword arguments are passed to MockVDC. Port 0
+        means any free port.
+    """
+    server = MockServer((host, port), MockVDC(**kwargs), latency_function(latency), error_rate, throttle_rate,
+                        reset_rate, verbose, idle_timeout)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    # STEP: Parse the command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default='127.0.0.1', help="address for the server to listen on (default 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=8080, help="port for the server to listen on (default 8080)")
+    parser.add_argument("-n", "--vms", type=int, default=100, help="number of VMs in the inventory at the start (default 100)")
+    parser.add_argument("-s", "--seed", type=int, default=0, help="random seed for making the inventory (default 0)")
+    parser.add_argument("-l", "--latency", default='none',
+                        help="distribution of the response latency in seconds: none, fixed:S, uniform:MIN,MAX, exp:MEAN or lognormal:MEDIAN,SIGMA (default none)")
+    parser.add_argument("-j", "--jobtime", default='1,3', help="min,max time in seconds for an async job to finish (default 1,3)")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests to fail with an internal error, HTTP 530 (default 0)")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="fraction of requests to fail with an API limit error, HTTP 429 (default 0)")
+    parser.add_argument("--reset-rate", type=float, default=0, help="fraction of requests to get a connection reset (default 0)")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="time in seconds after which an idle kept-alive connection is closed (default never)")
+    parser.add_argument("--api-limit", type=int, default=None, help="number of API calls allowed in each --api-interval (default no limit)")
+    parser.add_argument("--api-interval", type=int, default=60, help="time in seconds of the API limit interval (default 60)")
+    parser.add_argument("--api-key", default='mock-api-key', help="API key accepted by the server (default mock-api-key)")
+    parser.add_argument("--secret", default='mock-secret', help="API secret key of the server (default mock-secret)")
+    parser.add_argument("-c", "--config", default='',
+                        help="write a config file with the URL and keys of the server, for the -c option of the programs "
+                             "(the programs without -c read ~/.vdcapi)")
+    parser.add_argument("-v", "--verbose", action='store_true', help="log every request")
+    args = parser.parse_args()
+
+    # STEP: Make the inventory and start the server
+    print("Making the inventory with %d VMs..." % args.vms)
+    vdc = MockVDC(vms=args.vms, seed=args.seed, job_time=[float(t) for t in args.jobtime.split(',')],
+                  api_key=args.api_key, secret=args.secret, api_limit=args.api_limit, api_interval=args.api_interval)
+    server = MockServer((args.host, args.port), vdc, latency_function(args.latency), args.error_rate,
+                        args.throttle_rate, args.reset_rate, args.verbose, args.idle_timeout)
+    if args.config:
+        with open(args.config, 'w') as fh:
+            json.dump({'api_url': server.url, 'api_key': args.api_key, 'api_secret': args.secret}, fh)
+        print("Config file written to %s" % args.config)
+    print("Mock VDC API server running at %s (press Ctrl-C to stop)" % server.url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nServer stopped after %d requests." % server.requests)
+
+
+if __name__ == '__main__':
+    main()
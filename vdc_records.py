@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+# Python classes for compact records of VDC API list responses
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# The record classes use __slots__ so that each record takes a small fraction of the
+# memory of the JSON dict it is made from: only the listed fields are kept, ASCII
+# strings are stored as 'str' instead of 'unicode', and values which are repeated in
+# many records (such as state or zone name) are interned so that one copy is shared.
+# Records can be read by attribute (vm.name) or like the original dict (vm['name']),
+# so code written for the dicts works unchanged. Fields which are missing from the
+# API response are set to None and behave as missing keys for dict-style access.
+# The 'region' field is not in the API responses: it is set on the records of calls made
+# in several regions at once with VDCApiCall.fan_out.
+#
+# Use with VDCApiCall by passing 'records=True' to an API call:
+#     result = api.listVirtualMachines({'region': 'Europe'}, records=True)
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+
+
+def compact(value, shared=False):
+    """
+        Return a compact form of a decoded JSON value: unicode strings which
+        are ASCII are converted to str, and interned if 'shared' is true.
+    """
+    if isinstance(value, unicode):
+        try:
+            value = value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+        if shared:
+            value = intern(value)
+    return value
+
+
+class Record(object):
+    """
+        Base class for the record classes. A subclass lists its fields in
+        __slots__, the fields whose values are shared between many records
+        in 'shared', and the classes for fields holding lists of nested
+        records in 'nested'.
+    """
+    __slots__ = ()
+    shared = frozenset()
+    nested = {}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+            Make a record from the dict of a decoded API response.
+        """
+        record = cls.__new__(cls)
+        for name in cls.__slots__:
+            value = data.get(name)
+            if name in cls.nested:
+                if value is not None:
+                    value = tuple(cls.nested[name].from_dict(item) for item in value)
+            else:
+                value = compact(value, name in cls.shared)
+            setattr(record, name, value)
+        return record
+
+    def to_dict(self):
+        """
+            Return the record as a dict with the fields which are present.
+        """
+        result = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not None:
+                if name in self.nested:
+                    value = [item.to_dict() for item in value]
+                result[name] = value
+        return result
+
+    def __getitem__(self, name):
+        value = getattr(self, name, None)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return getattr(self, name, None) is not None
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        if value is None:
+            return default
+        return value
+
+    def keys(self):
+        return [name for name in self.__slots__ if getattr(self, name) is not None]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.keys()))
+
+
+class Nic(Record):
+    __slots__ = ('id', 'networkid', 'networkname', 'ipaddress', 'netmask', 'gateway', 'macaddress',
+                 'isdefault', 'type', 'traffictype')
+    shared = frozenset(['networkid', 'networkname', 'netmask', 'gateway', 'type', 'traffictype'])
+
+
+class VirtualMachine(Record):
+    __slots__ = ('id', 'name', 'displayname', 'state', 'zoneid', 'zonename', 'account', 'domain', 'domainid',
+                 'templateid', 'templatename', 'serviceofferingid', 'serviceofferingname', 'cpunumber',
+                 'cpuspeed', 'memory', 'created', 'haenable', 'keypair', 'password', 'hypervisor', 'nic', 'region')
+    shared = frozenset(['state', 'zoneid', 'zonename', 'account', 'domain', 'domainid', 'templateid',
+                        'templatename', 'serviceofferingid', 'serviceofferingname', 'keypair', 'hypervisor',
+                        'region'])
+    nested = {'nic': Nic}
+
+
+class Network(Record):
+    __slots__ = ('id', 'name', 'displaytext', 'zoneid', 'zonename', 'cidr', 'gateway', 'netmask', 'type',
+                 'subtype', 'state', 'dcgid', 'dcgfriendlyname', 'isprovisioned', 'account', 'domain', 'domainid',
+                 'networkofferingname', 'traffictype', 'vpcid', 'region')
+    shared = frozenset(['zoneid', 'zonename', 'netmask', 'type', 'subtype', 'state', 'dcgid', 'dcgfriendlyname',
+                        'account', 'domain', 'domainid', 'networkofferingname', 'traffictype', 'region'])
+
+
+class PortForwardingRule(Record):
+    __slots__ = ('id', 'ipaddressid', 'ipaddress', 'publicport', 'publicendport', 'privateport', 'privateendport',
+                 'protocol', 'virtualmachineid', 'virtualmachinename', 'networkid', 'state', 'cidrlist', 'region')
+    shared = frozenset(['ipaddressid', 'ipaddress', 'protocol', 'networkid', 'state', 'cidrlist', 'region'])
+
+
+class LoadBalancerRule(Record):
+    __slots__ = ('id', 'name', 'description', 'publicip', 'publicipid', 'publicport', 'privateport', 'algorithm',
+                 'networkid', 'zoneid', 'state', 'cidrlist', 'account', 'domain', 'region')
+    shared = frozenset(['publicip', 'publicipid', 'algorithm', 'networkid', 'zoneid', 'state', 'cidrlist',
+                        'account', 'domain', 'region'])
+
+
+# Record class for each list name in the API responses
+RECORD_TYPES = {
+    'virtualmachine': VirtualMachine,
+    'nic': Nic,
+    'network': Network,
+    'portforwardingrule': PortForwardingRule,
+    'loadbalancerrule': LoadBalancerRule,
+}
+
+
+def convert_response(result):
+    """
+        Convert the lists of a decoded API response which have a record
+        class to lists of records. Other lists are left as they are.
+    """
+    for name, value in result.items():
+        if name in RECORD_TYPES and isinstance(value, list):
+            result[name] = [RECORD_TYPES[name].from_dict(item) for item in value]
+    return result
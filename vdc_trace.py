@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+# Python classes to record a timeline of a script run in the Chrome trace-event format
+# For download and information: https://github.com/Interoute/API-fun-and-education
+#
+# This program is configured for Python version 2.6/2.7
+#
+# A Tracer records spans of time: one for each API call, job wait, sleep and subprocess
+# call, nested inside the phases of the script. The trace is written as a JSON file in
+# the Chrome trace-event format, which can be opened in Perfetto (https://ui.perfetto.dev)
+# or in chrome://tracing to see where the time of the run goes.
+#
+# A script marks its phases with tracer.phase(name): each phase lasts until the next
+# one starts (or the tracer is closed), so the steps of a script do not have to be
+# indented inside 'with' blocks. NullTracer has the same methods and records nothing,
+# for when tracing is turned off.
+#
+# A long-running program can keep only the latest events (max_events) and write the trace
+# so far with tracer.flush(), e.g. once in each loop. The trace is also written when the
+# program is stopped with SIGTERM.
+#
+# Use with VDCApiCall by passing a tracer as 'tracer':
+#     tracer = vdc_trace.Tracer('run.trace.json')
+#     api = vdc.VDCApiCall(api_url, apiKey, secret, tracer=tracer)
+#     tracer.phase('Deploy virtual machines')
+#
+# Copyright (C) Interoute Communications Limited, 2017
+
+from __future__ import print_function
+from collections import deque
+import atexit
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Tracer(object):
+    """
+        Recorder of trace events. If 'path' is given, the trace is written
+        to that file when the tracer is closed, which happens at the latest
+        when the program exits (also by SIGTERM, if the program has no
+        handler of its own for it). If 'max_events' is given, only that
+        many of the latest events are kept, so that the trace of a program
+        which runs for days does not grow without limit.
+    """
+    def __init__(self, path=None, max_events=None):
+        self.path = path
+        self.pid = os.getpid()
+        self.origin = time.time()
+        self.events = deque(maxlen=max_events)
+        self._threads = {}
+        self._phase = None
+        self._closed = False
+        self._lock = threading.Lock()
+        if path is not None:
+            atexit.register(self.close)
+            # (SIGTERM normally kills the program without running the atexit functions)
+            if threading.current_thread().name == 'MainThread' and \
+                    signal.getsignal(signal.SIGTERM) == signal.SIG_DFL:
+                signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+
+    def _event(self, event):
+        thread = threading.current_thread()
+        event['pid'] = self.pid
+        event['tid'] = thread.ident
+        with self._lock:
+            self._threads[thread.ident] = thread.name
+            self.events.append(event)
+
+    def _ts(self, t):
+        # trace event times are in microseconds from the start of the trace
+        return int((t - self.origin) * 1000000)
+
+    def complete(self, name, cat, start, end=None, **args):
+        """
+            Record a span 'name' in category 'cat' from the time 'start' to
+            the time 'end' (default now), as given by time.time().
+        """
+        if end is None:
+            end = time.time()
+        self._event({'name': name, 'cat': cat, 'ph': 'X', 'ts': self._ts(start),
+                     'dur': self._ts(end) - self._ts(start), 'args': args})
+
+    @contextmanager
+    def span(self, name, cat='span', **args):
+        """
+            Context manager recording a span for the time of its block.
+        """
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.complete(name, cat, start, **args)
+
+    def begin(self, name, cat='phase', **args):
+        """
+            Start a span which lasts until end() is called on the same thread.
+        """
+        self._event({'name': name, 'cat': cat, 'ph': 'B', 'ts': self._ts(time.time()), 'args': args})
+
+    def end(self):
+        """
+            End the span last started by begin() on this thread.
+        """
+        self._event({'ph': 'E', 'ts': self._ts(time.time())})
+
+    def phase(self, name, **args):
+        """
+            Start the script phase 'name', ending the previous phase.
+        """
+        if self._phase is not None:
+            self.end()
+        self._phase = name
+        self.begin(name, 'phase', **args)
+
+    def instant(self, name, **args):
+        """
+            Record an event with no duration.
+        """
+        self._event({'name': name, 'cat': 'mark', 'ph': 'i', 's': 't', 'ts': self._ts(time.time()), 'args': args})
+
+    def sleep(self, seconds, name='sleep'):
+        """
+            time.sleep() recorded as a span.
+        """
+        start = time.time()
+        time.sleep(seconds)
+        self.complete(name, 'sleep', start)
+
+    def call(self, args, **kwargs):
+        """
+            subprocess.call() recorded as a span. Returns the exit code.
+        """
+        start = time.time()
+        returncode = subprocess.call(args, **kwargs)
+        name = args if isinstance(args, basestring) else ' '.join(args)
+        self.complete(name, 'subprocess', start, returncode=returncode)
+        return returncode
+
+    def trace(self):
+        """
+            Return the trace as a dict in the Chrome trace-event format.
+        """
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'tid': 0,
+                       'args': {'name': os.path.basename(sys.argv[0]) or 'python'}})
+        for tid, name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path=None):
+        """
+            Write the trace to the file 'path' (default: the path given when
+            the tracer was made).
+        """
+        path = path or self.path
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'w') as fh:
+            json.dump(self.trace(), fh)
+        os.rename(temp_path, path)
+
+    def flush(self):
+        """
+            Write the trace so far, if the tracer has a path, without
+            closing the tracer (the current phase is shown as unfinished).
+        """
+        if self.path is not None and not self._closed:
+            self.save()
+
+    def close(self):
+        """
+            End the current phase, and write the trace if the tracer has a path.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._phase is not None:
+            self.end()
+            self._phase = None
+        if self.path is not None:
+            self.save()
+            print("Trace written to %s" % self.path)
+
+
+class NullTracer(object):
+    """
+        Tracer which records nothing, for when tracing is turned off.
+    """
+    path = None
+
+    def complete(self, name, cat, start, end=None, **args):
+        pass
+
+    @contextmanager
+    def span(self, name, cat='span', **args):
+        yield args
+
+    def begin(self, name, cat='phase', **args):
+        pass
+
+    def end(self):
+        pass
+
+    def phase(self, name, **args):
+        pass
+
+    def instant(self, name, **args):
+        pass
+
+    def sleep(self, seconds, name='sleep'):
+        time.sleep(seconds)
+
+    def call(self, args, **kwargs):
+        return subprocess.call(args, **kwargs)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
@@ -26,6 +26,7 @@ from __future__ import print_function
 from collections import OrderedDict
 import base64
 import vdc_api_call as vdc
+import vdc_catalog
 import getpass
 import json
 import os
@@ -92,6 +93,7 @@ if __name__ == '__main__':
     parser.add_argument("-p", "--portforwarding", action='store_true', help="ask for input of portforwarding port(s) and execute create rules or output the create commands")
     parser.add_argument("-a", "--affinity", action='store_true', help="[NOT IMPLEMENTED] ask for selection of affinity group(s)")
     parser.add_argument("-i", "--iso", action='store_true', help="[NOT IMPLEMENTED] deploy from an ISO image")
+    parser.add_argument("--refresh", action='store_true', help="refresh the catalog of zones, templates, service offerings and networks from the API (default: use the catalog file ~/.vdcapi_catalog.db while it is up to date)")
 
     vdcRegion = parser.parse_args().region
     config_file = parser.parse_args().config
@@ -102,6 +104,7 @@ if __name__ == '__main__':
     askForUserdata = parser.parse_args().userdata
     askForAffinityGroup = parser.parse_args().affinity
     askForPortforwarding = parser.parse_args().portforwarding
+    refreshCatalog = parser.parse_args().refresh
     
     # STEP: If config file is found, read its content,
     # else query user for the URL, API key, Secret key
@@ -119,23 +122,27 @@ if __name__ == '__main__':
         apiKey = raw_input()
         secret = getpass.getpass(prompt='API secret:')
 
-    # STEP: Create the API access object
+    # STEP: Create the API access object, and open the catalog of zones, templates, service offerings and networks
+    # (the catalog is kept in a file and only listed again from the API when it is out of date, or with --refresh)
     api = vdc.VDCApiCall(api_url, apiKey, secret)
+    catalog = vdc_catalog.Catalog(api)
+    if refreshCatalog:
+        catalog.refresh(regions=[vdcRegion])
 
 #TO ADD: CHOOSE REGION OR FIND ZONES FOR ALL REGIONS THAT THE VDC ACCOUNT CAN ACCESS..........................
 
     # STEP: Select the zone
-    result = api.listZones({'region': vdcRegion})
-    zonelist = [zone['name'] for zone in result['zone']]
-    zone_ids = [zone['id'] for zone in result['zone']]
+    result = catalog.zones(vdcRegion)
+    zonelist = [zone['name'] for zone in result]
+    zone_ids = [zone['id'] for zone in result]
     print("ZONES:")
     choice = choose_item_from_list(zonelist, prompt="Select the zone?")
     zone_id = zone_ids[choice['itemindex']]
     print("Selected zone: %s, %s\n" % (zone_id, choice['itemcontent']))
 
     # STEP: Check if a network exists in selected zone, otherwise terminate
-    networks_available = api.listNetworks({'region': vdcRegion, 'zoneid': zone_id})
-    if networks_available['count']==0:
+    networks_available = {'network': catalog.networks(vdcRegion, zoneid=zone_id)}
+    if networks_available['network']==[]:
         print("ERROR: There are no networks in the selected zone. You must create a network to deploy a virtual machine.")
         sys.exit("FATAL: Program terminating")
     # If 'subtype' is not in the API call response then add the keypair 'subtype':'unknown' to all network dicts in networks_available
@@ -147,13 +154,8 @@ if __name__ == '__main__':
        print("Error: ISO case not implemented yet")
        exit
     else:
-       request = {
-        'region': vdcRegion,
-        'templatefilter': 'executable',
-        'zoneid': zone_id,
-       }
-       result = api.listTemplates(request)
-       templates_sorted = sorted(result['template'], key=lambda item: item['name'].upper())
+       result = catalog.templates(vdcRegion, zoneid=zone_id)
+       templates_sorted = sorted(result, key=lambda item: item['name'].upper())
        templatelist = [template['name'] for template in templates_sorted]
        template_ids = [template['id'] for template in templates_sorted]
        print("TEMPLATES:")
@@ -171,8 +173,7 @@ if __name__ == '__main__':
     print('')
     print("RAM MEMORY:")
     choice_ram = choose_item_from_list(map(lambda x: float(x)/1024, ramlist), prompt="Select the amount of RAM (GBytes)?")
-    result = api.listServiceOfferings({'region': vdcRegion})
-    serviceoffering_id = [s['id'] for s in result['serviceoffering'] if s['name']=='%d-%d'% (ramlist[choice_ram['itemindex']],choice_cpu)][0]
+    serviceoffering_id = catalog.service_offerings(vdcRegion, '%d-%d'% (ramlist[choice_ram['itemindex']],choice_cpu))[0]['id']
     print("Selected service offering: %s, \'%s\'\n" % (serviceoffering_id, '%d-%d'% (ramlist[choice_ram['itemindex']],choice_cpu)))
 
     # (optional) STEP: Select the affinity groups (if any exist)
@@ -215,7 +216,7 @@ if __name__ == '__main__':
         networks_selected = {}
         for netid in network_id.split(','):
             networks_selected[netid] = {}
-            tempnet = api.listNetworks({'region': vdcRegion, 'id':netid})['network'][0]
+            tempnet = catalog.networks(vdcRegion, id=netid)[0]
             if tempnet['subtype'] == 'internetgateway':
                networks_selected[netid]['network'] = tempnet
                try:
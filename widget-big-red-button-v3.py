@@ -43,10 +43,13 @@ class MainWindow(Frame):
                 secret = config['api_secret']
     
         # Create the api access object
+        # (it is shared by the GPIO callback threads and the Tk timers, which is safe)
         self.api = vdc.VDCApiCall(api_url, apiKey, secret)
 
         # INITIALISE THE GUI
         self.vmSelectedNumber= 0
+        # Future for the start/stop job being waited for (the job is waited for in the background so the GUI doesn't freeze)
+        self.pendingJob = None
         self.pack({"fill":"both"})
         self.createWidgets()
 
@@ -84,10 +87,18 @@ class MainWindow(Frame):
         return result
  
     def vmStates_update(self):
-        self.vmStatesLabel["text"]=self.get_vm_info()
+        if self.pendingJob is None:
+            self.vmStatesLabel["text"]=self.get_vm_info()
         # VM information will update after specified millisecs
         self.vmStatesLabel.after(5000, self.vmStates_update)
 
+    def pendingJob_check(self):
+        # When the start/stop job finishes, update the VM information at once
+        if self.pendingJob is not None and self.pendingJob.done():
+            self.pendingJob = None
+            self.vmStatesLabel["text"]=self.get_vm_info()
+        self.vmStatesLabel.after(500, self.pendingJob_check)
+
     def get_vm_info(self):
         #this method performs the API call 'listVirtualMachines'
         request={}
@@ -130,21 +141,19 @@ class MainWindow(Frame):
         
     def redButtonPressed(self,channel):
         print "test: RED BUTTON PRESSED!!"
-        if self.vm['state']=='Running':
+        if self.vm['state']=='Running' and self.pendingJob is None:
             request={'id': self.vm['id']}
             result= self.api.stopVirtualMachine(request)
             self.vmStatesLabel["text"]='**VM stopping, please wait**'      
-            self.api.wait_for_job(result['jobid'])
-            self.vmStatesLabel["text"]=self.get_vm_info()
+            self.pendingJob = self.api.wait_for_job_async(result['jobid'], timeout=600)
     
     def greenButtonPressed(self,channel):
         print "test: GREEN BUTTON PRESSED!!"
-        if self.vm['state']=='Stopped':
+        if self.vm['state']=='Stopped' and self.pendingJob is None:
             request={'id': self.vm['id']}
             result= self.api.startVirtualMachine(request)
             self.vmStatesLabel["text"]='**VM starting, please wait**'      
-            self.api.wait_for_job(result['jobid'])
-            self.vmStatesLabel["text"]=self.get_vm_info()   
+            self.pendingJob = self.api.wait_for_job_async(result['jobid'], timeout=600)
 
     def emergencyButtonPressed(self,channel):
        #need short time delay so that button is stable on or off when state is checked
@@ -197,6 +206,8 @@ class MainWindow(Frame):
         self.vmStatesLabel["text"]=self.get_vm_info()
         # VM information will update after 5000 millisecs
         self.vmStatesLabel.after(5000, self.vmStates_update)
+        # Check for a finished start/stop job every 500 millisecs
+        self.vmStatesLabel.after(500, self.pendingJob_check)
 
         self.SELECTDOWN = Button(self)
         self.SELECTDOWN["text"] = "< VM select"
@@ -21,42 +21,61 @@
 
 from Tkinter import *
 import vdc_api_call as vdc
+import vdc_inventory
 import json
 import os
 import datetime
 
 class Application(Frame):
     def vmStates_update(self):
-        #this method performs the API call 'listVirtualMachines'
+        #this method polls the VM inventory (see vdc_inventory.py): the first poll shows all of the VMs,
+        #and each later poll only changes the lines of the VMs which were added or removed or changed state
 
-        # Delete all current content of Text widget
-        self.vmStatesText.delete(1.0, END)
-
-        request={}
         checkTime = datetime.datetime.utcnow() # get the current time (UTC = GMT)
         try:
-            result = self.api.listVirtualMachines(request)
-            testdict = result['virtualmachine'][0] #this should throw exception if dictionary lookup fails
+            changes = self.inventory.poll()
         except:
-            self.vmStatesText.insert('end', "*** Error: VM data not returned by API\n***")
+            self.vmStates_header("*** Error: VM data not returned by API\n***")
             return -1
 
-        self.vmStatesText.insert('end',"%d VMs in the account '%s'\nchecked at %s" % (result['count'],result['virtualmachine'][1]['account'],checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))
-
-        vmcounter=0
-        for vm in result['virtualmachine']:
-            vmcounter = vmcounter + 1
-            if vm['state'] == 'Running':
-               self.vmStatesText.insert('end',"\n  [%2d] %s  " % (vmcounter,vm['name']), ('stateRunning'))
-            elif vm['state'] == 'Stopped':
-               self.vmStatesText.insert('end',"\n  [%2d] %s  (%s)" % (vmcounter,vm['name'],vm['state']), ('stateStopped'))
-            else:
-               self.vmStatesText.insert('end',"\n  [%2d] %s  (%s)" % (vmcounter,vm['name'],vm['state']), ('stateOther'))
+        for change in changes:
+            vmTag = 'vm-%s' % change.id
+            if change.kind == vdc_inventory.ADDED:
+                self.vmNumbers[change.id] = self.vmNextNumber
+                self.vmNextNumber += 1
+                self.vmStates_line('end', change.vm, vmTag)
+            elif change.kind == vdc_inventory.REMOVED:
+                self.vmStatesText.delete('%s.first' % vmTag, '%s.last' % vmTag)
+                self.vmStatesText.tag_delete(vmTag)
+                del self.vmNumbers[change.id]
+            elif change.kind == vdc_inventory.STATE:
+                lineStart = self.vmStatesText.index('%s.first' % vmTag)
+                self.vmStatesText.delete(lineStart, '%s.last' % vmTag)
+                self.vmStates_line(lineStart, change.vm, vmTag)
+
+        vms = list(self.inventory)
+        self.vmStates_header("%d VMs in the account '%s'\nchecked at %s" % (len(vms),vms[0]['account'] if vms else '',checkTime.strftime("%Y-%m-%d %H:%M:%S UTC")))
 
         # VM information will update after 60000 millisecs = 1 minute
         # ...set this value as you like
         self.vmStatesText.after(60000, self.vmStates_update)
 
+    def vmStates_header(self, text):
+        #replace the header text at the top of the Text widget
+        if self.vmStatesText.tag_ranges('header'):
+            self.vmStatesText.delete('header.first', 'header.last')
+        self.vmStatesText.insert('1.0', text, ('header'))
+
+    def vmStates_line(self, index, vm, vmTag):
+        #insert the line for one VM at 'index', tagged with the state colour and with the VM's own tag
+        vmNumber = self.vmNumbers[vm['id']]
+        if vm['state'] == 'Running':
+           self.vmStatesText.insert(index,"\n  [%2d] %s  " % (vmNumber,vm['name']), ('stateRunning', vmTag))
+        elif vm['state'] == 'Stopped':
+           self.vmStatesText.insert(index,"\n  [%2d] %s  (%s)" % (vmNumber,vm['name'],vm['state']), ('stateStopped', vmTag))
+        else:
+           self.vmStatesText.insert(index,"\n  [%2d] %s  (%s)" % (vmNumber,vm['name'],vm['state']), ('stateOther', vmTag))
+
     def refresh_states(self):
         #this method is called when the 'REFRESH' button is pressed
         self.vmStates_update()
@@ -96,8 +115,12 @@ class Application(Frame):
                 apiKey = config['api_key']
                 secret = config['api_secret']
     
-        # Create the api access object
+        # Create the api access object, and the inventory which keeps the VM list between updates
         self.api = vdc.VDCApiCall(api_url, apiKey, secret)
+        self.inventory = vdc_inventory.InventorySync(self.api)
+        # (the numbers of the VMs shown, and the number for the next VM which is added)
+        self.vmNumbers = {}
+        self.vmNextNumber = 1
 
         # INITIALISE THE GUI
         self.pack()
@@ -17,12 +17,8 @@
 # (2) Put this file and the file vdc_api_call.py in any location
 # (3) You can run this file using the command 'python widget-cpu-graphs.py&'
 
-import matplotlib
-matplotlib.use('TkAgg') 
-
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.figure as mplfig
-import matplotlib.pyplot as plt
+# (matplotlib is imported in Application.init_plot, after the window has appeared, because
+# it takes a few seconds to import)
 
 from Tkinter import *
 import vdc_api_call as vdc
@@ -122,17 +118,28 @@ class Application(Frame):
         # Create deque object to hold cpu data
         self.cpuData = deque([],self.plot_points)
 
+        # Show the window with a space for the plot, which is made once the window has appeared
+        self.plotFrame = Frame(self, width=900, height=400)
+        self.plotFrame.pack(side=TOP, fill=BOTH, expand=1)
+        self.pack()
+        self.createWidgets()
+        self.after_idle(self.init_plot)
+
+    def init_plot(self):
+        import matplotlib
+        matplotlib.use('TkAgg')
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        import matplotlib.figure as mplfig
+
         # Initialise the plot
         self.fig = mplfig.Figure(figsize=(9,4), dpi=100)
         self.a = self.fig.add_subplot(111)
         
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.plotFrame)
         self.plot_update()
 
         self.fig.canvas.draw()
         self.canvas.get_tk_widget().pack(side=TOP, fill=BOTH, expand=1)
-        self.pack()
-        self.createWidgets()
 
 root = Tk()
 root.title("VM CPU Load Graph widget")